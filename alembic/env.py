@@ -12,7 +12,8 @@ from backend_app.config import settings
 config.set_main_option("sqlalchemy.url", settings.database_url)
 
 
-if config.config_file_name:
+# из приложения (backend_app/migrate.py) логирование уже настроено — не трогаем его
+if config.config_file_name and config.attributes.get("connection") is None:
     fileConfig(config.config_file_name)
 
 target_metadata = Base.metadata
@@ -38,6 +39,18 @@ def run_migrations_offline():
 
 
 def run_migrations_online():
+    # приложение передаёт своё соединение (backend_app/migrate.py)
+    connection = config.attributes.get("connection")
+    if connection is not None:
+        context.configure(
+            connection=connection,
+            target_metadata=target_metadata,
+            compare_type=True,
+        )
+        with context.begin_transaction():
+            context.run_migrations()
+        return
+
     configuration = config.get_section(config.config_ini_section) or {}
     configuration["sqlalchemy.url"] = get_url()
 
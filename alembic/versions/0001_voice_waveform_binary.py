@@ -0,0 +1,72 @@
+"""voice_meta: binary uint8 waveform instead of JSON floats
+
+Revision ID: 0001_voice_waveform_binary
+Revises:
+Create Date: 2026-10-19 12:00:00
+
+"""
+
+import json
+
+from alembic import op
+import sqlalchemy as sa
+
+from backend_app.waveform import normalize_waveform
+
+revision = '0001_voice_waveform_binary'
+down_revision = None
+branch_labels = None
+depends_on = None
+
+BATCH = 500
+
+
+def upgrade() -> None:
+    bind = op.get_bind()
+    cols = {c["name"] for c in sa.inspect(bind).get_columns("voice_meta")}
+    # create_all на старте мог уже добавить колонку (новая БД)
+    if "waveform" not in cols:
+        op.add_column("voice_meta", sa.Column("waveform", sa.LargeBinary(), nullable=True))
+
+    vm = sa.table(
+        "voice_meta",
+        sa.column("id", sa.Integer),
+        sa.column("waveform", sa.LargeBinary),
+        sa.column("waveform_json", sa.Text),
+    )
+
+    last_id = 0
+    while True:
+        rows = bind.execute(
+            sa.select(vm.c.id, vm.c.waveform_json)
+            .where(vm.c.id > last_id, vm.c.waveform_json.isnot(None))
+            .order_by(vm.c.id)
+            .limit(BATCH)
+        ).fetchall()
+        if not rows:
+            break
+        for row_id, raw in rows:
+            bind.execute(
+                vm.update()
+                .where(vm.c.id == row_id)
+                .values(waveform=normalize_waveform(raw), waveform_json=None)
+            )
+        last_id = rows[-1][0]
+
+
+def downgrade() -> None:
+    # обратно в JSON (уже квантованные значения 0..1)
+    bind = op.get_bind()
+    vm = sa.table(
+        "voice_meta",
+        sa.column("id", sa.Integer),
+        sa.column("waveform", sa.LargeBinary),
+        sa.column("waveform_json", sa.Text),
+    )
+    rows = bind.execute(sa.select(vm.c.id, vm.c.waveform).where(vm.c.waveform.isnot(None))).fetchall()
+    for row_id, data in rows:
+        bars = [round(b / 255, 3) for b in bytes(data)]
+        bind.execute(vm.update().where(vm.c.id == row_id).values(waveform_json=json.dumps(bars)))
+
+    with op.batch_alter_table("voice_meta") as batch:
+        batch.drop_column("waveform")
@@ -0,0 +1,202 @@
+# backend_app/auth_cache.py
+"""
+Единый слой аутентификации по JWT.
+
+Раньше каждый запрос делал jwt.decode + db.get(User) (deps, auth.me,
+files._extract_user_id_from_token, ws). Теперь результат кэшируется:
+ключ — подпись токена, значение — claims и лёгкий снимок пользователя
+(Principal). Записи живут auth_cache_ttl_seconds, но не дольше exp токена.
+
+Кэш на процесс: после изменения профиля вызываем invalidate_user();
+другие воркеры увидят изменения не позже чем через ttl.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Any, Optional
+
+from fastapi import HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend_app import models
+from backend_app.config import settings
+from backend_app.security import decode_token
+
+
+@dataclass(frozen=True)
+class Principal:
+    """Снимок пользователя для роутов, которые его только читают."""
+
+    id: int
+    username: str
+    birth_year: Optional[int] = None
+    avatar_file_id: Optional[int] = None
+
+    @classmethod
+    def from_user(cls, u: models.User) -> "Principal":
+        return cls(
+            id=u.id,
+            username=u.username,
+            birth_year=u.birth_year,
+            avatar_file_id=u.avatar_file_id,
+        )
+
+
+@dataclass
+class _Entry:
+    token: str
+    claims: dict[str, Any]
+    principal: Principal
+    expires_at: float
+
+
+class PrincipalCache:
+    """LRU + TTL; индекс user_id -> ключи для точечной инвалидации."""
+
+    def __init__(self, maxsize: int, ttl: float):
+        self.maxsize = max(1, maxsize)
+        self.ttl = ttl
+        self._data: OrderedDict[str, _Entry] = OrderedDict()
+        self._by_user: dict[int, set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str, token: str) -> Optional[_Entry]:
+        now = time.time()
+        with self._lock:
+            e = self._data.get(key)
+            if e is None or e.token != token:
+                self.misses += 1
+                return None
+            if e.expires_at <= now:
+                self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return e
+
+    def put(self, key: str, entry: _Entry) -> None:
+        with self._lock:
+            self._drop(key)
+            self._data[key] = entry
+            self._by_user.setdefault(entry.principal.id, set()).add(key)
+            while len(self._data) > self.maxsize:
+                self._drop(next(iter(self._data)))
+
+    def invalidate_user(self, user_id: int) -> None:
+        with self._lock:
+            for key in list(self._by_user.get(user_id, ())):
+                self._drop(key)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+            self._by_user.clear()
+
+    def _drop(self, key: str) -> None:
+        e = self._data.pop(key, None)
+        if e is None:
+            return
+        keys = self._by_user.get(e.principal.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[e.principal.id]
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+principal_cache = PrincipalCache(
+    maxsize=settings.auth_cache_size,
+    ttl=settings.auth_cache_ttl_seconds,
+)
+
+
+def _user_id_from_claims(payload: Any) -> Optional[int]:
+    # decode_token может вернуть:
+    # - dict {"sub": "..."}
+    # - int (на всякий случай)
+    if isinstance(payload, int):
+        return payload
+    if isinstance(payload, dict):
+        sub = payload.get("sub")
+        if sub is None:
+            return None
+        try:
+            return int(sub)
+        except Exception:
+            return None
+    return None
+
+
+def _cached(token: str) -> tuple[str, Optional[Principal]]:
+    key = token.rsplit(".", 1)[-1]
+    e = principal_cache.get(key, token)
+    return key, (e.principal if e is not None else None)
+
+
+def _decode(token: str) -> tuple[Any, int]:
+    try:
+        claims = decode_token(token)
+    except Exception:
+        raise HTTPException(status_code=401, detail="Invalid token")
+
+    user_id = _user_id_from_claims(claims)
+    if not user_id:
+        raise HTTPException(status_code=401, detail="Invalid token")
+    return claims, user_id
+
+
+def _remember(key: str, token: str, claims: Any, u: Optional[models.User]) -> Principal:
+    if not u:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    principal = Principal.from_user(u)
+    if principal_cache.ttl > 0:
+        expires_at = time.time() + principal_cache.ttl
+        exp = claims.get("exp") if isinstance(claims, dict) else None
+        if isinstance(exp, (int, float)):
+            expires_at = min(expires_at, float(exp))
+        principal_cache.put(key, _Entry(token, claims if isinstance(claims, dict) else {}, principal, expires_at))
+    return principal
+
+
+def authenticate_token(db: Session, token: str) -> Principal:
+    """JWT -> Principal. На попадании в кэш нет ни decode, ни запроса в БД."""
+    key, principal = _cached(token)
+    if principal is not None:
+        return principal
+    claims, user_id = _decode(token)
+    return _remember(key, token, claims, db.get(models.User, user_id))
+
+
+async def authenticate_token_async(db: AsyncSession, token: str) -> Principal:
+    """То же для AsyncSession (async def роуты, WebSocket)."""
+    key, principal = _cached(token)
+    if principal is not None:
+        return principal
+    claims, user_id = _decode(token)
+    return _remember(key, token, claims, await db.get(models.User, user_id))
+
+
+def user_id_from_token(token: str) -> Optional[int]:
+    """Только id, без БД (кэш или подпись JWT); None — токен невалиден."""
+    _, principal = _cached(token)
+    if principal is not None:
+        return principal.id
+    try:
+        return _decode(token)[1]
+    except HTTPException:
+        return None
+
+
+def invalidate_user(user_id: int) -> None:
+    """Вызывать после изменения профиля (username/аватар/год рождения)."""
+    principal_cache.invalidate_user(user_id)
@@ -0,0 +1,114 @@
+# backend_app/chat_window.py
+"""
+Скользящее окно последних сообщений чата в памяти — контекст для ассистента.
+
+Окно ограничено assistant_max_messages / assistant_max_message_chars.
+chats.send дописывает сообщения сразу (record_message). При чтении
+(recent_messages) один индексный запрос догружает всё, что новее
+последнего известного id: так окно остаётся верным, даже если сообщение
+отправили через другой воркер. Число чатов в памяти ограничено (LRU).
+"""
+from __future__ import annotations
+
+from collections import OrderedDict, deque
+from dataclasses import dataclass, field
+from typing import Deque, NamedTuple
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from backend_app import models
+from backend_app.config import settings
+
+
+class WindowMsg(NamedTuple):
+    id: int
+    sender_id: int
+    text: str
+
+
+def _max_messages() -> int:
+    return max(0, int(getattr(settings, "assistant_max_messages", 12)))
+
+
+def _max_chars() -> int:
+    return max(0, int(getattr(settings, "assistant_max_message_chars", 600)))
+
+
+def _clip(s: str | None) -> str:
+    s = (s or "").strip()
+    n = _max_chars()
+    return s if len(s) <= n else s[:n]
+
+
+@dataclass
+class _Window:
+    # последний id, который мы видели (в т.ч. сообщения без текста)
+    last_id: int = 0
+    items: Deque[WindowMsg] = field(default_factory=lambda: deque(maxlen=_max_messages()))
+
+    def push(self, msg_id: int, sender_id: int, text: str | None) -> None:
+        if msg_id <= self.last_id:
+            return
+        self.last_id = msg_id
+        t = _clip(text)
+        if t:
+            self.items.append(WindowMsg(msg_id, sender_id, t))
+
+
+_windows: "OrderedDict[int, _Window]" = OrderedDict()
+
+
+def _window(chat_id: int) -> _Window:
+    w = _windows.get(chat_id)
+    if w is None:
+        w = _Window()
+        _windows[chat_id] = w
+        while len(_windows) > max(1, settings.chat_window_max_chats):
+            _windows.popitem(last=False)
+    else:
+        _windows.move_to_end(chat_id)
+    return w
+
+
+def record_message(chat_id: int, msg_id: int, sender_id: int, text: str | None) -> None:
+    """Вызывается из chats.send после commit."""
+    w = _windows.get(chat_id)
+    # окно, которого ещё нет, создадим при первом чтении (из БД целиком)
+    if w is not None:
+        w.push(msg_id, sender_id, text)
+
+
+async def recent_messages(db: AsyncSession, chat_id: int) -> list[WindowMsg]:
+    """Последние сообщения чата (старые -> новые), догружая из БД только новое."""
+    limit = _max_messages()
+    if limit <= 0:
+        return []
+
+    w = _window(chat_id)
+    since = w.last_id
+    rows = (
+        await db.execute(
+            select(models.Message.id, models.Message.sender_id, models.Message.text)
+            .where(models.Message.chat_id == chat_id, models.Message.id > since)
+            .order_by(models.Message.id.desc())
+            .limit(limit)
+        )
+    ).all()
+    if w.last_id != since:
+        # пока ждали БД, record_message уже дописал более новые — сливаем по id
+        merged = {m.id: m for m in w.items}
+        for r in rows:
+            t = _clip(r.text)
+            if t:
+                merged.setdefault(r.id, WindowMsg(r.id, r.sender_id, t))
+        w.items.clear()
+        w.items.extend(merged[k] for k in sorted(merged))
+        return list(w.items)
+    for r in reversed(rows):
+        w.push(r.id, r.sender_id, r.text)
+    return list(w.items)
+
+
+def forget_chat(chat_id: int) -> None:
+    _windows.pop(chat_id, None)
@@ -4,7 +4,7 @@ from pathlib import Path
 from typing import Any
 
 from pydantic_settings import BaseSettings, SettingsConfigDict
-from pydantic import field_validator
+from pydantic import AliasChoices, Field, field_validator
 
 BASE_DIR = Path(__file__).resolve().parent.parent
 
@@ -21,18 +21,191 @@ class Settings(BaseSettings):
     # =========================
     database_url: str = f"sqlite:///{BASE_DIR / 'mvp.db'}"
 
+    # =========================
+    # SQLITE PROFILE (db.py, sqlite_writer.py) — только если DATABASE_URL sqlite
+    # =========================
+    # False — как раньше: rollback journal и настройки sqlite по умолчанию
+    sqlite_tuning: bool = True
+    sqlite_wal: bool = True
+    # NORMAL в WAL: fsync только на checkpoint (после сбоя питания можно потерять последние коммиты, но не целостность)
+    sqlite_synchronous: str = "NORMAL"
+    sqlite_mmap_size_mb: int = 256
+    sqlite_cache_size_mb: int = 64
+    sqlite_busy_timeout_ms: int = 5000
+    # пул sync-соединений: не меньше потоков threadpool (40 у anyio) — иначе def-роуты
+    # ждут соединение, а его возврат (закрытие get_db) ждёт свободный поток
+    sqlite_pool_size: int = 40
+    # записи горячих путей (send/read/upload/outbox/rate limit) — через один поток-писатель,
+    # пачкой в одной транзакции (savepoint на каждую запись)
+    sqlite_single_writer: bool = True
+    sqlite_writer_batch_size: int = 64
+    # сколько писатель ждёт попутчиков, прежде чем коммитить неполную пачку
+    sqlite_writer_batch_wait_ms: float = 1.0
+
+    # =========================
+    # READ REPLICAS (db.py, db_routing.py)
+    # =========================
+    # env: DATABASE_REPLICA_URLS="postgres://...,postgres://..." (как DATABASE_URL); пусто — без реплик
+    database_replica_urls: str = Field(
+        default="",
+        validation_alias=AliasChoices("DATABASE_REPLICA_URLS", "database_replica_urls"),
+    )
+    # как часто проверять реплики (SELECT 1); упавшая выпадает из ротации до следующей удачной проверки
+    replica_health_interval_seconds: float = 5.0
+    # после записи (POST/PUT/PATCH/DELETE) пользователь столько секунд читает с primary —
+    # видит свои записи, даже если реплика отстаёт
+    replica_sticky_seconds: float = 5.0
+
+    # =========================
+    # SQL STATS (sql_stats.py): запросы/время в БД на каждый HTTP-запрос, N+1
+    # =========================
+    sql_stats_enabled: bool = True
+    # X-SQL-* и Server-Timing в ответах (с текстом SQL!) — только для локальной разработки
+    sql_stats_headers: bool = False
+    # одна форма запроса столько раз за запрос — вероятный N+1 (лог + счётчик)
+    sql_repeat_threshold: int = 5
+    # запросы, проведшие в БД дольше, — в лог; 0 — не логировать
+    sql_slow_request_ms: float = 500.0
+
     # =========================
     # JWT
     # =========================
     jwt_secret: str = "dev-secret-change-me"
     jwt_algorithm: str = "HS256"
     access_token_expire_minutes: int = 60 * 24 * 7
+    # кэш "токен -> пользователь" (см. auth_cache.py); 0 — выключить
+    auth_cache_ttl_seconds: int = 60
+    auth_cache_size: int = 10_000
+
+    # =========================
+    # PASSWORD HASHING
+    # =========================
+    # стоимость bcrypt; при изменении старые хэши пересчитываются при логине
+    bcrypt_rounds: int = 12
+    # bcrypt считается в отдельном пуле, чтобы не блокировать event loop
+    password_hash_workers: int = 2
+    # сколько хэширований может ждать в очереди; сверху — 503
+    password_hash_max_queue: int = 32
 
     # =========================
     # STORAGE
     # =========================
     storage_dir: str = str(BASE_DIR / "storage")
 
+    # =========================
+    # SIGNED MEDIA URLS
+    # =========================
+    # /files/{id}?exp=...&sig=<kid>.<mac> — проверяется одним HMAC, без JWT и без БД.
+    # Ссылка живёт от ttl до 2*ttl (exp выравнивается, чтобы URL был стабилен и кэшировался).
+    media_url_ttl_seconds: int = 60 * 60
+    # Ротация: "kid1:secret1,kid2:secret2" — первым ключом подписываем,
+    # остальными только проверяем. Пусто -> ключ выводится из jwt_secret.
+    media_url_keys: str | None = None
+
+    # =========================
+    # RESUMABLE UPLOADS
+    # =========================
+    # незавершённые сессии без активности дольше ttl удаляются фоновой задачей
+    upload_session_ttl_minutes: int = 24 * 60
+    upload_janitor_interval_seconds: int = 300
+
+    # =========================
+    # VOICE
+    # =========================
+    # сколько столбиков волны храним/отдаём (uint8 на столбик)
+    voice_waveform_bars: int = 64
+
+    # =========================
+    # FILE GC (осиротевшие файлы)
+    # =========================
+    file_gc_enabled: bool = True
+    file_gc_grace_hours: int = 24
+    file_gc_interval_seconds: int = 60 * 60
+    file_gc_batch_size: int = 200
+    file_gc_batch_pause_seconds: float = 1.0
+    file_gc_max_batches_per_run: int = 50
+
+    # =========================
+    # ASSISTANT UPSTREAM
+    # =========================
+    # env: OPENAI_API_KEY / OPENAI_MODEL / OPENAI_BASE_URL (как в .env.example)
+    openai_api_key: str = Field(default="", validation_alias=AliasChoices("OPENAI_API_KEY", "openai_api_key"))
+    openai_model: str = Field(default="", validation_alias=AliasChoices("OPENAI_MODEL", "openai_model"))
+    # для локального мока: OPENAI_BASE_URL=http://127.0.0.1:8901/v1
+    openai_base_url: str = Field(
+        default="https://api.openai.com/v1",
+        validation_alias=AliasChoices("OPENAI_BASE_URL", "openai_base_url"),
+    )
+
+    # один keep-alive клиент на процесс (backend_app/http_clients.py)
+    openai_http2: bool = True
+    openai_max_connections: int = 20
+    openai_max_keepalive_connections: int = 10
+    openai_keepalive_expiry_seconds: float = 60.0
+    openai_timeout_seconds: float = 25.0
+    openai_connect_timeout_seconds: float = 10.0
+    # кэш готовых подсказок по хэшу input (одинаковые chat/context/draft)
+    assistant_cache_ttl_seconds: float = 120.0
+    assistant_cache_size: int = 1000
+    # сколько чатов держим в памяти с окном последних сообщений (контекст ассистента)
+    chat_window_max_chats: int = 5000
+
+    # =========================
+    # USER SEARCH (backend_app/user_search.py)
+    # =========================
+    # кэш ответов /users/search на (пользователь, запрос); 0 — выключить
+    user_search_cache_ttl_seconds: float = 5.0
+    user_search_cache_size: int = 2000
+
+    # =========================
+    # RATE LIMITS (backend_app/ratelimit.py)
+    # =========================
+    rate_limit_enabled: bool = True
+    # "db" — общий для всех воркеров (таблица rate_limits), "memory" — на процесс
+    rate_limit_backend: str = "db"
+    # за Railway/прокси: брать IP из X-Forwarded-For. Левые записи пишет сам клиент —
+    # доверяем только тем, что дописали наши прокси: rate_limit_forwarded_hops-я справа
+    rate_limit_trust_forwarded_for: bool = False
+    # сколько доверенных прокси перед приложением (каждый дописывает адрес справа)
+    rate_limit_forwarded_hops: int = 1
+    # "N/second|minute|hour[;burst=M]"
+    rate_limit_login: str = "10/minute"
+    rate_limit_register: str = "5/minute"
+    rate_limit_upload: str = "30/minute"
+    rate_limit_send: str = "60/minute;burst=20"
+
+    # =========================
+    # WEB PUSH SENDER (backend_app/webpush_sender.py)
+    # =========================
+    # пул keep-alive соединений на каждый push-сервис (FCM, Mozilla, Apple …)
+    push_http2: bool = True
+    push_max_connections_per_origin: int = 20
+    push_keepalive_expiry_seconds: float = 60.0
+    push_timeout_seconds: float = 10.0
+    # сколько доставок одновременно в полёте на процесс
+    push_max_concurrency: int = 50
+    push_ttl_seconds: int = 60
+    # не слать push, если чат открыт в живой вкладке (WS + presence:subscribe)
+    push_skip_when_active: bool = True
+    # иначе ждём столько, вдруг прочитает (read receipt) — тогда push не нужен
+    push_grace_delay_ms: int = 3000
+    # склейка по (получатель, чат): после push'а следующий — не раньше чем через окно,
+    # и в нём всё накопленное одним уведомлением; 0 — только склейка внутри grace delay
+    push_coalesce_window_ms: int = 10000
+    # очередь push_outbox: ретраи с экспоненциальной задержкой, dead-letter после N попыток
+    push_outbox_enabled: bool = True
+    push_outbox_batch_size: int = 100
+    push_outbox_max_attempts: int = 6
+    push_outbox_backoff_base_seconds: float = 2.0
+    push_outbox_backoff_max_seconds: float = 300.0
+    push_outbox_poll_seconds: float = 5.0
+
+    # =========================
+    # ADMIN
+    # =========================
+    # через запятую: "alice,bob" — доступ к служебным эндпоинтам (GC, очереди)
+    admin_usernames: str = ""
+
     # =========================
     # VAPID (Web Push)
     # =========================
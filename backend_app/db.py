@@ -1,42 +1,151 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
 
+from backend_app.config import settings
+
 DATABASE_URL = os.getenv("DATABASE_URL")
 
 # fallback for local dev
 if not DATABASE_URL:
     DATABASE_URL = "sqlite:///./mvp.db"
 
-# Railway fix
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace(
-        "postgres://",
-        "postgresql+psycopg2://",
-        1
-    )
 
-if DATABASE_URL.startswith("postgresql://"):
-    DATABASE_URL = DATABASE_URL.replace(
-        "postgresql://",
-        "postgresql+psycopg2://",
-        1
-    )
+def _normalize_url(url: str) -> str:
+    # Railway fix
+    if url.startswith("postgres://"):
+        url = url.replace(
+            "postgres://",
+            "postgresql+psycopg2://",
+            1
+        )
+
+    if url.startswith("postgresql://"):
+        url = url.replace(
+            "postgresql://",
+            "postgresql+psycopg2://",
+            1
+        )
+    return url
+
+
+def _engine_kwargs(url: str) -> dict:
+    kwargs = {
+        "pool_pre_ping": True,
+    }
 
-engine_kwargs = {
-    "pool_pre_ping": True,
-}
+    if url.startswith("sqlite"):
+        kwargs["connect_args"] = {"check_same_thread": False}
+        if settings.sqlite_tuning:
+            # соединение SQLite дешёвое (см. sqlite_pool_size)
+            kwargs["pool_size"] = max(5, settings.sqlite_pool_size)
+            kwargs["max_overflow"] = 10
+    return kwargs
 
-if DATABASE_URL.startswith("sqlite"):
-    engine_kwargs["connect_args"] = {"check_same_thread": False}
+
+DATABASE_URL = _normalize_url(DATABASE_URL)
 
 engine = create_engine(
     DATABASE_URL,
-    **engine_kwargs
+    **_engine_kwargs(DATABASE_URL)
 )
 
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+
+
+# =========================
+# SQLite profile: WAL + pragmas на каждое новое соединение
+# (читатели не ждут писателя, писатель не делает fsync на каждый commit)
+# =========================
+def sqlite_pragmas() -> list[str]:
+    if not settings.sqlite_tuning:
+        return []
+    out = []
+    if settings.sqlite_wal:
+        out.append("PRAGMA journal_mode=WAL")
+    out += [
+        f"PRAGMA synchronous={settings.sqlite_synchronous.strip().upper() or 'NORMAL'}",
+        f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}",
+        f"PRAGMA mmap_size={int(settings.sqlite_mmap_size_mb) * 1024 * 1024}",
+        # отрицательное значение — в KiB, а не в страницах
+        f"PRAGMA cache_size={-int(settings.sqlite_cache_size_mb) * 1024}",
+        "PRAGMA temp_store=MEMORY",
+    ]
+    return out
+
+
+def apply_sqlite_pragmas(dbapi_connection, _record=None) -> None:
+    cur = dbapi_connection.cursor()
+    try:
+        for pragma in sqlite_pragmas():
+            cur.execute(pragma)
+    finally:
+        cur.close()
+
+
+if IS_SQLITE:
+    event.listen(engine, "connect", apply_sqlite_pragmas)
+
 SessionLocal = sessionmaker(
     autocommit=False,
     autoflush=False,
     bind=engine,
 )
+
+
+# =========================
+# Read replicas (DATABASE_REPLICA_URLS через запятую) — куда их отправлять,
+# решает db_routing.py; без них всё читается с primary
+# =========================
+REPLICA_URLS = [
+    _normalize_url(u.strip()) for u in (settings.database_replica_urls or "").split(",") if u.strip()
+]
+
+
+def _replica_engine(url: str):
+    kwargs = _engine_kwargs(url)
+    if url.startswith("postgresql"):
+        # лежащая реплика не должна подвешивать запрос на системный таймаут connect
+        kwargs["connect_args"] = {"connect_timeout": 3}
+    eng = create_engine(url, **kwargs)
+    if url.startswith("sqlite"):
+        event.listen(eng, "connect", apply_sqlite_pragmas)
+    return eng
+
+
+replica_engines = [_replica_engine(u) for u in REPLICA_URLS]
+
+
+# =========================
+# Async engine — для async def роутов и WebSocket'ов:
+# запрос ждёт БД, не блокируя event loop (sync engine остаётся для def-роутов,
+# create_all и фоновых задач в тредах)
+# =========================
+def _async_url(url: str) -> str:
+    if url.startswith("sqlite:"):
+        return "sqlite+aiosqlite:" + url[len("sqlite:"):]
+    if url.startswith("postgresql+psycopg2://"):
+        url = url.replace("postgresql+psycopg2://", "postgresql+asyncpg://", 1)
+        # asyncpg не знает sslmode (Railway его добавляет)
+        return url.replace("sslmode=", "ssl=")
+    return url
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL") or _async_url(DATABASE_URL)
+
+async_engine = create_async_engine(
+    ASYNC_DATABASE_URL,
+    pool_pre_ping=True,
+)
+
+if IS_SQLITE:
+    # aiosqlite-адаптер даёт sync cursor() внутри connect-события
+    event.listen(async_engine.sync_engine, "connect", apply_sqlite_pragmas)
+
+AsyncSessionLocal = async_sessionmaker(
+    bind=async_engine,
+    autoflush=False,
+    # после commit объекты остаются читаемыми без нового запроса (lazy load в async нельзя)
+    expire_on_commit=False,
+)
@@ -0,0 +1,263 @@
+# backend_app/db_routing.py
+"""
+Чтение с read-реплик (DATABASE_REPLICA_URLS).
+
+GET-роуты, которые только читают (история, список диалогов, поиск, /auth/me,
+скачивание файлов), берут сессию через get_read_db: она читает с реплики —
+по кругу среди живых — и не конкурирует с записями на primary. Всё остальное
+по-прежнему идёт через get_db / get_async_db на primary.
+
+- Здоровье: replica_health_loop (стартует в main.py) раз в
+  replica_health_interval_seconds делает SELECT 1; обрыв соединения во время
+  запроса тоже выкидывает реплику из ротации. Живых нет — читаем с primary.
+- Read-your-writes: после любого небезопасного запроса (POST/PUT/PATCH/DELETE)
+  StickyWritesMiddleware на replica_sticky_seconds отправляет чтения этого
+  пользователя на primary. Окно помнит процесс и — для остальных воркеров —
+  сам клиент: подписанная cookie rw_until (user_id, срок, HMAC).
+- Чужие свежие записи реплика может ещё не видеть: там, где "не найдено"
+  было бы ошибкой (только что созданный чат, только что загруженный файл),
+  роут повторяет чтение на primary через use_primary(db).
+- Если GET-роут всё же пишет, запись (и всё после неё) уходит на primary.
+
+Без реплик get_read_db — обычная сессия primary, middleware не ставится.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import hashlib
+import hmac
+import itertools
+import logging
+import math
+import threading
+import time
+from typing import Generator, Optional
+
+from fastapi import Header, Request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.sql.dml import UpdateBase
+
+from backend_app.auth_cache import user_id_from_token
+from backend_app.config import settings
+from backend_app.db import engine, replica_engines
+from backend_app.deps import extract_token
+
+log = logging.getLogger("db_routing")
+
+SAFE_METHODS = frozenset({"GET", "HEAD", "OPTIONS"})
+
+REPLICA_STATS = {
+    "replica_sessions": 0,
+    "primary_sticky": 0,
+    "primary_no_replica": 0,
+    "primary_retries": 0,
+    "marked_down": 0,
+}
+
+
+class ReplicaSet:
+    """Реплики и их состояние; pick() — round-robin по живым."""
+
+    def __init__(self, engines: list[Engine]):
+        self.engines = list(engines)
+        self.healthy = [True] * len(self.engines)
+        self._rr = itertools.count()
+        for eng in self.engines:
+            event.listen(eng, "handle_error", self._on_error)
+
+    def __bool__(self) -> bool:
+        return bool(self.engines)
+
+    def pick(self) -> Optional[Engine]:
+        up = [e for e, ok in zip(self.engines, self.healthy) if ok]
+        if not up:
+            return None
+        return up[next(self._rr) % len(up)]
+
+    def mark(self, eng: Engine, ok: bool) -> None:
+        i = self.engines.index(eng)
+        if self.healthy[i] != ok:
+            self.healthy[i] = ok
+            if not ok:
+                REPLICA_STATS["marked_down"] += 1
+            log.warning("replica %s is %s", eng.url.render_as_string(hide_password=True), "up" if ok else "DOWN")
+
+    def check(self) -> None:
+        """SELECT 1 на каждой реплике (sync — звать в потоке)."""
+        for eng in self.engines:
+            try:
+                with eng.connect() as conn:
+                    conn.exec_driver_sql("SELECT 1")
+            except Exception:
+                self.mark(eng, False)
+            else:
+                self.mark(eng, True)
+
+    def _on_error(self, ctx) -> None:
+        if ctx.is_disconnect and ctx.engine in self.engines:
+            self.mark(ctx.engine, False)
+
+
+replicas = ReplicaSet(replica_engines)
+
+
+# =========================
+# Read-your-writes: user_id -> до какого момента читаем с primary
+# =========================
+_sticky_until: dict[int, float] = {}
+_sticky_lock = threading.Lock()
+
+
+def mark_write(user_id: int) -> None:
+    now = time.monotonic()
+    with _sticky_lock:
+        _sticky_until[user_id] = now + settings.replica_sticky_seconds
+        if len(_sticky_until) > 10_000:
+            for uid in [u for u, t in _sticky_until.items() if t <= now]:
+                del _sticky_until[uid]
+
+
+def is_sticky(user_id: int) -> bool:
+    return _sticky_until.get(user_id, 0.0) > time.monotonic()
+
+
+# следующий GET может попасть на другой воркер: окно носит с собой клиент
+STICKY_COOKIE = "rw_until"
+
+
+def _sticky_mac(user_id: int, until: int) -> str:
+    key = hmac.new(settings.jwt_secret.encode("utf-8"), b"sticky-writes", hashlib.sha256).digest()
+    mac = hmac.new(key, f"{int(user_id)}.{int(until)}".encode("ascii"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(mac[:18]).rstrip(b"=").decode("ascii")
+
+
+def sticky_cookie(user_id: int, secure: bool = False) -> bytes:
+    """Значение Set-Cookie: rw_until=<user_id>.<until_ms>.<mac>."""
+    until = int((time.time() + settings.replica_sticky_seconds) * 1000)
+    value = f"{int(user_id)}.{until}.{_sticky_mac(user_id, until)}"
+    max_age = max(1, math.ceil(settings.replica_sticky_seconds))
+    cookie = f"{STICKY_COOKIE}={value}; Max-Age={max_age}; Path=/; HttpOnly; SameSite=Lax"
+    return (cookie + ("; Secure" if secure else "")).encode("latin-1")
+
+
+def is_sticky_cookie(value: Optional[str], user_id: int) -> bool:
+    uid, _, rest = (value or "").partition(".")
+    until, _, mac = rest.partition(".")
+    if not (uid.isdigit() and until.isdigit() and mac) or int(uid) != user_id:
+        return False
+    if int(until) <= time.time() * 1000:
+        return False
+    return hmac.compare_digest(mac, _sticky_mac(user_id, int(until)))
+
+
+class StickyWritesMiddleware:
+    """ASGI: после небезопасного запроса пользователя его чтения какое-то время идут на primary."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope["method"] in SAFE_METHODS:
+            return await self.app(scope, receive, send)
+
+        request = Request(scope)
+        token = extract_token(request, request.headers.get("authorization"))
+        user_id = user_id_from_token(token) if token else None
+        if user_id is None:
+            return await self.app(scope, receive, send)
+
+        secure = scope.get("scheme") == "https"
+
+        async def send_marked(message):
+            # окно отсчитываем от момента, когда клиент узнаёт о записи
+            if message["type"] == "http.response.start":
+                mark_write(user_id)
+                headers = list(message.get("headers", []))
+                headers.append((b"set-cookie", sticky_cookie(user_id, secure)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_marked)
+        finally:
+            mark_write(user_id)
+
+
+# =========================
+# Сессия для чтения
+# =========================
+class RoutingSession(Session):
+    """Читает с replica (если задана); первая же запись переключает сессию на primary."""
+
+    def __init__(self, *args, replica: Optional[Engine] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.replica = replica
+
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if self.replica is not None:
+            if not (self._flushing or isinstance(clause, UpdateBase)):
+                return self.replica
+            self.replica = None
+        return super().get_bind(mapper=mapper, clause=clause, **kwargs)
+
+
+ReadSessionLocal = sessionmaker(
+    class_=RoutingSession,
+    autocommit=False,
+    autoflush=False,
+    bind=engine,
+)
+
+
+def use_primary(db: Session) -> bool:
+    """
+    Сессия читала с реплики — переключает её на primary и возвращает True
+    (повторить чтение: реплика могла ещё не получить запись). False — уже primary.
+    """
+    if getattr(db, "replica", None) is None:
+        return False
+    db.rollback()  # отпускаем соединение реплики
+    db.replica = None
+    REPLICA_STATS["primary_retries"] += 1
+    return True
+
+
+def _replica_for(request: Request, authorization: Optional[str]) -> Optional[Engine]:
+    if not replicas or request.method not in SAFE_METHODS:
+        return None
+    token = extract_token(request, authorization)
+    user_id = user_id_from_token(token) if token else None
+    if user_id is not None and (
+        is_sticky(user_id) or is_sticky_cookie(request.cookies.get(STICKY_COOKIE), user_id)
+    ):
+        REPLICA_STATS["primary_sticky"] += 1
+        return None
+    eng = replicas.pick()
+    REPLICA_STATS["replica_sessions" if eng is not None else "primary_no_replica"] += 1
+    return eng
+
+
+def get_read_db(
+    request: Request,
+    authorization: Optional[str] = Header(default=None),
+) -> Generator[Session, None, None]:
+    """Для GET-роутов, которые только читают: сессия на реплике (или на primary, см. модуль)."""
+    db = ReadSessionLocal(replica=_replica_for(request, authorization))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def replica_health_loop() -> None:
+    """Фоновая задача (стартует в main.py, если есть реплики)."""
+    interval = max(0.5, float(settings.replica_health_interval_seconds))
+    while True:
+        try:
+            await asyncio.to_thread(replicas.check)
+        except Exception:
+            log.exception("replica health check failed")
+        await asyncio.sleep(interval)
@@ -1,11 +1,13 @@
-from typing import Generator, Optional, Any
+from typing import AsyncGenerator, Generator, Optional
 
 from fastapi import Depends, HTTPException, Header, Request
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from backend_app.db import SessionLocal
+from backend_app.config import settings
+from backend_app.db import AsyncSessionLocal, SessionLocal
 from backend_app import models
-from backend_app.security import decode_token
+from backend_app.auth_cache import Principal, authenticate_token
 
 
 def get_db() -> Generator[Session, None, None]:
@@ -16,6 +18,12 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """Для async def роутов: запросы не блокируют event loop."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
 def extract_token(request: Request, authorization: Optional[str]) -> Optional[str]:
     """
     1) Standard: Authorization: Bearer <token>
@@ -33,43 +41,31 @@ def extract_token(request: Request, authorization: Optional[str]) -> Optional[st
     return None
 
 
-def _user_id_from_payload(payload: Any) -> Optional[int]:
-    # decode_token может вернуть:
-    # - dict {"sub": "..."}
-    # - int (на всякий случай)
-    if isinstance(payload, int):
-        return payload
-    if isinstance(payload, dict):
-        sub = payload.get("sub")
-        if sub is None:
-            return None
-        try:
-            return int(sub)
-        except Exception:
-            return None
-    return None
-
-
-def get_current_user(
+def get_principal(
     request: Request,
     db: Session = Depends(get_db),
     authorization: Optional[str] = Header(default=None),
-) -> models.User:
+) -> Principal:
+    """Кто делает запрос (снимок из кэша). Для роутов, которые пользователя не меняют."""
     token = extract_token(request, authorization)
     if not token:
         raise HTTPException(status_code=401, detail="Not authenticated")
+    return authenticate_token(db, token)
 
-    try:
-        payload = decode_token(token)
-    except Exception:
-        raise HTTPException(status_code=401, detail="Invalid token")
-
-    user_id = _user_id_from_payload(payload)
-    if not user_id:
-        raise HTTPException(status_code=401, detail="Invalid token")
 
-    user = db.get(models.User, user_id)
+def get_current_user(
+    principal: Principal = Depends(get_principal),
+    db: Session = Depends(get_db),
+) -> models.User:
+    """Полный ORM User — только там, где его изменяют (не забыть invalidate_user)."""
+    user = db.get(models.User, principal.id)
     if not user:
         raise HTTPException(status_code=401, detail="User not found")
-
     return user
+
+
+def get_admin_user(principal: Principal = Depends(get_principal)) -> Principal:
+    admins = {x.strip() for x in (settings.admin_usernames or "").split(",") if x.strip()}
+    if principal.username not in admins:
+        raise HTTPException(status_code=403, detail="Admin only")
+    return principal
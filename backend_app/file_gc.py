@@ -0,0 +1,170 @@
+# backend_app/file_gc.py
+"""
+Сборщик мусора для таблицы files.
+
+Файл считается осиротевшим, если он старше grace-периода и на него не ссылается
+ни users.avatar_file_id, ни message_attachments. Строка voice_meta — это метаданные
+самого файла, а не ссылка на него: она удаляется вместе с файлом.
+
+Удаляем ограниченными батчами с паузой между ними, чтобы не держать долгих
+транзакций и не грузить БД. Условие «сирота» повторяется прямо в DELETE —
+если файл успели прикрепить между SELECT и DELETE, он не удалится.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from datetime import datetime, timedelta
+from typing import Any
+
+from sqlalchemy import and_, exists, func, select
+from sqlalchemy.orm import Session
+
+from backend_app import models
+from backend_app.config import settings
+from backend_app.db import SessionLocal
+
+log = logging.getLogger("file_gc")
+
+# метрики процесса (отдаются через /files/gc/stats)
+GC_STATS: dict[str, Any] = {
+    "runs": 0,
+    "files_deleted": 0,
+    "bytes_reclaimed": 0,
+    "errors": 0,
+    "last_run_at": None,
+    "last_run_deleted": 0,
+    "last_run_bytes": 0,
+    "last_run_ms": 0,
+}
+
+
+def _cutoff() -> datetime:
+    return datetime.utcnow() - timedelta(hours=max(0, int(settings.file_gc_grace_hours)))
+
+
+def _orphan_clause(cutoff: datetime):
+    return and_(
+        models.File.created_at < cutoff,
+        ~exists().where(models.User.avatar_file_id == models.File.id),
+        ~exists().where(models.MessageAttachment.file_id == models.File.id),
+    )
+
+
+def dry_run_report(db: Session, sample: int = 20) -> dict[str, Any]:
+    """Сколько файлов/байт удалил бы GC прямо сейчас (ничего не удаляет)."""
+    cutoff = _cutoff()
+    count, total = (
+        db.query(func.count(models.File.id), func.coalesce(func.sum(models.File.size), 0))
+        .filter(_orphan_clause(cutoff))
+        .one()
+    )
+    rows = (
+        db.query(models.File.id, models.File.owner_id, models.File.mime, models.File.size, models.File.created_at)
+        .filter(_orphan_clause(cutoff))
+        .order_by(models.File.id.asc())
+        .limit(max(0, sample))
+        .all()
+    )
+    return {
+        "dry_run": True,
+        "cutoff": cutoff.isoformat(),
+        "orphaned_files": int(count or 0),
+        "orphaned_bytes": int(total or 0),
+        "sample": [
+            {
+                "id": r.id,
+                "owner_id": r.owner_id,
+                "mime": r.mime,
+                "size": r.size,
+                "created_at": r.created_at.isoformat(),
+            }
+            for r in rows
+        ],
+    }
+
+
+def delete_batch(db: Session, cutoff: datetime, batch_size: int) -> tuple[int, int]:
+    """Удаляет один батч сирот. Возвращает (files, bytes)."""
+    candidates = (
+        db.query(models.File.id, models.File.size)
+        .filter(_orphan_clause(cutoff))
+        .order_by(models.File.id.asc())
+        .limit(batch_size)
+        .all()
+    )
+    if not candidates:
+        return 0, 0
+
+    ids = [r.id for r in candidates]
+    still_orphan = select(models.File.id).where(models.File.id.in_(ids), _orphan_clause(cutoff))
+
+    # байты считаем по тем, кто реально удалится (в той же транзакции)
+    reclaimed = (
+        db.query(func.coalesce(func.sum(models.File.size), 0))
+        .filter(models.File.id.in_(still_orphan))
+        .scalar()
+    ) or 0
+
+    db.query(models.VoiceMeta).filter(models.VoiceMeta.file_id.in_(still_orphan)).delete(synchronize_session=False)
+    deleted = (
+        db.query(models.File)
+        .filter(models.File.id.in_(ids), _orphan_clause(cutoff))
+        .delete(synchronize_session=False)
+    )
+    db.commit()
+    return int(deleted or 0), int(reclaimed)
+
+
+def _record_run(files: int, total: int, started: float) -> None:
+    GC_STATS["runs"] += 1
+    GC_STATS["files_deleted"] += files
+    GC_STATS["bytes_reclaimed"] += total
+    GC_STATS["last_run_at"] = datetime.utcnow().isoformat()
+    GC_STATS["last_run_deleted"] = files
+    GC_STATS["last_run_bytes"] = total
+    GC_STATS["last_run_ms"] = int((time.perf_counter() - started) * 1000)
+
+
+def _delete_batch_once(cutoff: datetime, batch_size: int) -> tuple[int, int]:
+    db = SessionLocal()
+    try:
+        return delete_batch(db, cutoff, batch_size)
+    finally:
+        db.close()
+
+
+async def run_gc_pass() -> dict[str, Any]:
+    """Батчи выполняются в треде, между ними — пауза (rate limit)."""
+    started = time.perf_counter()
+    cutoff = _cutoff()
+    batch_size = max(1, int(settings.file_gc_batch_size))
+    pause = max(0.0, float(settings.file_gc_batch_pause_seconds))
+    files = total = 0
+
+    for i in range(max(1, int(settings.file_gc_max_batches_per_run))):
+        if i:
+            await asyncio.sleep(pause)
+        n, b = await asyncio.to_thread(_delete_batch_once, cutoff, batch_size)
+        files += n
+        total += b
+        if n < batch_size:
+            break
+
+    _record_run(files, total, started)
+    if files:
+        log.info("file gc: deleted %d files, reclaimed %d bytes", files, total)
+    return {"files_deleted": files, "bytes_reclaimed": total}
+
+
+async def file_gc_loop() -> None:
+    """Фоновая задача (стартует в main.py)."""
+    interval = max(60, int(settings.file_gc_interval_seconds))
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await run_gc_pass()
+        except Exception:
+            GC_STATS["errors"] += 1
+            log.exception("file gc failed")
@@ -229,8 +229,6 @@ let assistantLastSuggestion = "";
 const ASSISTANT_DEBOUNCE_MS = 1200;
 const ASSISTANT_MIN_INTERVAL_MS = 1200;
 const ASSISTANT_MAX_DRAFT_CHARS = 1200;
-const ASSISTANT_MAX_CONTEXT_MESSAGES = 14;
-const ASSISTANT_MAX_MSG_CHARS = 800;
 
 // =========================
 // Dialogs (Telegram-like) state
@@ -428,7 +426,10 @@ function fileUrl(pathOrUrl, v = null) {
   const sep1 = pathOrUrl.includes("?") ? "&" : "?";
   let out = API + pathOrUrl;
 
-  if (FILES_AUTH_MODE === "query_token" && token) out += `${sep1}token=${encodeURIComponent(token)}`;
+  // signed URLs (?exp=&sig=) from the API don't need the JWT; once exp passes
+  // attachments get a fresh signature via resignOnError()
+  const signed = /[?&]sig=/.test(pathOrUrl);
+  if (FILES_AUTH_MODE === "query_token" && token && !signed) out += `${sep1}token=${encodeURIComponent(token)}`;
 
   if (v !== null && v !== undefined && v !== "") {
     const sep2 = out.includes("?") ? "&" : "?";
@@ -438,6 +439,56 @@ function fileUrl(pathOrUrl, v = null) {
   return out;
 }
 
+/* signed links expire (a tab left open for hours): re-sign them in one /files/meta call */
+const _resignWaiters = new Map(); // file id -> [resolve]
+let _resignTimer = null;
+
+function _signedExpired(url) {
+  const m = /[?&]exp=(\d+)/.exec(url || "");
+  return !!m && Number(m[1]) * 1000 <= Date.now();
+}
+
+async function _flushResign() {
+  _resignTimer = null;
+  const batch = new Map(_resignWaiters);
+  _resignWaiters.clear();
+
+  const urls = {};
+  try {
+    const r = await fetch(API + "/files/meta", {
+      method: "POST",
+      headers: authHeadersJson(),
+      body: JSON.stringify({ ids: [...batch.keys()] }),
+    });
+    if (r.ok) {
+      const j = await r.json();
+      for (const it of j.items || []) urls[it.id] = it.url;
+    }
+  } catch (_) {}
+
+  for (const [id, waiters] of batch) for (const done of waiters) done(urls[id] || null);
+}
+
+function freshFileUrl(fileId) {
+  const id = Number(fileId);
+  if (!id) return Promise.resolve(null);
+  return new Promise((resolve) => {
+    if (!_resignWaiters.has(id)) _resignWaiters.set(id, []);
+    _resignWaiters.get(id).push(resolve);
+    if (!_resignTimer) _resignTimer = setTimeout(_flushResign, 50);
+  });
+}
+
+function resignOnError(el, fileId) {
+  let tried = false; // one retry per element: a fresh link that still fails is a real error
+  el.addEventListener("error", async () => {
+    if (tried || !_signedExpired(el.src)) return;
+    tried = true;
+    const fresh = await freshFileUrl(fileId);
+    if (fresh) el.src = fileUrl(fresh, fileId);
+  });
+}
+
 function ensureAvatarPath(uobj) {
   if (!uobj) return null;
   if (uobj.avatar_url) return uobj.avatar_url;
@@ -983,33 +1034,6 @@ function assistantCancelInFlight() {
   assistantBusy = false;
 }
 
-function assistantCollectContext() {
-  if (!msgs) return [];
-
-  const nodes = Array.from(msgs.querySelectorAll(".msg[data-message-id]"));
-  if (!nodes.length) return [];
-
-  const slice = nodes.slice(Math.max(0, nodes.length - ASSISTANT_MAX_CONTEXT_MESSAGES));
-
-  const out = [];
-  for (const n of slice) {
-    const senderIdStr = n.getAttribute("data-sender-id") || n.dataset.senderId || "";
-    const senderId = parseInt(senderIdStr || "0", 10);
-
-    let sender = "other";
-    if (me && senderId && senderId === me.id) sender = "me";
-
-    const tNode = n.querySelector(".msgText");
-    const t = tNode ? tNode.textContent || "" : "";
-    const clipped = _clip(t.trim(), ASSISTANT_MAX_MSG_CHARS);
-    if (!clipped) continue;
-
-    out.push({ sender, text: clipped });
-  }
-
-  return out;
-}
-
 async function assistantRequestSuggestion(reason = "idle") {
   if (!assistantEnabled) return;
   if (!token || !me) return;
@@ -1029,32 +1053,67 @@ async function assistantRequestSuggestion(reason = "idle") {
   assistantLastAtMs = now;
   assistantLastSentDraft = draft;
 
-  const context = assistantCollectContext();
-
   assistantAbortCtrl = new AbortController();
   const ctrl = assistantAbortCtrl;
 
   try {
-    const r = await fetch(API + "/assistant/suggest", {
+    // streaming: tokens arrive as SSE (event: delta / done / error);
+    // aborting ctrl closes the connection and the server cancels upstream
+    const r = await fetch(API + "/assistant/suggest/stream", {
       method: "POST",
       headers: authHeadersJson(),
       body: JSON.stringify({
         chat_id: currentChatId,
         reason,
         draft,
-        messages: context,
+        // context is assembled server-side from the chat history
       }),
       signal: ctrl.signal,
     });
 
-    if (!r.ok) {
+    if (!r.ok || !r.body) {
       assistantBusy = false;
       return;
     }
 
-    const j = await r.json();
-    const sug = j && j.suggestion ? String(j.suggestion).trim() : "";
+    const reader = r.body.getReader();
+    const dec = new TextDecoder();
+    let buf = "";
+    let partial = "";
+    let sug = "";
+
+    while (true) {
+      const { value, done } = await reader.read();
+      if (done) break;
+      buf += dec.decode(value, { stream: true });
+
+      let sep;
+      while ((sep = buf.indexOf("\n\n")) >= 0) {
+        const block = buf.slice(0, sep);
+        buf = buf.slice(sep + 2);
+
+        let ev = "message";
+        let data = "";
+        for (const line of block.split("\n")) {
+          if (line.startsWith("event:")) ev = line.slice(6).trim();
+          else if (line.startsWith("data:")) data += line.slice(5).trim();
+        }
+        const j = _safeJsonParse(data) || {};
+
+        if (ev === "delta" && j.delta) {
+          partial += String(j.delta);
+          assistantShowBubble(partial.trim());
+        } else if (ev === "done") {
+          sug = j.suggestion ? String(j.suggestion).trim() : partial.trim();
+        } else if (ev === "error") {
+          partial = "";
+        }
+      }
+    }
+
+    if (!sug) sug = partial.trim();
     if (!sug) {
+      assistantHideBubble();
       assistantBusy = false;
       return;
     }
@@ -1297,6 +1356,22 @@ function _safeJsonParse(s) {
   try { return JSON.parse(s); } catch (_) { return null; }
 }
 
+// server sends waveform as base64 of uint8 bars (0..255); old payloads were JSON arrays
+function _decodeWaveform(s) {
+  if (!s) return [];
+  if (Array.isArray(s)) return s;
+  const str = String(s);
+  if (str.startsWith("[")) return _safeJsonParse(str) || [];
+  try {
+    const bin = atob(str);
+    const out = new Array(bin.length);
+    for (let i = 0; i < bin.length; i++) out[i] = bin.charCodeAt(i) / 255;
+    return out;
+  } catch (_) {
+    return [];
+  }
+}
+
 function _drawWave(canvas, bars, progress01 = 0) {
   if (!canvas) return;
   const ctx = canvas.getContext("2d");
@@ -3330,7 +3405,7 @@ function applyGroupingTail() {
 
 function _makeVoiceNode(att) {
   const url = fileUrl(att.url, att.id || "");
-  const bars = _safeJsonParse(att.waveform) || [];
+  const bars = _decodeWaveform(att.waveform);
 
   const wrap = mk("div", { class: "voiceBubble" });
 
@@ -3349,6 +3424,7 @@ function _makeVoiceNode(att) {
 
   let audio = new Audio();
   audio.preload = "metadata";
+  resignOnError(audio, att.id);
   audio.src = url;
   let rate = 1.0;
 
@@ -3418,6 +3494,7 @@ function renderAttachmentsNode(atts) {
     if (a.mime && a.mime.startsWith("image/")) {
       const wrap = mk("div");
       const img = mk("img", { src: url, alt: a.name || "image", loading: "lazy", decoding: "async" });
+      resignOnError(img, a.id);
       img.addEventListener("load", () => {
         if (isNearBottom() && msgs) msgs.scrollTop = msgs.scrollHeight;
       });
@@ -3429,6 +3506,7 @@ function renderAttachmentsNode(atts) {
     if (a.mime && a.mime.startsWith("video/")) {
       const wrap = mk("div");
       const v = mk("video", { src: url, controls: "true", preload: "metadata" });
+      resignOnError(v, a.id);
       wrap.appendChild(v);
       box.appendChild(wrap);
       continue;
@@ -3436,6 +3514,14 @@ function renderAttachmentsNode(atts) {
 
     const linkWrap = mk("div", { style: "margin-top:8px" });
     const link = mk("a", { href: url, target: "_blank", rel: "noopener" }, [`📎 ${a.name || "file"}`]);
+    link.addEventListener("click", async (e) => {
+      if (!_signedExpired(link.href)) return;
+      e.preventDefault();
+      const fresh = await freshFileUrl(a.id);
+      if (!fresh) return;
+      link.href = fileUrl(fresh, a.id || "");
+      window.open(link.href, "_blank", "noopener");
+    });
     linkWrap.appendChild(link);
     box.appendChild(linkWrap);
   }
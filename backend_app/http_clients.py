@@ -0,0 +1,155 @@
+# backend_app/http_clients.py
+"""
+Долгоживущие httpx.AsyncClient на всё время жизни приложения.
+
+Один клиент = один пул keep-alive соединений (и HTTP/2, если есть пакет h2),
+поэтому TCP+TLS handshake к апстриму делается один раз, а не на каждый запрос.
+Клиенты создаются лениво через get_client(name, factory) и закрываются
+в main.py на shutdown (close_all).
+
+RequestTimer/LatencyStats — замеры connect / TTFB / total через trace-хуки httpcore.
+"""
+from __future__ import annotations
+
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Deque, Optional
+
+import httpx
+
+log = logging.getLogger("http_clients")
+
+_clients: dict[str, httpx.AsyncClient] = {}
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def get_client(name: str, factory: Callable[[], httpx.AsyncClient]) -> httpx.AsyncClient:
+    c = _clients.get(name)
+    if c is None or c.is_closed:
+        c = factory()
+        _clients[name] = c
+    return c
+
+
+async def close_all() -> None:
+    clients = list(_clients.values())
+    _clients.clear()
+    for c in clients:
+        try:
+            await c.aclose()
+        except Exception:
+            log.exception("http client close failed")
+
+
+# -------------------------
+# Latency instrumentation
+# -------------------------
+class RequestTimer:
+    """
+    Передаётся в extensions={"trace": timer.trace}.
+    connect_ms == None — соединение взяли из пула (переиспользовали).
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self._connect_started: Optional[float] = None
+        self.connect_ms: Optional[float] = None
+        self.ttfb_ms: Optional[float] = None
+        self.total_ms: Optional[float] = None
+
+    async def trace(self, event: str, info: dict[str, Any]) -> None:
+        now = time.perf_counter()
+        if event.endswith("connect_tcp.started"):
+            self._connect_started = now
+        elif event.endswith(("connect_tcp.complete", "start_tls.complete")):
+            if self._connect_started is not None:
+                self.connect_ms = (now - self._connect_started) * 1000
+        elif event.endswith("receive_response_headers.complete") and self.ttfb_ms is None:
+            self.ttfb_ms = (now - self.started) * 1000
+
+    def finish(self) -> None:
+        self.total_ms = (time.perf_counter() - self.started) * 1000
+
+
+class LatencyStats:
+    """Последние N замеров + счётчики; snapshot() — для debug-эндпоинтов и бенчей."""
+
+    def __init__(self, window: int = 500):
+        self.count = 0
+        self.errors = 0
+        self.new_connections = 0
+        self._connect: Deque[float] = deque(maxlen=window)
+        self._ttfb: Deque[float] = deque(maxlen=window)
+        self._total: Deque[float] = deque(maxlen=window)
+        self._window = window
+        # произвольные именованные метрики (например ttft для стриминга)
+        self._extra: dict[str, Deque[float]] = {}
+
+    def record(self, t: RequestTimer, ok: bool = True) -> None:
+        self.count += 1
+        if not ok:
+            self.errors += 1
+        if t.connect_ms is not None:
+            self.new_connections += 1
+            self._connect.append(t.connect_ms)
+        if t.ttfb_ms is not None:
+            self._ttfb.append(t.ttfb_ms)
+        if t.total_ms is not None:
+            self._total.append(t.total_ms)
+
+    def observe(self, name: str, ms: float) -> None:
+        self._extra.setdefault(name, deque(maxlen=self._window)).append(ms)
+
+    @staticmethod
+    def _pct(xs: Deque[float], p: float) -> Optional[float]:
+        if not xs:
+            return None
+        s = sorted(xs)
+        return round(s[min(len(s) - 1, int(p / 100 * (len(s) - 1) + 0.5))], 2)
+
+    def snapshot(self) -> dict[str, Any]:
+        return {
+            "requests": self.count,
+            "errors": self.errors,
+            "new_connections": self.new_connections,
+            "connect_ms_p50": self._pct(self._connect, 50),
+            "ttfb_ms_p50": self._pct(self._ttfb, 50),
+            "ttfb_ms_p99": self._pct(self._ttfb, 99),
+            "total_ms_p50": self._pct(self._total, 50),
+            "total_ms_p99": self._pct(self._total, 99),
+            **{
+                f"{name}_ms_{p}": self._pct(xs, q)
+                for name, xs in self._extra.items()
+                for p, q in (("p50", 50), ("p99", 99))
+            },
+        }
+
+
+async def timed_request(
+    client: httpx.AsyncClient,
+    method: str,
+    url: str,
+    stats: Optional[LatencyStats] = None,
+    **kwargs: Any,
+) -> httpx.Response:
+    """client.request(...) + замер connect/TTFB/total в stats."""
+    timer = RequestTimer()
+    ext = dict(kwargs.pop("extensions", None) or {})
+    ext["trace"] = timer.trace
+    ok = False
+    try:
+        r = await client.request(method, url, extensions=ext, **kwargs)
+        ok = r.status_code < 500
+        return r
+    finally:
+        timer.finish()
+        if stats is not None:
+            stats.record(timer, ok=ok)
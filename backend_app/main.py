@@ -1,11 +1,23 @@
+import asyncio
+import contextlib
 from pathlib import Path
 
-from fastapi import FastAPI
+from fastapi import Depends, FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import FileResponse, HTMLResponse
 from fastapi.staticfiles import StaticFiles
 
+from backend_app.config import settings
+from backend_app import http_clients, push_notify
 from backend_app.db import engine
+from backend_app.db_routing import StickyWritesMiddleware, replica_health_loop, replicas
+from backend_app.deps import get_admin_user
+from backend_app import sql_stats
+from backend_app.file_gc import file_gc_loop
+from backend_app.migrate import run_migrations
+from backend_app.push_outbox import push_outbox_loop
+from backend_app.sqlite_writer import stop_writer
+from backend_app.user_search import ensure_search_indexes
 from backend_app.models import Base
 from backend_app.ws import router as ws_router
 from backend_app.routers import auth, users, chats, files, assistant, push  # ✅ push добавили
@@ -18,6 +30,44 @@ def on_startup():
     # ⚠️ create_all создаст НОВУЮ таблицу push_subscriptions,
     # но не умеет менять существующие таблицы (для этого alembic).
     Base.metadata.create_all(bind=engine)
+    # изменения существующих таблиц (alembic upgrade head)
+    run_migrations(engine)
+    # prefix/trigram индексы для /users/search
+    ensure_search_indexes(engine)
+
+
+_background_tasks: list[asyncio.Task] = []
+
+
+@app.on_event("startup")
+async def start_background_tasks():
+    # чистка брошенных resumable-загрузок
+    _background_tasks.append(asyncio.create_task(files.upload_sessions_janitor()))
+    # удаление осиротевших файлов (старые аватарки, неприкреплённые загрузки)
+    if settings.file_gc_enabled:
+        _background_tasks.append(asyncio.create_task(file_gc_loop()))
+    # доставка Web Push из очереди push_outbox
+    if settings.push_outbox_enabled:
+        _background_tasks.append(asyncio.create_task(push_outbox_loop()))
+    # проверка read-реплик (DATABASE_REPLICA_URLS)
+    if replicas:
+        _background_tasks.append(asyncio.create_task(replica_health_loop()))
+
+
+@app.on_event("shutdown")
+async def stop_background_tasks():
+    for t in _background_tasks:
+        t.cancel()
+    for t in _background_tasks:
+        with contextlib.suppress(asyncio.CancelledError):
+            await t
+    _background_tasks.clear()
+    # отложенные (grace delay) push'и
+    await push_notify.cancel_pending()
+    # SQLite: писатель дописывает поставленное в очередь
+    await asyncio.to_thread(stop_writer)
+    # pooled upstream clients (assistant, ...)
+    await http_clients.close_all()
 
 
 app.add_middleware(
@@ -28,6 +78,14 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# read-your-writes: после записи пользователь читает с primary (только если есть реплики)
+if replicas:
+    app.add_middleware(StickyWritesMiddleware)
+
+# число SQL и время в БД на запрос (снаружи остальных — считаем всё)
+if settings.sql_stats_enabled:
+    app.add_middleware(sql_stats.SQLStatsMiddleware)
+
 app.include_router(auth.router, prefix="/auth", tags=["auth"])
 app.include_router(users.router, prefix="/users", tags=["users"])
 app.include_router(chats.router, prefix="/chats", tags=["chats"])
@@ -69,4 +127,10 @@ def index():
 
 @app.get("/ping")
 def ping():
-    return {"ok": True}
\ No newline at end of file
+    return {"ok": True}
+
+
+# агрегаты sql_stats по роутам (самые дорогие по времени в БД — первыми)
+@app.get("/debug/sql")
+def sql_stats_report(admin=Depends(get_admin_user)):
+    return sql_stats.snapshot()
\ No newline at end of file
@@ -0,0 +1,26 @@
+# backend_app/migrate.py
+"""
+alembic upgrade head при старте приложения.
+
+create_all создаёт только недостающие таблицы и не меняет существующие
+(например, не добавит voice_meta.waveform) — это делают миграции из alembic/.
+Порядок на старте: create_all (новая БД получает актуальную схему), затем
+миграции (старая БД доводится до неё; миграции пишутся идемпотентными).
+"""
+from __future__ import annotations
+
+from pathlib import Path
+
+from alembic import command
+from alembic.config import Config
+from sqlalchemy.engine import Engine
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def run_migrations(engine: Engine) -> None:
+    cfg = Config(str(ROOT / "alembic.ini"))
+    cfg.set_main_option("script_location", str(ROOT / "alembic"))
+    with engine.begin() as conn:
+        cfg.attributes["connection"] = conn
+        command.upgrade(cfg, "head")
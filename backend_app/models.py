@@ -1,7 +1,7 @@
 from datetime import datetime
 from sqlalchemy import (
     Column, Integer, String, DateTime, ForeignKey, Text, UniqueConstraint,
-    LargeBinary,
+    LargeBinary, BigInteger, Index,
 )
 from sqlalchemy.orm import DeclarativeBase, relationship
 
@@ -77,6 +77,37 @@ class File(Base):
     owner = relationship("User", foreign_keys=[owner_id])
 
 
+# =========================
+# ✅ Resumable uploads (tus-like)
+# =========================
+class UploadSession(Base):
+    __tablename__ = "upload_sessions"
+
+    # uuid4 hex — отдаётся клиенту как upload_id
+    id = Column(String(32), primary_key=True)
+    owner_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+
+    original_name = Column(String(255), nullable=False)
+    mime = Column(String(128), nullable=False)
+
+    # заявленный полный размер и сколько байт уже принято
+    size = Column(Integer, nullable=False)
+    offset = Column(Integer, nullable=False, default=0)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False, index=True)
+
+
+class UploadChunk(Base):
+    __tablename__ = "upload_chunks"
+    __table_args__ = (UniqueConstraint("upload_id", "offset", name="uq_upload_chunk"),)
+
+    id = Column(Integer, primary_key=True)
+    upload_id = Column(String(32), ForeignKey("upload_sessions.id"), nullable=False, index=True)
+    offset = Column(Integer, nullable=False)
+    data = Column(LargeBinary, nullable=False)
+
+
 class MessageAttachment(Base):
     __tablename__ = "message_attachments"
     __table_args__ = (UniqueConstraint("message_id", "file_id", name="uq_msg_file"),)
@@ -114,7 +145,10 @@ class VoiceMeta(Base):
     # duration in milliseconds (from client)
     duration_ms = Column(Integer, nullable=False, default=0)
 
-    # JSON string with downsampled waveform bars (0..1 floats)
+    # waveform bars quantized to uint8 (see backend_app/waveform.py)
+    waveform = Column(LargeBinary, nullable=True)
+
+    # legacy: JSON string with 0..1 floats from client (converted by migration 0001)
     waveform_json = Column(Text, nullable=True)
 
     codec = Column(String(64), nullable=True)
@@ -143,4 +177,46 @@ class PushSubscription(Base):
     created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
     updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
 
-    user = relationship("User", foreign_keys=[user_id])
\ No newline at end of file
+    user = relationship("User", foreign_keys=[user_id])
+
+
+# =========================
+# ✅ Outbound Web Push queue (backend_app/push_outbox.py)
+# =========================
+class PushOutbox(Base):
+    __tablename__ = "push_outbox"
+    __table_args__ = (
+        Index("ix_push_outbox_status_next", "status", "next_attempt_at"),
+    )
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    # без FK: подписку могут удалить (unsubscribe/410), пока строка в очереди
+    subscription_id = Column(Integer, nullable=False)
+
+    payload = Column(Text, nullable=False)  # JSON уже нормализованного push'а
+
+    # pending -> sending (лиз до next_attempt_at) -> удалена | pending (retry) | dead
+    status = Column(String(16), nullable=False, default="pending")
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow)
+    claim_token = Column(String(32), nullable=True)
+
+    last_status_code = Column(Integer, nullable=True)
+    last_error = Column(String(400), nullable=True)
+
+    created_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+    updated_at = Column(DateTime, default=datetime.utcnow, nullable=False)
+
+
+# =========================
+# ✅ Rate limiting (GCRA state, shared across workers)
+# =========================
+class RateLimitState(Base):
+    __tablename__ = "rate_limits"
+
+    # "<limit name>:<user id | ip>"
+    key = Column(String(191), primary_key=True)
+
+    # theoretical arrival time, unix ms; tat <= now — ключ простаивает
+    tat = Column(BigInteger, nullable=False, index=True)
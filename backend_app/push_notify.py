@@ -0,0 +1,195 @@
+# backend_app/push_notify.py
+"""
+Политика доставки уведомлений о новых сообщениях.
+
+- У получателя открыт WebSocket и он подписан на этот чат (чат открыт на
+  экране) — событие по WS он уже получил, push не шлём.
+- Иначе ждём push_grace_delay_ms: если за это время пришёл read receipt
+  (mark_read до этого сообщения) или получатель открыл чат — push не нужен.
+  Нет — отправляем Web Push (через очередь push_outbox, если она включена).
+
+Склейка по (получатель, чат): всё, что пришло, пока push ждёт отправки,
+уходит одним push'ем («Новые сообщения (N)» + превью последнего). Первый push
+в тихом чате уходит через обычный grace delay; следующий — не раньше чем
+через push_coalesce_window_ms после предыдущего, и в нём всё накопленное.
+
+Счётчики — NOTIFY_STATS (GET /push/stats для админов).
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import logging
+import time
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+from backend_app.config import settings
+from backend_app.db import AsyncSessionLocal
+from backend_app.push_outbox import enqueue_push
+from backend_app.routers.push import send_webpush_to_user
+from backend_app.ws import manager
+
+log = logging.getLogger("push")
+
+NOTIFY_STATS: dict[str, int] = {
+    "messages": 0,  # сообщений, которым вообще мог понадобиться push
+    "scheduled": 0,  # push'ей поставлено в ожидание
+    "coalesced": 0,  # сообщений, приклеенных к уже ждущему push'у
+    "suppressed_active": 0,  # чат открыт в живой вкладке
+    "suppressed_read": 0,  # прочитал за время ожидания
+    "queued": 0,  # передан в push_outbox
+    "sent": 0,  # (без outbox) ушёл хотя бы на одно устройство
+    "merged": 0,  # из отправленных/переданных — склеенных (count > 1)
+    "no_subscriptions": 0,
+    "failed": 0,
+}
+
+# idle-слоты старше окна склейки чистим, когда их становится много
+_PRUNE_THRESHOLD = 1000
+
+
+@dataclass
+class _Slot:
+    """Состояние push'ей по одной паре (получатель, чат)."""
+
+    message_ids: list[int] = field(default_factory=list)  # ждут отправки
+    data: dict[str, Any] = field(default_factory=dict)  # payload последнего сообщения
+    task: Optional[asyncio.Task] = None  # ожидание перед отправкой
+    last_sent_at: float = 0.0  # monotonic
+
+
+_slots: dict[tuple[int, int], _Slot] = {}
+_tasks: set[asyncio.Task] = set()
+
+
+def _is_active(user_id: int, chat_id: int) -> bool:
+    return manager.is_online(user_id) and manager.is_subscribed(user_id, chat_id)
+
+
+def _merged_payload(data: dict[str, Any], message_ids: list[int]) -> dict[str, Any]:
+    n = len(message_ids)
+    out = {**data, "count": n, "message_id": max(message_ids)}
+    if n > 1:
+        out["title"] = f"Новые сообщения ({n})"
+    return out
+
+
+async def _deliver(recipient_id: int, data: dict[str, Any]) -> None:
+    if data.get("count", 1) > 1:
+        NOTIFY_STATS["merged"] += 1
+
+    try:
+        async with AsyncSessionLocal() as db:
+            if settings.push_outbox_enabled:
+                # дальше — очередь push_outbox (ретраи, dead-letter)
+                n = await enqueue_push(db, recipient_id, data)
+                NOTIFY_STATS["queued" if n else "no_subscriptions"] += 1
+                return
+            res = await send_webpush_to_user(db, recipient_id, data)
+    except Exception:
+        NOTIFY_STATS["failed"] += 1
+        log.exception("push delivery failed (user %s)", recipient_id)
+        return
+
+    if res.get("sent"):
+        NOTIFY_STATS["sent"] += 1
+    elif res.get("reason") == "no_subscriptions":
+        NOTIFY_STATS["no_subscriptions"] += 1
+    else:
+        NOTIFY_STATS["failed"] += 1
+
+
+async def _flush(key: tuple[int, int], delay: float) -> None:
+    recipient_id, chat_id = key
+    await asyncio.sleep(delay)
+
+    slot = _slots.get(key)
+    if slot is None or not slot.message_ids:
+        return
+    # забираем накопленное: всё, что придёт дальше, — уже следующий push
+    ids, data = slot.message_ids, slot.data
+    slot.message_ids, slot.data, slot.task = [], {}, None
+
+    if settings.push_skip_when_active and _is_active(recipient_id, chat_id):
+        NOTIFY_STATS["suppressed_active"] += 1
+        return
+
+    slot.last_sent_at = time.monotonic()
+    await _deliver(recipient_id, _merged_payload(data, ids))
+
+    if len(_slots) > _PRUNE_THRESHOLD:
+        _prune()
+
+
+def _prune() -> None:
+    horizon = time.monotonic() - max(0, settings.push_coalesce_window_ms) / 1000
+    for k, s in list(_slots.items()):
+        if not s.message_ids and s.task is None and s.last_sent_at < horizon:
+            del _slots[k]
+
+
+def _spawn(coro) -> asyncio.Task:
+    task = asyncio.create_task(coro)
+    _tasks.add(task)
+    task.add_done_callback(_tasks.discard)
+    return task
+
+
+def notify_new_message(recipient_id: int, chat_id: int, message_id: int, data: dict[str, Any]) -> None:
+    """Вызывается из send() после WS-рассылки; сам решает, нужен ли push и когда."""
+    NOTIFY_STATS["messages"] += 1
+    if settings.push_skip_when_active and _is_active(recipient_id, chat_id):
+        NOTIFY_STATS["suppressed_active"] += 1
+        return
+
+    key = (recipient_id, chat_id)
+    slot = _slots.setdefault(key, _Slot())
+    slot.message_ids.append(message_id)
+    slot.data = data
+
+    if slot.task is not None:
+        # push по этому чату уже ждёт — поедет вместе с ним
+        NOTIFY_STATS["coalesced"] += 1
+        return
+
+    delay = max(0, settings.push_grace_delay_ms) / 1000
+    if slot.last_sent_at:
+        # недавно уже слали — следующий не раньше окна склейки
+        window_end = slot.last_sent_at + max(0, settings.push_coalesce_window_ms) / 1000
+        delay = max(delay, window_end - time.monotonic())
+
+    NOTIFY_STATS["scheduled"] += 1
+    slot.task = _spawn(_flush(key, delay))
+
+
+def note_read(user_id: int, chat_id: int, last_read_message_id: int) -> None:
+    """Read receipt: прочитанное из ожидающего push'а выкидываем; если ничего не осталось — отменяем."""
+    slot = _slots.get((user_id, chat_id))
+    if slot is None or slot.task is None:
+        return
+    slot.message_ids = [m for m in slot.message_ids if m > last_read_message_id]
+    if not slot.message_ids:
+        slot.task.cancel()
+        slot.task, slot.data = None, {}
+        NOTIFY_STATS["suppressed_read"] += 1
+
+
+def pending_count() -> int:
+    """Сколько push'ей сейчас ждёт отправки (по парам получатель/чат)."""
+    return sum(1 for s in _slots.values() if s.task is not None)
+
+
+def pending_messages() -> int:
+    return sum(len(s.message_ids) for s in _slots.values())
+
+
+async def cancel_pending() -> None:
+    """На shutdown: отложенные push'и теряются (процесс всё равно уходит)."""
+    tasks = list(_tasks)
+    for t in tasks:
+        t.cancel()
+    for t in tasks:
+        with contextlib.suppress(asyncio.CancelledError):
+            await t
+    _slots.clear()
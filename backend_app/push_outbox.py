@@ -0,0 +1,317 @@
+# backend_app/push_outbox.py
+"""
+Исходящая очередь Web Push (таблица push_outbox).
+
+enqueue_push() пишет по строке на каждую подписку получателя; фоновый воркер
+(push_outbox_loop, стартует в main.py) забирает готовые строки батчами и
+доставляет их через webpush_sender.
+
+- Успех — строка удаляется; 404/410 — удаляются и строка, и подписка.
+- Временная ошибка (сеть, таймаут, 408/429/5xx) — повтор с экспоненциальной
+  задержкой (с джиттером); если сервис прислал Retry-After и он больше — ждём его.
+- После push_outbox_max_attempts попыток, а также при постоянной ошибке
+  (400/401/403/413 …) строка переходит в status="dead" и остаётся для разбора
+  (GET /push/outbox для админов).
+
+Забор батча — условный UPDATE с claim_token: несколько воркеров (процессов)
+не возьмут одну строку дважды. Строка в "sending" с истёкшим лизом (воркер
+упал посреди доставки) снова становится доступной.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import random
+import uuid
+from datetime import datetime, timedelta
+from typing import Any, Optional
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from backend_app import models
+from backend_app.config import settings
+from backend_app.db import SessionLocal
+from backend_app.push_payload import normalize_push_payload
+from backend_app.sqlite_writer import run_write
+from backend_app.webpush_sender import PushResult, PushTarget, deliver, vapid_signer
+
+log = logging.getLogger("push")
+
+OUTBOX_STATS: dict[str, int] = {
+    "enqueued": 0,
+    "batches": 0,
+    "delivered": 0,
+    "retried": 0,
+    "dead": 0,
+    "gone": 0,  # подписка протухла (404/410)
+    "errors": 0,  # сбои самого воркера
+}
+
+# сколько держим строку в "sending", прежде чем считать воркер упавшим
+_LEASE_SECONDS = 60
+
+_wake: Optional[asyncio.Event] = None
+
+
+def _wake_event() -> asyncio.Event:
+    global _wake
+    if _wake is None:
+        _wake = asyncio.Event()
+    return _wake
+
+
+async def enqueue_push(db: AsyncSession, user_id: int, data: dict[str, Any]) -> int:
+    """По строке на каждую подписку пользователя. Возвращает число строк (0 — подписок нет)."""
+    payload = json.dumps(normalize_push_payload(data or {}), ensure_ascii=False)
+
+    def insert_rows(s: Session) -> int:
+        sub_ids = list(
+            s.scalars(select(models.PushSubscription.id).where(models.PushSubscription.user_id == user_id))
+        )
+        now = datetime.utcnow()
+        s.add_all(
+            models.PushOutbox(
+                user_id=user_id,
+                subscription_id=sid,
+                payload=payload,
+                status="pending",
+                attempts=0,
+                next_attempt_at=now,
+                created_at=now,
+                updated_at=now,
+            )
+            for sid in sub_ids
+        )
+        return len(sub_ids)
+
+    n = await run_write(db, insert_rows)
+    if not n:
+        return 0
+
+    OUTBOX_STATS["enqueued"] += n
+    _wake_event().set()
+    return n
+
+
+def _backoff_seconds(attempts: int, retry_after: Optional[float]) -> float:
+    base = max(0.1, float(settings.push_outbox_backoff_base_seconds))
+    cap = max(base, float(settings.push_outbox_backoff_max_seconds))
+    delay = min(cap, base * (2 ** max(0, attempts - 1)))
+    # full jitter в верхней половине: ретраи после общего сбоя не идут одной волной
+    delay = delay / 2 + random.uniform(0, delay / 2)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return delay
+
+
+# -------------------------
+# Worker steps (sync, выполняются в треде)
+# -------------------------
+def _claim_batch(limit: int) -> list[tuple[models.PushOutbox, Optional[PushTarget]]]:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        ids = [
+            i
+            for (i,) in db.query(models.PushOutbox.id)
+            .filter(
+                models.PushOutbox.status.in_(("pending", "sending")),
+                models.PushOutbox.next_attempt_at <= now,
+            )
+            .order_by(models.PushOutbox.next_attempt_at)
+            .limit(limit)
+        ]
+        if not ids:
+            return []
+
+        token = uuid.uuid4().hex
+        # условие повторяем в UPDATE: строку, которую уже забрал другой воркер, не тронем
+        db.query(models.PushOutbox).filter(
+            models.PushOutbox.id.in_(ids),
+            models.PushOutbox.status.in_(("pending", "sending")),
+            models.PushOutbox.next_attempt_at <= now,
+        ).update(
+            {
+                models.PushOutbox.status: "sending",
+                models.PushOutbox.claim_token: token,
+                models.PushOutbox.next_attempt_at: now + timedelta(seconds=_LEASE_SECONDS),
+                models.PushOutbox.updated_at: now,
+            },
+            synchronize_session=False,
+        )
+        db.commit()
+
+        rows = db.query(models.PushOutbox).filter(models.PushOutbox.claim_token == token).all()
+        subs = {
+            s.id: s
+            for s in db.query(models.PushSubscription).filter(
+                models.PushSubscription.id.in_({r.subscription_id for r in rows})
+            )
+        }
+        out = []
+        for r in rows:
+            s = subs.get(r.subscription_id)
+            out.append((r, PushTarget(s.id, s.endpoint, s.p256dh, s.auth) if s else None))
+        db.expunge_all()
+        return out
+    finally:
+        db.close()
+
+
+def _apply_results(done: list[tuple[models.PushOutbox, Optional[PushResult]]]) -> None:
+    db = SessionLocal()
+    try:
+        now = datetime.utcnow()
+        max_attempts = max(1, int(settings.push_outbox_max_attempts))
+        delete_ids: list[int] = []
+        gone_subs: list[int] = []
+        # весь батч забран одним UPDATE — один claim_token
+        token = done[0][0].claim_token if done else None
+
+        for row, res in done:
+            if res is None or res.ok:
+                # res None — подписки уже нет, слать некуда
+                delete_ids.append(row.id)
+                if res is not None:
+                    OUTBOX_STATS["delivered"] += 1
+                continue
+
+            if res.gone:
+                delete_ids.append(row.id)
+                gone_subs.append(row.subscription_id)
+                OUTBOX_STATS["gone"] += 1
+                continue
+
+            attempts = row.attempts + 1
+            values: dict[Any, Any] = {
+                models.PushOutbox.attempts: attempts,
+                models.PushOutbox.last_status_code: res.status_code,
+                models.PushOutbox.last_error: (res.error or "")[:400],
+                models.PushOutbox.claim_token: None,
+                models.PushOutbox.updated_at: now,
+            }
+            if res.transient and attempts < max_attempts:
+                values[models.PushOutbox.status] = "pending"
+                values[models.PushOutbox.next_attempt_at] = now + timedelta(
+                    seconds=_backoff_seconds(attempts, res.retry_after)
+                )
+                OUTBOX_STATS["retried"] += 1
+            else:
+                values[models.PushOutbox.status] = "dead"
+                OUTBOX_STATS["dead"] += 1
+                log.warning("push outbox: dead after %d attempts: %s", attempts, res.error_detail())
+
+            # строка всё ещё наша: батч мог пережить лиз, и её уже забрал другой воркер
+            db.query(models.PushOutbox).filter(
+                models.PushOutbox.id == row.id, models.PushOutbox.claim_token == row.claim_token
+            ).update(values, synchronize_session=False)
+
+        if delete_ids:
+            db.query(models.PushOutbox).filter(
+                models.PushOutbox.id.in_(delete_ids), models.PushOutbox.claim_token == token
+            ).delete(synchronize_session=False)
+        if gone_subs:
+            db.query(models.PushSubscription).filter(models.PushSubscription.id.in_(gone_subs)).delete(
+                synchronize_session=False
+            )
+        db.commit()
+    finally:
+        db.close()
+
+
+async def drain_once() -> int:
+    """Один батч: забрать, доставить, разложить результаты. Возвращает размер батча."""
+    batch = await asyncio.to_thread(_claim_batch, max(1, int(settings.push_outbox_batch_size)))
+    if not batch:
+        return 0
+    OUTBOX_STATS["batches"] += 1
+
+    signer = vapid_signer()
+    if signer is None:
+        # ключи не настроены — вернём строки в очередь как временную ошибку
+        results = [
+            (row, PushResult(t, ok=False, error="bad_or_missing_private_key") if t else None) for row, t in batch
+        ]
+    else:
+
+        async def one(row: models.PushOutbox, t: Optional[PushTarget]):
+            if t is None:
+                return row, None
+            return row, await deliver(t, row.payload.encode("utf-8"), signer)
+
+        results = list(await asyncio.gather(*(one(r, t) for r, t in batch)))
+
+    await asyncio.to_thread(_apply_results, results)
+    return len(batch)
+
+
+async def push_outbox_loop() -> None:
+    """Фоновая задача (стартует в main.py): дренирует очередь, просыпается по enqueue или по таймеру."""
+    wake = _wake_event()
+    poll = max(0.2, float(settings.push_outbox_poll_seconds))
+    batch_size = max(1, int(settings.push_outbox_batch_size))
+    while True:
+        try:
+            n = await drain_once()
+        except Exception:
+            OUTBOX_STATS["errors"] += 1
+            log.exception("push outbox drain failed")
+            n = 0
+        if n >= batch_size:
+            continue  # очередь не пуста — следующий батч сразу
+        wake.clear()
+        try:
+            await asyncio.wait_for(wake.wait(), timeout=poll)
+        except asyncio.TimeoutError:
+            pass
+
+
+# -------------------------
+# Admin summary
+# -------------------------
+def outbox_summary(db: Session, dead_limit: int = 20) -> dict[str, Any]:
+    by_status = dict(
+        db.query(models.PushOutbox.status, func.count(models.PushOutbox.id)).group_by(models.PushOutbox.status).all()
+    )
+    oldest = (
+        db.query(func.min(models.PushOutbox.created_at))
+        .filter(models.PushOutbox.status.in_(("pending", "sending")))
+        .scalar()
+    )
+    failing = (
+        db.query(models.PushOutbox.last_status_code, func.count(models.PushOutbox.id))
+        .filter(or_(models.PushOutbox.status == "dead", models.PushOutbox.attempts > 0))
+        .group_by(models.PushOutbox.last_status_code)
+        .all()
+    )
+    dead = (
+        db.query(models.PushOutbox)
+        .filter(models.PushOutbox.status == "dead")
+        .order_by(models.PushOutbox.updated_at.desc())
+        .limit(dead_limit)
+        .all()
+    )
+    return {
+        "depth": {s: int(by_status.get(s, 0)) for s in ("pending", "sending", "dead")},
+        "oldest_pending_age_s": (
+            int((datetime.utcnow() - oldest).total_seconds()) if oldest is not None else None
+        ),
+        "failures_by_status_code": {str(code) if code is not None else "network": n for code, n in failing},
+        "recent_dead": [
+            {
+                "id": r.id,
+                "user_id": r.user_id,
+                "subscription_id": r.subscription_id,
+                "attempts": r.attempts,
+                "last_status_code": r.last_status_code,
+                "last_error": r.last_error,
+                "created_at": r.created_at.isoformat(),
+                "updated_at": r.updated_at.isoformat(),
+            }
+            for r in dead
+        ],
+        "stats": dict(OUTBOX_STATS),
+    }
@@ -0,0 +1,124 @@
+# backend_app/push_payload.py
+"""
+Payload Web Push: поля, которые ждёт service worker, и абсолютные URL иконок.
+Общий для мгновенной отправки (routers/push.py) и очереди (push_outbox.py).
+"""
+from __future__ import annotations
+
+import os
+from datetime import datetime
+from typing import Any
+
+from backend_app.config import settings
+
+
+# -------------------------
+# Public origin helpers (for absolute avatar URLs)
+# -------------------------
+
+def _origin() -> str:
+    """
+    Public origin for absolute URLs in push payload.
+    Put this in Railway env:
+      PUBLIC_ORIGIN=https://<your-app>.up.railway.app
+    """
+    o = (os.getenv("PUBLIC_ORIGIN") or "").strip()
+    if not o:
+        o = (getattr(settings, "PUBLIC_ORIGIN", None) or "").strip()  # optional
+    if not o:
+        o = (getattr(settings, "APP_ORIGIN", None) or "").strip()  # optional
+    return o.rstrip("/")
+
+
+def _abs_url(path_or_url: str | None) -> str | None:
+    if not path_or_url:
+        return None
+    s = str(path_or_url).strip()
+    if not s:
+        return None
+    if s.startswith("http://") or s.startswith("https://"):
+        return s
+    o = _origin()
+    if not o:
+        return None
+    if not s.startswith("/"):
+        s = "/" + s
+    return o + s
+
+
+def sender_avatar_abs(sender: Any) -> str | None:
+    """
+    Returns absolute public avatar URL (must be accessible by browser without auth for SW icon).
+    """
+    if not sender:
+        return None
+
+    av_url = getattr(sender, "avatar_url", None)
+    if av_url:
+        return _abs_url(av_url) or str(av_url)
+
+    fid = getattr(sender, "avatar_file_id", None)
+    if fid:
+        return _abs_url(f"/files/{fid}")
+
+    return None
+
+
+def normalize_push_payload(data: dict[str, Any]) -> dict[str, Any]:
+    """
+    Telegram Web–like payload fields:
+      - chat_id
+      - sender_username / sender_display
+      - avatar_icon_url (absolute)
+      - title/body
+      - tag = chat:<chat_id>
+    """
+    out: dict[str, Any] = dict(data or {})
+
+    # chat id
+    chat_id = out.get("chat_id", out.get("chatId"))
+    if chat_id is not None:
+        try:
+            chat_id = int(chat_id)
+        except Exception:
+            pass
+    out["chat_id"] = chat_id
+
+    # sender username
+    su = (out.get("sender_username") or out.get("from_username") or "").strip()
+    if su.startswith("@"):
+        su = su[1:]
+    if su:
+        out["sender_username"] = su
+
+    # sender display (what Telegram shows in title)
+    sd = (out.get("sender_display") or "").strip()
+    if not sd:
+        sd = f"@{su}" if su else "Новое сообщение"
+    out["sender_display"] = sd
+
+    # title/body
+    title = (out.get("title") or "").strip()
+    if not title:
+        title = sd or "Новое сообщение"
+    out["title"] = title
+
+    body = (out.get("body") or out.get("text") or "").strip()
+    if not body:
+        body = "Откройте чат"
+    out["body"] = body
+
+    # icon/badge (absolute, public)
+    icon = (out.get("avatar_icon_url") or out.get("icon") or out.get("sender_avatar") or out.get("avatar") or "").strip()
+    icon_abs = _abs_url(icon) if icon else None
+    if icon_abs:
+        out["avatar_icon_url"] = icon_abs
+        out["icon"] = icon_abs
+        out.setdefault("badge", icon_abs)
+
+    # tag for grouping
+    if chat_id and not out.get("tag"):
+        out["tag"] = f"chat:{chat_id}"
+
+    out.setdefault("ts", datetime.utcnow().isoformat())
+    return out
@@ -0,0 +1,237 @@
+# backend_app/ratelimit.py
+"""
+Rate limiting для любых роутов (GCRA — generic cell rate algorithm).
+
+На ключ хранится одно число — TAT (theoretical arrival time, ms).
+Запрос разрешён, если после сдвига TAT на interval он уходит вперёд
+не больше чем на burst * interval. Ключ с TAT в прошлом ничем не
+отличается от отсутствующего — такие удаляем (idle eviction).
+
+Backends:
+  - "db"     — таблица rate_limits в основной БД: лимит общий для всех воркеров,
+               проверка — один атомарный UPDATE (+ INSERT для нового ключа);
+  - "memory" — dict в процессе (для dev / одного воркера).
+
+Использование:
+    @router.post("/send", dependencies=[Depends(rate_limit("send", settings.rate_limit_send))])
+"""
+from __future__ import annotations
+
+import math
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from fastapi import Depends, HTTPException, Request
+from sqlalchemy import case, delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from backend_app.auth_cache import Principal
+from backend_app.config import settings
+from backend_app.db import engine
+from backend_app.deps import get_principal
+from backend_app.models import RateLimitState
+from backend_app.sqlite_writer import get_writer
+
+_PERIODS_MS = {"second": 1000, "minute": 60_000, "hour": 3_600_000, "day": 86_400_000}
+
+# раз в сколько проверок чистим простаивающие ключи
+_SWEEP_EVERY = 1000
+
+
+@dataclass(frozen=True)
+class Limit:
+    """rate запросов за period_ms, всплеск до burst подряд."""
+
+    rate: int
+    period_ms: int
+    burst: int
+
+    @property
+    def interval_ms(self) -> float:
+        return self.period_ms / self.rate
+
+    @classmethod
+    def parse(cls, spec: str) -> "Limit":
+        """'20/minute', '5/second', '100/hour;burst=10'."""
+        head, _, extra = (spec or "").partition(";")
+        n, _, per = head.strip().partition("/")
+        per = per.strip().lower().rstrip("s") or "second"
+        if per not in _PERIODS_MS:
+            raise ValueError(f"bad rate limit period: {spec!r}")
+        rate = int(n)
+        burst = rate
+        if extra.strip().startswith("burst="):
+            burst = int(extra.strip()[len("burst="):])
+        if rate <= 0 or burst <= 0:
+            raise ValueError(f"bad rate limit: {spec!r}")
+        return cls(rate=rate, period_ms=_PERIODS_MS[per], burst=burst)
+
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+
+class MemoryBackend:
+    def __init__(self):
+        self._tat: dict[str, float] = {}
+        self._lock = threading.Lock()
+        self._ops = 0
+
+    def hit(self, key: str, limit: Limit, now: int) -> float:
+        """0 — разрешено, иначе сколько мс ждать."""
+        t = limit.interval_ms
+        with self._lock:
+            self._ops += 1
+            if self._ops % _SWEEP_EVERY == 0:
+                self._sweep(now)
+
+            tat = max(self._tat.get(key, now), now)
+            new_tat = tat + t
+            over = new_tat - now - limit.burst * t
+            if over > 0:
+                return over
+            self._tat[key] = new_tat
+            return 0.0
+
+    def _sweep(self, now: int) -> None:
+        for k in [k for k, v in self._tat.items() if v <= now]:
+            del self._tat[k]
+
+    def __len__(self) -> int:
+        return len(self._tat)
+
+
+class DBBackend:
+    def __init__(self, bind=engine):
+        self.bind = bind
+        self._ops = 0
+
+    @staticmethod
+    def _advance(key: str, t: int, tol: int, now: int):
+        rl = RateLimitState.__table__
+        base = case((rl.c.tat > now, rl.c.tat), else_=now)
+        return update(rl).where(rl.c.key == key, base + t - now <= tol).values(tat=base + t)
+
+    @staticmethod
+    def _wait_ms(tat: Optional[int], t: int, tol: int, now: int) -> float:
+        if tat is None:
+            return 0.0
+        return max(1.0, max(tat, now) + t - now - tol)
+
+    def hit(self, key: str, limit: Limit, now: int) -> float:
+        t = limit.interval_ms
+        tol = limit.burst * t
+        rl = RateLimitState.__table__
+
+        self._ops += 1
+        sweep = self._ops % _SWEEP_EVERY == 0
+
+        w = get_writer() if self.bind is engine else None
+        if w is not None:
+            # SQLite: проверка — запись, отдаём её писателю (одна транзакция на пачку)
+            return w.submit(lambda db: self._hit_in_session(db, key, t, tol, now, sweep)).result()
+
+        with self.bind.begin() as conn:
+            if sweep:
+                conn.execute(delete(rl).where(rl.c.tat <= now))
+            res = conn.execute(self._advance(key, t, tol, now))
+            if res.rowcount == 1:
+                return 0.0
+
+        # либо ключа нет, либо лимит исчерпан
+        try:
+            with self.bind.begin() as conn:
+                conn.execute(insert(rl).values(key=key, tat=now + t))
+            return 0.0
+        except IntegrityError:
+            pass
+
+        with self.bind.connect() as conn:
+            tat = conn.execute(select(rl.c.tat).where(rl.c.key == key)).scalar()
+        return self._wait_ms(tat, t, tol, now)
+
+    def _hit_in_session(self, db: Session, key: str, t: int, tol: int, now: int, sweep: bool) -> float:
+        rl = RateLimitState.__table__
+        if sweep:
+            db.execute(delete(rl).where(rl.c.tat <= now))
+        if db.execute(self._advance(key, t, tol, now)).rowcount == 1:
+            return 0.0
+        try:
+            with db.begin_nested():
+                db.execute(insert(rl).values(key=key, tat=now + t))
+            return 0.0
+        except IntegrityError:
+            pass
+        return self._wait_ms(db.execute(select(rl.c.tat).where(rl.c.key == key)).scalar(), t, tol, now)
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                kind = (settings.rate_limit_backend or "db").strip().lower()
+                _backend = MemoryBackend() if kind == "memory" else DBBackend()
+    return _backend
+
+
+def check(name: str, key: str, limit: Limit, detail: str = "Rate limit exceeded") -> None:
+    """Бросает 429 с Retry-After, если ключ name:key исчерпал limit."""
+    if not settings.rate_limit_enabled:
+        return
+    wait_ms = get_backend().hit(f"{name}:{key}", limit, _now_ms())
+    if wait_ms > 0:
+        raise HTTPException(
+            status_code=429,
+            detail=detail,
+            headers={"Retry-After": str(max(1, math.ceil(wait_ms / 1000)))},
+        )
+
+
+def client_ip(request: Request) -> str:
+    if settings.rate_limit_trust_forwarded_for:
+        fwd = request.headers.get("x-forwarded-for")
+        if fwd:
+            # первая запись справа налево, добавленная не нашими прокси, — адрес клиента;
+            # всё левее клиент мог прислать сам
+            hops = [x.strip() for x in fwd.split(",") if x.strip()]
+            if hops:
+                return hops[-min(len(hops), max(1, settings.rate_limit_forwarded_hops))]
+    return request.client.host if request.client else "unknown"
+
+
+def rate_limit(
+    name: str,
+    spec: str | Limit,
+    by: str = "user",
+    detail: str = "Rate limit exceeded",
+) -> Callable:
+    """
+    FastAPI-зависимость. by="user" — ключ по авторизованному пользователю,
+    by="ip" — по IP клиента (для login/register, где пользователя ещё нет).
+    """
+    limit = spec if isinstance(spec, Limit) else Limit.parse(spec)
+
+    if by == "ip":
+        def dep_ip(request: Request) -> None:
+            check(name, client_ip(request), limit, detail)
+
+        return dep_ip
+
+    def dep_user(principal: Principal = Depends(get_principal)) -> None:
+        check(name, str(principal.id), limit, detail)
+
+    return dep_user
+
+
+def reset_backend(backend: Optional[object] = None) -> None:
+    """Для бенчмарков/скриптов: подменить или сбросить backend."""
+    global _backend
+    _backend = backend
@@ -1,30 +1,32 @@
 from __future__ import annotations
 
+import asyncio
+import hashlib
 import json
+import logging
 import time
-from collections import deque
-from typing import Deque, Dict, List, Optional
+from dataclasses import dataclass
+from typing import AsyncIterator, List, Optional
 
 import httpx
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel, Field
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from backend_app import models
+from backend_app.cache import TTLCache
+from backend_app.chat_window import recent_messages
 from backend_app.config import settings
-from backend_app.deps import get_current_user, get_db
-
-router = APIRouter()
-
-# -------------------------
-# In-memory rate limiters
-# -------------------------
-_user_last_ts_ms: Dict[int, int] = {}
-_user_minute_ts: Dict[int, Deque[int]] = {}
+from backend_app.http_clients import (
+    LatencyStats, RequestTimer, get_client, http2_available, timed_request,
+)
+from backend_app.deps import get_async_db, get_principal
+from backend_app.ratelimit import Limit, rate_limit
 
+log = logging.getLogger("assistant")
 
-def _now_ms() -> int:
-    return int(time.time() * 1000)
+router = APIRouter()
 
 
 def _clip(s: str, n: int) -> str:
@@ -36,35 +38,28 @@ def _clip(s: str, n: int) -> str:
     return s if len(s) <= n else s[:n]
 
 
-def _rate_limit(user_id: int) -> None:
-    now = _now_ms()
-
-    # min interval
-    min_interval = int(getattr(settings, "assistant_min_interval_ms", 1200))
-    last = _user_last_ts_ms.get(user_id, 0)
-    if now - last < min_interval:
-        raise HTTPException(status_code=429, detail="Assistant rate limit: too frequent")
+# -------------------------
+# Rate limits (общий backend, см. backend_app/ratelimit.py)
+# -------------------------
+def _min_interval_limit() -> Limit:
+    # burst=1: не чаще одного запроса за min_interval
+    min_interval = max(1, int(getattr(settings, "assistant_min_interval_ms", 1200)))
+    return Limit(rate=1, period_ms=min_interval, burst=1)
 
-    # per-minute
-    rpm = int(getattr(settings, "assistant_max_requests_per_minute", 20))
-    dq = _user_minute_ts.get(user_id)
-    if dq is None:
-        dq = deque()
-        _user_minute_ts[user_id] = dq
 
-    one_min_ago = now - 60_000
-    while dq and dq[0] < one_min_ago:
-        dq.popleft()
+def _per_minute_limit() -> Limit:
+    rpm = max(1, int(getattr(settings, "assistant_max_requests_per_minute", 20)))
+    return Limit(rate=rpm, period_ms=60_000, burst=rpm)
 
-    if len(dq) >= rpm:
-        raise HTTPException(status_code=429, detail="Assistant rate limit: too many requests")
 
-    dq.append(now)
-    _user_last_ts_ms[user_id] = now
+_assistant_limits = [
+    Depends(rate_limit("assistant_interval", _min_interval_limit(), detail="Assistant rate limit: too frequent")),
+    Depends(rate_limit("assistant_minute", _per_minute_limit(), detail="Assistant rate limit: too many requests")),
+]
 
 
-def _ensure_chat_member(db: Session, chat_id: int, user_id: int) -> models.DMChat:
-    chat = db.get(models.DMChat, chat_id)
+async def _ensure_chat_member(db: AsyncSession, chat_id: int, user_id: int) -> models.DMChat:
+    chat = await db.get(models.DMChat, chat_id)
     if not chat or user_id not in (chat.user1_id, chat.user2_id):
         raise HTTPException(status_code=404, detail="Chat not found")
     return chat
@@ -86,7 +81,9 @@ class SuggestIn(BaseModel):
     chat_id: int
     draft: Optional[str] = None
     reason: Optional[str] = "idle"
-    messages: List[AssistantMsg] = Field(default_factory=list)
+    # None — контекст собирает сервер из БД (окно последних сообщений чата);
+    # список (даже пустой) — явное переопределение от клиента
+    messages: Optional[List[AssistantMsg]] = None
 
     # backward compatibility (если фронт шлёт text)
     text: Optional[str] = None
@@ -131,6 +128,36 @@ def _build_openai_input(
     return input_msgs
 
 
+# -------------------------
+# Upstream HTTP client (pooled, keep-alive)
+# -------------------------
+def _responses_url() -> str:
+    base = (settings.openai_base_url or "https://api.openai.com/v1").strip().rstrip("/")
+    return base + "/responses"
+
+upstream_stats = LatencyStats()
+
+
+def _make_openai_client() -> httpx.AsyncClient:
+    http2 = bool(settings.openai_http2) and http2_available()
+    return httpx.AsyncClient(
+        http2=http2,
+        limits=httpx.Limits(
+            max_connections=settings.openai_max_connections,
+            max_keepalive_connections=settings.openai_max_keepalive_connections,
+            keepalive_expiry=settings.openai_keepalive_expiry_seconds,
+        ),
+        timeout=httpx.Timeout(
+            settings.openai_timeout_seconds,
+            connect=settings.openai_connect_timeout_seconds,
+        ),
+    )
+
+
+def _openai_client() -> httpx.AsyncClient:
+    return get_client("openai", _make_openai_client)
+
+
 def _extract_openai_error_text(resp: httpx.Response) -> str:
     try:
         j = resp.json()
@@ -148,7 +175,7 @@ def _extract_openai_error_text(resp: httpx.Response) -> str:
         return (resp.text or "")[:500]
 
 
-async def _call_openai(input_msgs: List[dict]) -> str:
+def _openai_request(input_msgs: List[dict], stream: bool = False) -> tuple[dict, dict]:
     api_key = (getattr(settings, "openai_api_key", "") or "").strip()
     if not api_key:
         raise HTTPException(status_code=500, detail="OPENAI_API_KEY is not configured")
@@ -161,20 +188,27 @@ async def _call_openai(input_msgs: List[dict]) -> str:
         "input": input_msgs,
         "max_output_tokens": max_out,
     }
+    if stream:
+        payload["stream"] = True
 
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json",
     }
+    return payload, headers
 
-    timeout = httpx.Timeout(25.0, connect=10.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        r = await client.post("https://api.openai.com/v1/responses", json=payload, headers=headers)
+
+async def _call_openai(input_msgs: List[dict]) -> str:
+    payload, headers = _openai_request(input_msgs)
+
+    r = await timed_request(
+        _openai_client(), "POST", _responses_url(), upstream_stats, json=payload, headers=headers
+    )
 
     if r.status_code >= 400:
         reason = _extract_openai_error_text(r)
-        # важно: печатаем в консоль, чтобы ты видел прямо в uvicorn
-        print(f"[assistant] OpenAI error {r.status_code}: {reason}")
+        # WARNING без настройки логирования всё равно попадает в stderr uvicorn
+        log.warning("OpenAI error %s: %s", r.status_code, reason)
         raise HTTPException(status_code=502, detail=f"OpenAI error {r.status_code}: {reason}")
 
     data = r.json()
@@ -197,36 +231,372 @@ async def _call_openai(input_msgs: List[dict]) -> str:
         return ""
 
 
+# -------------------------
+# Suggestion cache + in-flight coalescing
+# -------------------------
+# ключ — хэш нормализованного input (+ модель/лимит токенов)
+suggestion_cache = TTLCache(
+    maxsize=settings.assistant_cache_size,
+    ttl=settings.assistant_cache_ttl_seconds,
+)
+
+cache_stats = {"hits": 0, "misses": 0, "coalesced": 0, "superseded": 0, "upstream_calls": 0}
+
+
+@dataclass
+class _Inflight:
+    task: asyncio.Task
+    waiters: int = 0
+
+
+# один апстрим-вызов на ключ, сколько бы одинаковых запросов ни ждало
+_inflight: dict[str, _Inflight] = {}
+
+# latest wins: на пользователя — future, который резолвится, когда пришёл запрос новее
+_latest_by_user: dict[int, asyncio.Future] = {}
+
+
+def _suggest_key(input_msgs: List[dict]) -> str:
+    norm = [
+        {"role": m.get("role"), "content": " ".join(str(m.get("content") or "").split())}
+        for m in input_msgs
+    ]
+    raw = json.dumps(
+        {
+            "model": (getattr(settings, "openai_model", "") or "gpt-4o-mini").strip(),
+            "max_out": int(getattr(settings, "assistant_max_output_tokens", 120)),
+            "input": norm,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _supersede(user_id: int) -> asyncio.Future:
+    prev = _latest_by_user.get(user_id)
+    if prev is not None and not prev.done():
+        prev.set_result(True)
+    me = asyncio.get_running_loop().create_future()
+    _latest_by_user[user_id] = me
+    return me
+
+
+def _release_latest(user_id: int, me: asyncio.Future) -> None:
+    if _latest_by_user.get(user_id) is me:
+        del _latest_by_user[user_id]
+
+
+def _start_upstream(key: str, input_msgs: List[dict]) -> _Inflight:
+    cache_stats["upstream_calls"] += 1
+    inf = _Inflight(task=asyncio.create_task(_call_openai(input_msgs)))
+
+    def _done(t: asyncio.Task) -> None:
+        if _inflight.get(key) is inf:
+            del _inflight[key]
+        if not t.cancelled() and t.exception() is None and (t.result() or "").strip():
+            suggestion_cache.put(key, t.result())
+
+    inf.task.add_done_callback(_done)
+    _inflight[key] = inf
+    return inf
+
+
+async def _suggest_coalesced(user_id: int, input_msgs: List[dict], use_cache: bool = True) -> str:
+    """
+    1) кэш (LRU+TTL);
+    2) одинаковые одновременные запросы ждут один апстрим-вызов;
+    3) новый запрос пользователя отменяет его старый (409), а апстрим-вызов
+       без оставшихся ожидающих отменяется.
+    """
+    key = _suggest_key(input_msgs)
+    if use_cache:
+        cached = suggestion_cache.get(key)
+        if cached is not None:
+            cache_stats["hits"] += 1
+            return cached
+    cache_stats["misses"] += 1
+
+    me = _supersede(user_id)
+
+    inf = _inflight.get(key)
+    if inf is None:
+        inf = _start_upstream(key, input_msgs)
+    else:
+        cache_stats["coalesced"] += 1
+
+    inf.waiters += 1
+    try:
+        await asyncio.wait({inf.task, me}, return_when=asyncio.FIRST_COMPLETED)
+        if inf.task.done():
+            return inf.task.result()
+        cache_stats["superseded"] += 1
+        raise HTTPException(status_code=409, detail="Superseded by a newer suggestion request")
+    finally:
+        inf.waiters -= 1
+        if inf.waiters <= 0 and not inf.task.done():
+            # убираем ключ сразу (а не в done-колбэке): одинаковый запрос, пришедший
+            # до колбэка, иначе присоединился бы к отменённой задаче и получил CancelledError
+            if _inflight.get(key) is inf:
+                del _inflight[key]
+            inf.task.cancel()
+        _release_latest(user_id, me)
+
+
+def _sse(event: str, data: dict) -> bytes:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8")
+
+
+async def _open_openai_stream(input_msgs: List[dict]) -> tuple[httpx.Response, RequestTimer]:
+    """Открывает стрим к апстриму; ошибку статуса отдаём обычным 502 до начала SSE."""
+    payload, headers = _openai_request(input_msgs, stream=True)
+    timer = RequestTimer()
+    client = _openai_client()
+    req = client.build_request(
+        "POST", _responses_url(), json=payload, headers=headers, extensions={"trace": timer.trace}
+    )
+    r = await client.send(req, stream=True)
+
+    if r.status_code >= 400:
+        try:
+            await r.aread()
+        finally:
+            await r.aclose()
+        timer.finish()
+        upstream_stats.record(timer, ok=r.status_code < 500)
+        reason = _extract_openai_error_text(r)
+        log.warning("OpenAI error %s (stream): %s", r.status_code, reason)
+        raise HTTPException(status_code=502, detail=f"OpenAI error {r.status_code}: {reason}")
+
+    return r, timer
+
+
+@dataclass
+class _StreamInflight:
+    """Один апстрим-стрим на ключ; подписчики читают накопленный текст и ждут дельты."""
+
+    key: str
+    max_chars: int
+    opened: asyncio.Future
+    task: Optional[asyncio.Task] = None
+    text: str = ""
+    final: Optional[bytes] = None  # последнее SSE-событие (done/error) — после него стрим закончен
+    subscribers: int = 0
+
+    def __post_init__(self) -> None:
+        self._wake = asyncio.Event()
+
+    def notify(self) -> None:
+        self._wake.set()
+        self._wake = asyncio.Event()
+
+
+_stream_inflight: dict[str, _StreamInflight] = {}
+
+
+async def _pump_openai_stream(inf: _StreamInflight, input_msgs: List[dict]) -> None:
+    """
+    Upstream SSE (response.output_text.delta ...) -> inf.text / inf.final.
+    Задачу отменяют, когда не осталось подписчиков: finally закрывает
+    апстрим-ответ (соединение рвётся, генерация наверху прекращается).
+    """
+    try:
+        r, timer = await _open_openai_stream(input_msgs)
+    except asyncio.CancelledError:
+        inf.opened.cancel()
+        raise
+    except Exception as e:
+        # 502 и т.п. получат все подписчики из inf.opened
+        inf.opened.set_exception(e)
+        if _stream_inflight.get(inf.key) is inf:
+            del _stream_inflight[inf.key]
+        return
+    inf.opened.set_result(True)
+
+    ok = False
+    try:
+        async for line in r.aiter_lines():
+            if not line.startswith("data:"):
+                continue
+            raw = line[5:].strip()
+            if not raw or raw == "[DONE]":
+                continue
+            try:
+                ev = json.loads(raw)
+            except ValueError:
+                continue
+
+            typ = ev.get("type") or ""
+            if typ == "response.output_text.delta":
+                delta = ev.get("delta") or ""
+                if not delta:
+                    continue
+                if not inf.text:
+                    # главная метрика стрима: время до первого токена
+                    upstream_stats.observe("ttft", (time.perf_counter() - timer.started) * 1000)
+                inf.text += delta[: max(0, inf.max_chars - len(inf.text))]
+                inf.notify()
+                if len(inf.text) >= inf.max_chars:
+                    break
+
+            elif typ in ("error", "response.failed"):
+                err = ev.get("error") or (ev.get("response") or {}).get("error") or {}
+                detail = err.get("message") if isinstance(err, dict) else None
+                inf.final = _sse("error", {"detail": detail or "Upstream error"})
+                return
+
+            elif typ == "response.completed":
+                break
+
+        suggestion = inf.text.strip()
+        if suggestion:
+            ok = True
+            suggestion_cache.put(inf.key, suggestion)
+            inf.final = _sse("done", {"suggestion": suggestion})
+        else:
+            inf.final = _sse("error", {"detail": "Empty assistant response"})
+    except Exception:
+        log.exception("assistant stream failed")
+        inf.final = _sse("error", {"detail": "Upstream error"})
+    finally:
+        if inf.final is None:
+            inf.final = _sse("error", {"detail": "Upstream error"})
+        if _stream_inflight.get(inf.key) is inf:
+            del _stream_inflight[inf.key]
+        inf.notify()
+        await r.aclose()
+        timer.finish()
+        upstream_stats.record(timer, ok=ok)
+
+
+def _start_stream(key: str, input_msgs: List[dict], max_chars: int) -> _StreamInflight:
+    cache_stats["upstream_calls"] += 1
+    inf = _StreamInflight(key=key, max_chars=max_chars, opened=asyncio.get_running_loop().create_future())
+    inf.task = asyncio.create_task(_pump_openai_stream(inf, input_msgs))
+    _stream_inflight[key] = inf
+    return inf
+
+
+def _unsubscribe(inf: _StreamInflight) -> None:
+    inf.subscribers -= 1
+    if inf.subscribers <= 0 and inf.task is not None and not inf.task.done():
+        # убираем ключ сразу: новый одинаковый запрос не должен присоединиться к отменённому
+        if _stream_inflight.get(inf.key) is inf:
+            del _stream_inflight[inf.key]
+        inf.task.cancel()
+
+
+class _SubscriptionResponse(StreamingResponse):
+    """
+    SSE-ответ подписчика: release() — при любом исходе, даже если Starlette
+    так и не начал итерировать генератор (клиент отключился до первого байта)
+    и его finally не выполнится.
+    """
+
+    def __init__(self, content: AsyncIterator[bytes], release, **kwargs):
+        super().__init__(content, **kwargs)
+        self._release = release
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self._release()
+
+
+async def _subscribe_stream(user_id: int, key: str, input_msgs: List[dict], max_chars: int) -> StreamingResponse:
+    """
+    Как _suggest_coalesced, но для стрима: одинаковые запросы читают один
+    апстрим-стрим (присоединившийся получает уже накопленный текст одной дельтой),
+    новый запрос пользователя завершает его старый стрим (event: error),
+    апстрим без подписчиков отменяется.
+
+    Возвращает ответ, когда апстрим открыт: ошибка статуса — обычный 502 до SSE.
+    """
+    me = _supersede(user_id)
+    inf = _stream_inflight.get(key)
+    if inf is None:
+        inf = _start_stream(key, input_msgs, max_chars)
+    else:
+        cache_stats["coalesced"] += 1
+    inf.subscribers += 1
+    # новый запрос пользователя должен разбудить этого подписчика
+    me.add_done_callback(lambda _: inf.notify())
+
+    released = False
+
+    def release() -> None:
+        nonlocal released
+        if not released:
+            released = True
+            _unsubscribe(inf)
+            _release_latest(user_id, me)
+
+    try:
+        await asyncio.wait({inf.opened, me}, return_when=asyncio.FIRST_COMPLETED)
+        if me.done() and not inf.opened.done():
+            cache_stats["superseded"] += 1
+            raise HTTPException(status_code=409, detail="Superseded by a newer suggestion request")
+        inf.opened.result()  # 502 апстрима — всем подписчикам
+    except BaseException:
+        release()
+        raise
+
+    async def events() -> AsyncIterator[bytes]:
+        sent = 0
+        try:
+            while True:
+                wake = inf._wake
+                if len(inf.text) > sent:
+                    yield _sse("delta", {"delta": inf.text[sent:]})
+                    sent = len(inf.text)
+                if inf.final is not None:
+                    yield inf.final
+                    return
+                if me.done():
+                    cache_stats["superseded"] += 1
+                    yield _sse("error", {"detail": "Superseded by a newer suggestion request"})
+                    return
+                await wake.wait()
+        finally:
+            # стрим закончился или клиент отключился: апстрим без подписчиков отменяется сразу
+            release()
+
+    return _SubscriptionResponse(
+        events(),
+        release,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+    )
+
+
 # -------------------------
 # Debug endpoint
 # -------------------------
 @router.get("/debug")
-def debug(user=Depends(get_current_user)):
+def debug(user=Depends(get_principal)):
     key = (getattr(settings, "openai_api_key", "") or "").strip()
     return {
         "has_key": bool(key),
         "key_prefix": (key[:10] + "…" + key[-4:]) if key else "",
         "model": (getattr(settings, "openai_model", "") or ""),
+        "base_url": settings.openai_base_url,
         "min_interval_ms": int(getattr(settings, "assistant_min_interval_ms", 1200)),
         "max_requests_per_minute": int(getattr(settings, "assistant_max_requests_per_minute", 20)),
         "max_output_tokens": int(getattr(settings, "assistant_max_output_tokens", 120)),
+        "upstream": upstream_stats.snapshot(),
+        "cache": {**cache_stats, "size": len(suggestion_cache), "inflight": len(_inflight), "inflight_streams": len(_stream_inflight)},
     }
 
 
 # -------------------------
 # Main endpoint
 # -------------------------
-@router.post("/suggest", response_model=SuggestOut)
-async def suggest(
-    data: SuggestIn,
-    db: Session = Depends(get_db),
-    user=Depends(get_current_user),
-):
-    _rate_limit(int(user.id))
-
-    chat = _ensure_chat_member(db, int(data.chat_id), int(user.id))
+async def _prepare_suggest(data: SuggestIn, db: AsyncSession, user) -> tuple[List[dict], int]:
+    """Проверки + сборка input для апстрима. Возвращает (input_msgs, max_draft)."""
+    chat = await _ensure_chat_member(db, int(data.chat_id), int(user.id))
     other_user_id = _other_id(chat, int(user.id))
-    other = db.get(models.User, other_user_id)
+    other = await db.get(models.User, other_user_id)
     other_username = other.username if other else "user"
 
     draft_raw = data.draft if data.draft is not None else data.text
@@ -239,13 +609,18 @@ async def suggest(
     max_chars = int(getattr(settings, "assistant_max_message_chars", 600))
 
     msgs: List[AssistantMsg] = []
-    for m in (data.messages or [])[: max(0, max_n)]:
-        sender = (m.sender or "").strip().lower()
-        if sender not in ("me", "other"):
-            sender = "other"
-        txt = _clip(m.text or "", max_chars)
-        if txt:
-            msgs.append(AssistantMsg(sender=sender, text=txt))
+    if data.messages is None:
+        for m in await recent_messages(db, int(chat.id)):
+            sender = "me" if m.sender_id == int(user.id) else "other"
+            msgs.append(AssistantMsg(sender=sender, text=m.text))
+    else:
+        for m in data.messages[: max(0, max_n)]:
+            sender = (m.sender or "").strip().lower()
+            if sender not in ("me", "other"):
+                sender = "other"
+            txt = _clip(m.text or "", max_chars)
+            if txt:
+                msgs.append(AssistantMsg(sender=sender, text=txt))
 
     input_msgs = _build_openai_input(
         system_prompt=getattr(settings, "assistant_system_prompt", ""),
@@ -254,11 +629,52 @@ async def suggest(
         context_messages=msgs,
         draft=draft,
     )
+    return input_msgs, max_draft
+
 
-    suggestion = await _call_openai(input_msgs)
+@router.post("/suggest", response_model=SuggestOut, dependencies=_assistant_limits)
+async def suggest(
+    data: SuggestIn,
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_principal),
+):
+    input_msgs, max_draft = await _prepare_suggest(data, db, user)
+    # отпускаем соединение пула на время апстрима (иначе при конкуренции > пула запросы ждут его)
+    await db.rollback()
+
+    # "regen" — пользователь явно просит другой вариант: мимо кэша
+    use_cache = (data.reason or "") != "regen"
+    suggestion = await _suggest_coalesced(int(user.id), input_msgs, use_cache=use_cache)
     suggestion = _clip(suggestion.strip(), max_draft)
 
     if not suggestion:
         raise HTTPException(status_code=502, detail="Empty assistant response")
 
-    return SuggestOut(suggestion=suggestion)
\ No newline at end of file
+    return SuggestOut(suggestion=suggestion)
+
+
+@router.post("/suggest/stream", dependencies=_assistant_limits)
+async def suggest_stream(
+    data: SuggestIn,
+    request: Request,
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_principal),
+):
+    """То же, что /suggest, но токены приходят по мере генерации (text/event-stream)."""
+    input_msgs, max_draft = await _prepare_suggest(data, db, user)
+    await db.rollback()
+
+    # кэш, склейка одинаковых запросов и latest wins — как у /suggest
+    key = _suggest_key(input_msgs)
+    cached = suggestion_cache.get(key) if (data.reason or "") != "regen" else None
+    if cached is not None:
+        cache_stats["hits"] += 1
+        suggestion = _clip(cached, max_draft)
+        return StreamingResponse(
+            iter([_sse("delta", {"delta": suggestion}), _sse("done", {"suggestion": suggestion})]),
+            media_type="text/event-stream",
+            headers={"Cache-Control": "no-store", "X-Accel-Buffering": "no"},
+        )
+    cache_stats["misses"] += 1
+
+    return await _subscribe_stream(int(user.id), key, input_msgs, max_draft)
@@ -1,22 +1,29 @@
 from fastapi import APIRouter, Depends, HTTPException, UploadFile, File as UpFile, Form, Header, Query
 from pydantic import BaseModel
+from sqlalchemy import select, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from backend_app.db import SessionLocal
+from backend_app.db_routing import get_read_db
+from backend_app.deps import get_async_db
 from backend_app import models
-from backend_app.security import hash_password, verify_password, create_access_token, decode_token
+from backend_app.security import (
+    hash_password_async, verify_password_async, create_access_token, signed_file_url,
+)
+from backend_app.auth_cache import authenticate_token, authenticate_token_async, invalidate_user
+from backend_app.config import settings
+from backend_app.ratelimit import rate_limit
 
 router = APIRouter()
 
+_register_limit = rate_limit("register", settings.rate_limit_register, by="ip", detail="Too many registrations")
+_login_limit = rate_limit("login", settings.rate_limit_login, by="ip", detail="Too many login attempts")
+
 ALLOWED_AVATAR_PREFIXES = ("image/",)
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+async def _username_taken(db: AsyncSession, username: str) -> bool:
+    return (await db.scalar(select(models.User.id).where(models.User.username == username).limit(1))) is not None
 
 
 async def read_upload_bytes(upload: UploadFile, max_bytes: int) -> bytes:
@@ -45,32 +52,33 @@ class LoginIn(BaseModel):
     password: str
 
 
-@router.post("/register")
-def register(data: RegisterIn, db: Session = Depends(get_db)):
+@router.post("/register", dependencies=[Depends(_register_limit)])
+async def register(data: RegisterIn, db: AsyncSession = Depends(get_async_db)):
     username = (data.username or "").strip()
     password = (data.password or "").strip()
 
     if not username or not password:
         raise HTTPException(400, "Username and password required")
 
-    if db.query(models.User).filter(models.User.username == username).first():
+    if await _username_taken(db, username):
         raise HTTPException(400, "Username already exists")
+    # отпускаем соединение пула на время bcrypt (иначе шторм выберет весь пул)
+    await db.rollback()
 
-    u = models.User(username=username, password_hash=hash_password(password))
+    u = models.User(username=username, password_hash=await hash_password_async(password))
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
 
     return {"id": u.id, "username": u.username}
 
 
-@router.post("/register_form")
+@router.post("/register_form", dependencies=[Depends(_register_limit)])
 async def register_form(
     username: str = Form(...),
     password: str = Form(...),
     birth_year: int | None = Form(default=None),
     avatar: UploadFile | None = UpFile(default=None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
     username = (username or "").strip()
     password = (password or "").strip()
@@ -78,17 +86,17 @@ async def register_form(
     if not username or not password:
         raise HTTPException(400, "Username and password required")
 
-    if db.query(models.User).filter(models.User.username == username).first():
+    if await _username_taken(db, username):
         raise HTTPException(400, "Username already exists")
+    await db.rollback()
 
     u = models.User(
         username=username,
-        password_hash=hash_password(password),
+        password_hash=await hash_password_async(password),
         birth_year=birth_year,
     )
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
 
     avatar_file_id = None
     if avatar is not None:
@@ -106,14 +114,12 @@ async def register_form(
             path=None,
         )
         db.add(rec)
-        db.commit()
-        db.refresh(rec)
+        await db.flush()
 
         avatar_file_id = rec.id
         u.avatar_file_id = avatar_file_id
         db.add(u)
-        db.commit()
-        db.refresh(u)
+        await db.commit()
 
     token = create_access_token({"sub": str(u.id)})
 
@@ -122,20 +128,42 @@ async def register_form(
         "username": u.username,
         "access_token": token,
         "avatar_file_id": avatar_file_id,
-        "avatar_url": (f"/files/{avatar_file_id}" if avatar_file_id else None),
+        "avatar_url": (signed_file_url(avatar_file_id) if avatar_file_id else None),
     }
 
 
-@router.post("/login")
-def login(data: LoginIn, db: Session = Depends(get_db)):
+@router.post("/login", dependencies=[Depends(_login_limit)])
+async def login(data: LoginIn, db: AsyncSession = Depends(get_async_db)):
     username = (data.username or "").strip()
     password = (data.password or "").strip()
 
-    u = db.query(models.User).filter(models.User.username == username).first()
-    if not u or not verify_password(password, u.password_hash):
+    row = (
+        await db.execute(
+            select(models.User.id, models.User.password_hash)
+            .where(models.User.username == username)
+            .limit(1)
+        )
+    ).first()
+    # отпускаем соединение пула на время bcrypt (иначе шторм выберет весь пул)
+    await db.rollback()
+    if not row:
         raise HTTPException(401, "Invalid credentials")
 
-    token = create_access_token({"sub": str(u.id)})
+    ok, new_hash = await verify_password_async(password, row.password_hash)
+    if not ok:
+        raise HTTPException(401, "Invalid credentials")
+
+    # bcrypt_rounds поменяли — тихо пересчитываем хэш
+    if new_hash:
+        await db.execute(
+            update(models.User)
+            .where(models.User.id == row.id)
+            .values(password_hash=new_hash)
+            .execution_options(synchronize_session=False)
+        )
+        await db.commit()
+
+    token = create_access_token({"sub": str(row.id)})
     return {"access_token": token, "token_type": "bearer"}
 
 
@@ -161,27 +189,17 @@ def _extract_token(token_q: str | None, authorization: str | None) -> str:
 def me(
     token: str | None = Query(default=None),
     authorization: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
-    t = _extract_token(token, authorization)
+    u = authenticate_token(db, _extract_token(token, authorization))
 
-    try:
-        payload = decode_token(t)
-        user_id = int(payload.get("sub")) if isinstance(payload, dict) else int(payload)
-    except Exception:
-        raise HTTPException(401, "Invalid token")
-
-    u = db.get(models.User, user_id)
-    if not u:
-        raise HTTPException(401, "User not found")
-
-    avatar_file_id = getattr(u, "avatar_file_id", None)
+    avatar_file_id = u.avatar_file_id
     return {
         "id": u.id,
         "username": u.username,
         "birth_year": u.birth_year,
         "avatar_file_id": avatar_file_id,
-        "avatar_url": (f"/files/{avatar_file_id}" if avatar_file_id else None),
+        "avatar_url": (signed_file_url(avatar_file_id) if avatar_file_id else None),
     }
 
 
@@ -192,17 +210,12 @@ async def profile_update_form(
     avatar: UploadFile | None = UpFile(default=None),
     token: str | None = Query(default=None),
     authorization: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    t = _extract_token(token, authorization)
-
-    try:
-        payload = decode_token(t)
-        user_id = int(payload.get("sub")) if isinstance(payload, dict) else int(payload)
-    except Exception:
-        raise HTTPException(401, "Invalid token")
+    principal = await authenticate_token_async(db, _extract_token(token, authorization))
 
-    u = db.get(models.User, user_id)
+    # профиль меняем — нужен полный ORM User
+    u = await db.get(models.User, principal.id)
     if not u:
         raise HTTPException(401, "User not found")
 
@@ -226,14 +239,13 @@ async def profile_update_form(
             path=None,
         )
         db.add(rec)
-        db.commit()
-        db.refresh(rec)
+        await db.flush()
 
         u.avatar_file_id = rec.id
 
     db.add(u)
-    db.commit()
-    db.refresh(u)
+    await db.commit()
+    invalidate_user(u.id)
 
     avatar_file_id = getattr(u, "avatar_file_id", None)
     return {
@@ -241,5 +253,5 @@ async def profile_update_form(
         "username": u.username,
         "birth_year": u.birth_year,
         "avatar_file_id": avatar_file_id,
-        "avatar_url": (f"/files/{avatar_file_id}" if avatar_file_id else None),
+        "avatar_url": (signed_file_url(avatar_file_id) if avatar_file_id else None),
     }
\ No newline at end of file
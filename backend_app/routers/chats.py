@@ -1,18 +1,28 @@
 from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
 from pydantic import BaseModel
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
-from sqlalchemy import or_, func
+from sqlalchemy import or_, func, select
 
-from backend_app.deps import get_db, get_current_user
+from backend_app.db_routing import get_read_db, use_primary
+from backend_app.deps import get_async_db, get_db, get_principal
 from backend_app import models
 from backend_app.ws import manager
+from backend_app.chat_window import record_message
+from backend_app.config import settings
+from backend_app.ratelimit import rate_limit
+from backend_app.security import signed_file_url
+from backend_app.sqlite_writer import run_write
+from backend_app.waveform import waveform_out
 
-# ✅ web push sender
-from backend_app.routers.push import send_webpush_to_user
+# ✅ web push (политика: не слать в открытый чат, ждать read receipt)
+from backend_app.push_notify import note_read, notify_new_message
 
 router = APIRouter()
 
+_send_limit = rate_limit("send", settings.rate_limit_send, detail="Too many messages")
+
 
 def user_public(u: models.User) -> dict:
     avatar_file_id = getattr(u, "avatar_file_id", None)
@@ -20,7 +30,7 @@ def user_public(u: models.User) -> dict:
         "id": u.id,
         "username": u.username,
         "avatar_file_id": avatar_file_id,
-        "avatar_url": (f"/files/{avatar_file_id}" if avatar_file_id else None),
+        "avatar_url": (signed_file_url(avatar_file_id) if avatar_file_id else None),
     }
 
 
@@ -48,24 +58,19 @@ def ensure_chat_member(db: Session, chat_id: int, user_id: int) -> models.DMChat
     return chat
 
 
-def other_id(chat: models.DMChat, me: int) -> int:
-    return chat.user2_id if chat.user1_id == me else chat.user1_id
+async def ensure_chat_member_async(db: AsyncSession, chat_id: int, user_id: int) -> models.DMChat:
+    chat = await db.get(models.DMChat, chat_id)
+    if not chat or user_id not in (chat.user1_id, chat.user2_id):
+        raise HTTPException(404, "Chat not found")
+    return chat
 
 
-def msg_to_dict(db: Session, m: models.Message):
-    attaches = (
-        db.query(models.File)
-        .join(models.MessageAttachment, models.File.id == models.MessageAttachment.file_id)
-        .filter(models.MessageAttachment.message_id == m.id)
-        .all()
-    )
+def other_id(chat: models.DMChat, me: int) -> int:
+    return chat.user2_id if chat.user1_id == me else chat.user1_id
 
-    file_ids = [f.id for f in attaches]
-    voice_map: dict[int, models.VoiceMeta] = {}
-    if file_ids:
-        for vm in db.query(models.VoiceMeta).filter(models.VoiceMeta.file_id.in_(file_ids)).all():
-            voice_map[vm.file_id] = vm
 
+def _attachments_out(attaches: list[models.File], voices: list[models.VoiceMeta]) -> list[dict]:
+    voice_map = {vm.file_id: vm for vm in voices}
     out_atts = []
     for f in attaches:
         vm = voice_map.get(f.id)
@@ -74,29 +79,58 @@ def msg_to_dict(db: Session, m: models.Message):
                 "id": f.id,
                 "mime": f.mime,
                 "name": f.original_name,
-                "url": f"/files/{f.id}",
+                "url": signed_file_url(f.id),
                 "kind": ("voice" if (vm is not None) else "file"),
                 "duration_ms": (vm.duration_ms if vm is not None else None),
-                "waveform": (vm.waveform_json if vm is not None else None),
+                "waveform": (waveform_out(vm) if vm is not None else None),
             }
         )
+    return out_atts
 
+
+def _message_out(m: models.Message, attachments: list[dict]) -> dict:
     return {
         "id": m.id,
         "sender_id": m.sender_id,
         "text": m.text,
         "created_at": m.created_at.isoformat(),
-        "attachments": out_atts,
+        "attachments": attachments,
     }
 
 
+def _attachments_query(message_id: int):
+    return (
+        select(models.File)
+        .join(models.MessageAttachment, models.File.id == models.MessageAttachment.file_id)
+        .where(models.MessageAttachment.message_id == message_id)
+    )
+
+
+def msg_to_dict(db: Session, m: models.Message):
+    attaches = list(db.scalars(_attachments_query(m.id)))
+
+    file_ids = [f.id for f in attaches]
+    voices = db.query(models.VoiceMeta).filter(models.VoiceMeta.file_id.in_(file_ids)).all() if file_ids else []
+    return _message_out(m, _attachments_out(attaches, voices))
+
+
+async def msg_to_dict_async(db: AsyncSession, m: models.Message):
+    attaches = list(await db.scalars(_attachments_query(m.id)))
+
+    file_ids = [f.id for f in attaches]
+    voices = []
+    if file_ids:
+        voices = list(await db.scalars(select(models.VoiceMeta).where(models.VoiceMeta.file_id.in_(file_ids))))
+    return _message_out(m, _attachments_out(attaches, voices))
+
+
 def get_read_state(db: Session, chat_id: int, user_id: int) -> int:
     r = db.query(models.DMRead).filter_by(chat_id=chat_id, user_id=user_id).first()
     return r.last_read_message_id if r else 0
 
 
 @router.post("/dm/start")
-def start_dm(data: StartDMIn, db: Session = Depends(get_db), user=Depends(get_current_user)):
+def start_dm(data: StartDMIn, db: Session = Depends(get_db), user=Depends(get_principal)):
     if data.other_user_id == user.id:
         raise HTTPException(400, "Cannot chat with yourself")
 
@@ -120,7 +154,7 @@ def start_dm(data: StartDMIn, db: Session = Depends(get_db), user=Depends(get_cu
 
 
 @router.get("/dm/list")
-def list_dm(db: Session = Depends(get_db), user=Depends(get_current_user)):
+def list_dm(db: Session = Depends(get_read_db), user=Depends(get_principal)):
     chats = (
         db.query(models.DMChat)
         .filter(or_(models.DMChat.user1_id == user.id, models.DMChat.user2_id == user.id))
@@ -159,10 +193,16 @@ def history(
     chat_id: int,
     before_id: int | None = None,
     limit: int = 50,
-    db: Session = Depends(get_db),
-    user=Depends(get_current_user),
+    db: Session = Depends(get_read_db),
+    user=Depends(get_principal),
 ):
-    chat = ensure_chat_member(db, chat_id, user.id)
+    try:
+        chat = ensure_chat_member(db, chat_id, user.id)
+    except HTTPException:
+        # чат только что создан собеседником — реплика могла его ещё не получить
+        if not use_primary(db):
+            raise
+        chat = ensure_chat_member(db, chat_id, user.id)
 
     q = db.query(models.Message).filter(models.Message.chat_id == chat_id)
     if before_id is not None:
@@ -182,43 +222,52 @@ def history(
     }
 
 
-@router.post("/dm/{chat_id}/send")
-async def send(chat_id: int, data: SendMessageIn, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    chat = ensure_chat_member(db, chat_id, user.id)
+@router.post("/dm/{chat_id}/send", dependencies=[Depends(_send_limit)])
+async def send(chat_id: int, data: SendMessageIn, db: AsyncSession = Depends(get_async_db), user=Depends(get_principal)):
+    chat = await ensure_chat_member_async(db, chat_id, user.id)
 
     if (not data.text or not data.text.strip()) and not data.file_ids:
         raise HTTPException(400, "Empty message")
 
-    msg = models.Message(chat_id=chat_id, sender_id=user.id, text=(data.text.strip() if data.text else None))
-    db.add(msg)
-    db.commit()
-    db.refresh(msg)
+    text = data.text.strip() if data.text else None
+    file_ids = list(data.file_ids)
 
-    for fid in data.file_ids:
-        f = db.get(models.File, fid)
-        if f:
-            db.add(models.MessageAttachment(message_id=msg.id, file_id=fid))
-    db.commit()
+    def insert_message(s: Session) -> int:
+        msg = models.Message(chat_id=chat_id, sender_id=user.id, text=text)
+        s.add(msg)
+        s.flush()
+        for fid in file_ids:
+            if s.get(models.File, fid):
+                s.add(models.MessageAttachment(message_id=msg.id, file_id=fid))
+        return msg.id
 
-    message_dict = msg_to_dict(db, msg)
+    msg = await db.get(models.Message, await run_write(db, insert_message))
+
+    message_dict = await msg_to_dict_async(db, msg)
+    # соединение больше не нужно: WS-рассылка идёт без него (close, а не rollback — msg не протухнет)
+    await db.close()
     oid = other_id(chat, user.id)
 
+    # контекст ассистента (скользящее окно чата)
+    record_message(chat_id, msg.id, user.id, msg.text)
+
     payload = {"type": "message:new", "chat_id": chat_id, "message": message_dict}
 
     # ✅ realtime WS
     await manager.send(oid, payload)
 
     # ✅ настоящие web push (если вкладка закрыта/нет WS)
-    # отправляем краткий текст
+    # отправляем краткий текст; когда и нужно ли — решает push_notify
     try:
         body = (message_dict.get("text") or "").strip()
         if not body:
             # если нет текста — покажем что это вложение
             body = "Вложение" if (message_dict.get("attachments") or []) else "Новое сообщение"
 
-        send_webpush_to_user(
-            db,
+        notify_new_message(
             oid,
+            chat_id,
+            msg.id,
             {
                 "type": "message:new",
                 "chat_id": chat_id,
@@ -233,22 +282,29 @@ async def send(chat_id: int, data: SendMessageIn, db: Session = Depends(get_db),
 
 
 @router.post("/dm/{chat_id}/read")
-async def mark_read(chat_id: int, data: ReadIn, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    chat = ensure_chat_member(db, chat_id, user.id)
+async def mark_read(chat_id: int, data: ReadIn, db: AsyncSession = Depends(get_async_db), user=Depends(get_principal)):
+    chat = await ensure_chat_member_async(db, chat_id, user.id)
 
-    m = db.get(models.Message, data.last_read_message_id)
+    m = await db.get(models.Message, data.last_read_message_id)
     if not m or m.chat_id != chat_id:
         raise HTTPException(400, "Invalid message id")
 
-    row = db.query(models.DMRead).filter_by(chat_id=chat_id, user_id=user.id).first()
-    if not row:
-        row = models.DMRead(chat_id=chat_id, user_id=user.id, last_read_message_id=0)
-        db.add(row)
-
-    if data.last_read_message_id > row.last_read_message_id:
+    def advance_read(s: Session) -> tuple[int, bool]:
+        row = s.query(models.DMRead).filter_by(chat_id=chat_id, user_id=user.id).first()
+        current = row.last_read_message_id if row else 0
+        if data.last_read_message_id <= current:
+            return current, False
+        if not row:
+            row = models.DMRead(chat_id=chat_id, user_id=user.id)
+            s.add(row)
         row.last_read_message_id = data.last_read_message_id
         row.updated_at = datetime.utcnow()
-        db.commit()
+        return row.last_read_message_id, True
+
+    last_read, advanced = await run_write(db, advance_read)
+
+    if advanced:
+        note_read(user.id, chat_id, last_read)
 
         oid = other_id(chat, user.id)
         await manager.send(
@@ -257,8 +313,8 @@ async def mark_read(chat_id: int, data: ReadIn, db: Session = Depends(get_db), u
                 "type": "message:read",
                 "chat_id": chat_id,
                 "user_id": user.id,
-                "last_read_message_id": row.last_read_message_id,
+                "last_read_message_id": last_read,
             },
         )
 
-    return {"ok": True, "last_read_message_id": row.last_read_message_id}
\ No newline at end of file
+    return {"ok": True, "last_read_message_id": last_read}
\ No newline at end of file
@@ -1,19 +1,38 @@
 # backend_app/routers/files.py
+import asyncio
+import logging
 import os
+import time
+import uuid
+from datetime import datetime, timedelta
 from io import BytesIO
-from fastapi import APIRouter, Depends, UploadFile, File as UpFile, HTTPException, Query, Header, Form, Request
+from fastapi import APIRouter, Depends, UploadFile, File as UpFile, HTTPException, Query, Header, Form, Request, Response
 from fastapi.responses import StreamingResponse, FileResponse
+from pydantic import BaseModel
+from sqlalchemy import and_, exists, or_, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 
-from backend_app.deps import get_db, get_current_user
+from backend_app.db_routing import get_read_db, use_primary
+from backend_app.deps import get_async_db, get_db, get_principal, get_admin_user
 from backend_app.config import settings
-from backend_app import models
-from backend_app.security import decode_token
+from backend_app.db import SessionLocal
+from backend_app import models, file_gc
+from backend_app.auth_cache import authenticate_token
+from backend_app.ratelimit import rate_limit
+from backend_app.security import verify_file_signature, signed_file_url
+from backend_app.sqlite_writer import run_write
+from backend_app.waveform import normalize_waveform, encode_waveform, waveform_out
 
 router = APIRouter()
+log = logging.getLogger("files")
 
 ALLOWED_PREFIXES = ("image/", "video/", "audio/", "application/", "text/")
 
+# общий лимит на все виды загрузок (обычная, голосовая, resumable-сессия)
+_upload_limit = rate_limit("upload", settings.rate_limit_upload, detail="Too many uploads")
+
 
 def get_max_upload_bytes() -> int:
     mb = getattr(settings, "max_upload_mb", None)
@@ -24,11 +43,11 @@ def get_max_upload_bytes() -> int:
     return mb * 1024 * 1024
 
 
-@router.post("/upload")
+@router.post("/upload", dependencies=[Depends(_upload_limit)])
 async def upload(
     file: UploadFile = UpFile(...),
-    db: Session = Depends(get_db),
-    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_principal),
 ):
     if not file.content_type or not file.content_type.startswith(ALLOWED_PREFIXES):
         raise HTTPException(400, "Unsupported file type")
@@ -50,29 +69,34 @@ async def upload(
         chunks.append(chunk)
 
     data = b"".join(chunks)
+    name = file.filename or "file"
+    mime = file.content_type
+
+    def insert_file(s: Session) -> int:
+        rec = models.File(
+            owner_id=user.id,
+            original_name=name,
+            mime=mime,
+            size=size,
+            data=data,      # ✅ храним bytes в БД
+            path=None,      # ✅ на диск не пишем
+        )
+        s.add(rec)
+        s.flush()
+        return rec.id
 
-    rec = models.File(
-        owner_id=user.id,
-        original_name=file.filename or "file",
-        mime=file.content_type,
-        size=size,
-        data=data,      # ✅ храним bytes в БД
-        path=None,      # ✅ на диск не пишем
-    )
-    db.add(rec)
-    db.commit()
-    db.refresh(rec)
+    file_id = await run_write(db, insert_file)
 
-    return {"file_id": rec.id, "mime": rec.mime, "name": rec.original_name, "size": rec.size}
+    return {"file_id": file_id, "mime": mime, "name": name, "size": size}
 
 
-@router.post("/voice")
+@router.post("/voice", dependencies=[Depends(_upload_limit)])
 async def upload_voice(
     file: UploadFile = UpFile(...),
     duration_ms: int = Form(0),
     waveform: str | None = Form(default=None),
-    db: Session = Depends(get_db),
-    user=Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_principal),
 ):
     """Upload voice message (audio/webm;codecs=opus recommended)."""
     if not file.content_type or not file.content_type.startswith("audio/"):
@@ -92,42 +116,372 @@ async def upload_voice(
         chunks.append(chunk)
 
     data = b"".join(chunks)
+    name = file.filename or "voice.webm"
+    mime = file.content_type or "audio/webm"
+    duration = int(duration_ms or 0)
+    peaks = normalize_waveform(waveform)
+
+    def insert_voice(s: Session) -> int:
+        rec = models.File(
+            owner_id=user.id,
+            original_name=name,
+            mime=mime,
+            size=size,
+            data=data,
+            path=None,
+        )
+        s.add(rec)
+        s.flush()
+        s.add(
+            models.VoiceMeta(
+                file_id=rec.id,
+                duration_ms=duration,
+                waveform=peaks,
+                codec=(file.content_type or "")[:64],
+            )
+        )
+        return rec.id
+
+    file_id = await run_write(db, insert_voice)
+
+    return {"file_id": file_id, "mime": mime, "name": name, "size": size, "duration_ms": duration, "waveform": encode_waveform(peaks)}
+
+
+# -------------------------
+# Resumable uploads (tus-like)
+#   POST   /files/uploads                 -> create session
+#   HEAD   /files/uploads/{id}            -> Upload-Offset
+#   PATCH  /files/uploads/{id}            -> append bytes at Upload-Offset
+#   POST   /files/uploads/{id}/finalize   -> models.File
+#   DELETE /files/uploads/{id}            -> abort
+# -------------------------
+UPLOAD_PIECE_BYTES = 1024 * 1024  # столько пишем в одну строку upload_chunks (и коммитим)
+
+
+class UploadCreateIn(BaseModel):
+    filename: str | None = None
+    mime: str
+    size: int
+
+
+def _upload_headers(sess: models.UploadSession) -> dict[str, str]:
+    return {
+        "Upload-Offset": str(sess.offset),
+        "Upload-Length": str(sess.size),
+        "Cache-Control": "no-store",
+    }
+
+
+def _get_upload_session(db: Session, upload_id: str, user_id: int) -> models.UploadSession:
+    sess = db.get(models.UploadSession, upload_id)
+    if not sess or sess.owner_id != user_id:
+        raise HTTPException(404, "Upload not found")
+    return sess
+
+
+async def _get_upload_session_async(db: AsyncSession, upload_id: str, user_id: int) -> models.UploadSession:
+    sess = await db.get(models.UploadSession, upload_id)
+    if not sess or sess.owner_id != user_id:
+        raise HTTPException(404, "Upload not found")
+    return sess
+
+
+def _delete_upload_sessions(db: Session, upload_ids: list[str]) -> None:
+    if not upload_ids:
+        return
+    db.query(models.UploadChunk).filter(models.UploadChunk.upload_id.in_(upload_ids)).delete(synchronize_session=False)
+    db.query(models.UploadSession).filter(models.UploadSession.id.in_(upload_ids)).delete(synchronize_session=False)
+
+
+@router.post("/uploads", status_code=201, dependencies=[Depends(_upload_limit)])
+def create_upload(data: UploadCreateIn, db: Session = Depends(get_db), user=Depends(get_principal)):
+    mime = (data.mime or "").strip()
+    if not mime or not mime.startswith(ALLOWED_PREFIXES):
+        raise HTTPException(400, "Unsupported file type")
+
+    if data.size <= 0:
+        raise HTTPException(400, "Invalid size")
+
+    max_bytes = get_max_upload_bytes()
+    if max_bytes and data.size > max_bytes:
+        raise HTTPException(400, f"File too large (max {max_bytes // (1024*1024)}MB)")
+
+    now = datetime.utcnow()
+    sess = models.UploadSession(
+        id=uuid.uuid4().hex,
+        owner_id=user.id,
+        original_name=((data.filename or "").strip() or "file")[:255],
+        mime=mime[:128],
+        size=int(data.size),
+        offset=0,
+        created_at=now,
+        updated_at=now,
+    )
+    db.add(sess)
+    db.commit()
+
+    return {
+        "upload_id": sess.id,
+        "location": f"/files/uploads/{sess.id}",
+        "offset": 0,
+        "size": sess.size,
+    }
+
+
+@router.head("/uploads/{upload_id}")
+def upload_offset(upload_id: str, db: Session = Depends(get_db), user=Depends(get_principal)):
+    sess = _get_upload_session(db, upload_id, user.id)
+    return Response(status_code=200, headers=_upload_headers(sess))
+
+
+@router.patch("/uploads/{upload_id}")
+async def upload_chunk(
+    upload_id: str,
+    request: Request,
+    upload_offset: int = Header(..., alias="Upload-Offset"),
+    db: AsyncSession = Depends(get_async_db),
+    user=Depends(get_principal),
+):
+    """
+    Тело запроса — сырые байты (application/offset+octet-stream), начиная с Upload-Offset.
+    Пишем кусками по 1MB и коммитим каждый кусок: если соединение оборвётся,
+    всё принятое до обрыва останется, и клиент продолжит с HEAD-offset.
+    """
+    sess = await _get_upload_session_async(db, upload_id, user.id)
+    if upload_offset != sess.offset:
+        raise HTTPException(409, "Upload-Offset mismatch", headers=_upload_headers(sess))
+
+    offset, size = sess.offset, sess.size
+    # не держим соединение пула, пока клиент шлёт тело (commit/rollback его отпускают)
+    await db.rollback()
+    buf = bytearray()
+
+    async def flush() -> None:
+        nonlocal offset
+        if not buf:
+            return
+        if offset + len(buf) > size:
+            raise HTTPException(400, "Chunk exceeds declared upload length")
+
+        at, piece = offset, bytes(buf)
+
+        def append_piece(s: Session) -> bool:
+            # compare-and-set до вставки куска: параллельный PATCH на тот же offset
+            # проиграет здесь (на Postgres — после ожидания блокировки строки)
+            res = s.execute(
+                update(models.UploadSession)
+                .where(models.UploadSession.id == upload_id, models.UploadSession.offset == at)
+                .values(offset=at + len(piece), updated_at=datetime.utcnow())
+            )
+            if res.rowcount != 1:
+                return False
+            s.add(models.UploadChunk(upload_id=upload_id, offset=at, data=piece))
+            return True
+
+        try:
+            ok = await run_write(db, append_piece)
+        except IntegrityError:
+            ok = False  # uq_upload_chunk: кусок на этот offset уже записал другой PATCH
+        if not ok:
+            await db.refresh(sess)
+            raise HTTPException(409, "Concurrent upload to the same offset", headers=_upload_headers(sess))
+
+        offset += len(piece)
+        buf.clear()
+
+    async for part in request.stream():
+        buf.extend(part)
+        if len(buf) >= UPLOAD_PIECE_BYTES:
+            await flush()
+    await flush()
+
+    await db.refresh(sess)
+    return Response(status_code=204, headers=_upload_headers(sess))
+
+
+@router.post("/uploads/{upload_id}/finalize")
+def finalize_upload(upload_id: str, db: Session = Depends(get_db), user=Depends(get_principal)):
+    sess = _get_upload_session(db, upload_id, user.id)
+    if sess.offset != sess.size:
+        raise HTTPException(409, "Upload is incomplete", headers=_upload_headers(sess))
+
+    chunks = (
+        db.query(models.UploadChunk.offset, models.UploadChunk.data)
+        .filter(models.UploadChunk.upload_id == upload_id)
+        .order_by(models.UploadChunk.offset.asc())
+        .all()
+    )
+    data = b"".join(c.data for c in chunks)
+    if len(data) != sess.size:
+        raise HTTPException(500, "Upload chunks are inconsistent")
 
     rec = models.File(
         owner_id=user.id,
-        original_name=file.filename or "voice.webm",
-        mime=file.content_type or "audio/webm",
-        size=size,
+        original_name=sess.original_name,
+        mime=sess.mime,
+        size=sess.size,
         data=data,
         path=None,
     )
     db.add(rec)
+    _delete_upload_sessions(db, [upload_id])
     db.commit()
     db.refresh(rec)
 
-    meta = models.VoiceMeta(
-        file_id=rec.id,
-        duration_ms=int(duration_ms or 0),
-        waveform_json=waveform,
-        codec=(file.content_type or "")[:64],
-    )
-    db.add(meta)
-    db.commit()
+    return {"file_id": rec.id, "mime": rec.mime, "name": rec.original_name, "size": rec.size}
 
-    return {"file_id": rec.id, "mime": rec.mime, "name": rec.original_name, "size": rec.size, "duration_ms": meta.duration_ms, "waveform": meta.waveform_json}
 
+@router.delete("/uploads/{upload_id}")
+def abort_upload(upload_id: str, db: Session = Depends(get_db), user=Depends(get_principal)):
+    _get_upload_session(db, upload_id, user.id)
+    _delete_upload_sessions(db, [upload_id])
+    db.commit()
+    return {"ok": True}
 
-def _extract_user_id_from_token(db: Session, token: str) -> int:
+
+def expire_upload_sessions(db: Session, batch: int = 100) -> int:
+    """Удаляет брошенные сессии (нет PATCH дольше upload_session_ttl_minutes)."""
+    cutoff = datetime.utcnow() - timedelta(minutes=settings.upload_session_ttl_minutes)
+    total = 0
+    while True:
+        ids = [
+            r.id
+            for r in db.query(models.UploadSession.id)
+            .filter(models.UploadSession.updated_at < cutoff)
+            .limit(batch)
+            .all()
+        ]
+        if not ids:
+            return total
+        _delete_upload_sessions(db, ids)
+        db.commit()
+        total += len(ids)
+
+
+def _expire_upload_sessions_once() -> int:
+    db = SessionLocal()
     try:
-        payload = decode_token(token)
-        user_id = int(payload.get("sub")) if isinstance(payload, dict) else int(payload)
-    except Exception:
-        raise HTTPException(401, "Invalid token")
+        return expire_upload_sessions(db)
+    finally:
+        db.close()
+
+
+async def upload_sessions_janitor() -> None:
+    """Фоновая задача (стартует в main.py): периодически чистит брошенные загрузки."""
+    interval = max(10, int(settings.upload_janitor_interval_seconds))
+    while True:
+        try:
+            n = await asyncio.to_thread(_expire_upload_sessions_once)
+            if n:
+                log.info("expired %d abandoned upload sessions", n)
+        except Exception:
+            log.exception("upload janitor failed")
+        await asyncio.sleep(interval)
+
+
+# -------------------------
+# Batch metadata
+# -------------------------
+FILE_META_MAX_IDS = 500
+
+
+class FileMetaIn(BaseModel):
+    ids: list[int]
+
+
+def _accessible_files_clause(user_id: int):
+    """
+    То же, что user_can_access_file, но одним условием для WHERE:
+    свой файл, чей-то аватар или вложение в чате, где user участник.
+    """
+    in_my_chat = (
+        exists()
+        .where(models.MessageAttachment.file_id == models.File.id)
+        .where(models.Message.id == models.MessageAttachment.message_id)
+        .where(models.DMChat.id == models.Message.chat_id)
+        .where(or_(models.DMChat.user1_id == user_id, models.DMChat.user2_id == user_id))
+    )
+    return or_(
+        models.File.owner_id == user_id,
+        exists().where(models.User.avatar_file_id == models.File.id),
+        in_my_chat,
+    )
 
-    user = db.get(models.User, user_id)
-    if not user:
-        raise HTTPException(401, "Invalid token")
-    return user.id
+
+@router.post("/meta")
+def files_meta(data: FileMetaIn, db: Session = Depends(get_db), user=Depends(get_principal)):
+    """
+    Метаданные пачки файлов без скачивания blob'ов: один SELECT
+    (files + voice_meta, проверка доступа внутри WHERE).
+    Недоступные и несуществующие id не различаем — оба попадают в missing.
+    """
+    ids = list(dict.fromkeys(int(x) for x in data.ids))
+    if len(ids) > FILE_META_MAX_IDS:
+        raise HTTPException(400, f"Too many ids (max {FILE_META_MAX_IDS})")
+    if not ids:
+        return {"items": [], "missing": []}
+
+    rows = (
+        db.query(
+            models.File.id,
+            models.File.mime,
+            models.File.size,
+            models.File.original_name,
+            models.File.created_at,
+            models.VoiceMeta.duration_ms,
+            models.VoiceMeta.waveform,
+            models.VoiceMeta.waveform_json,
+            models.VoiceMeta.id.label("voice_id"),
+        )
+        .outerjoin(models.VoiceMeta, models.VoiceMeta.file_id == models.File.id)
+        .filter(and_(models.File.id.in_(ids), _accessible_files_clause(user.id)))
+        .all()
+    )
+
+    by_id = {r.id: r for r in rows}
+    items = []
+    for fid in ids:
+        r = by_id.get(fid)
+        if r is None:
+            continue
+        is_voice = r.voice_id is not None
+        items.append(
+            {
+                "id": r.id,
+                "mime": r.mime,
+                "size": r.size,
+                "name": r.original_name,
+                "created_at": r.created_at.isoformat(),
+                "url": signed_file_url(r.id),
+                "kind": ("voice" if is_voice else "file"),
+                "duration_ms": (r.duration_ms if is_voice else None),
+                "waveform": (waveform_out(r) if is_voice else None),
+            }
+        )
+
+    return {"items": items, "missing": [fid for fid in ids if fid not in by_id]}
+
+
+# -------------------------
+# Orphaned files GC (admin)
+# -------------------------
+@router.get("/gc/report")
+def gc_report(db: Session = Depends(get_db), admin=Depends(get_admin_user)):
+    return file_gc.dry_run_report(db)
+
+
+@router.get("/gc/stats")
+def gc_stats(admin=Depends(get_admin_user)):
+    return dict(file_gc.GC_STATS)
+
+
+@router.post("/gc/run")
+async def gc_run(admin=Depends(get_admin_user)):
+    return await file_gc.run_gc_pass()
+
+
+def _extract_user_id_from_token(db: Session, token: str) -> int:
+    return authenticate_token(db, token).id
 
 
 def _get_user_id_from_request(
@@ -188,17 +542,39 @@ def download(
     file_id: int,
     request: Request,
     token: str | None = Query(default=None),
+    exp: int | None = Query(default=None),
+    sig: str | None = Query(default=None),
     authorization: str | None = Header(default=None),
     range: str | None = Header(default=None),
-    db: Session = Depends(get_db),
+    db: Session = Depends(get_read_db),
 ):
     """
+    Вариант 0: ?exp=...&sig=... — подписанная ссылка из msg_to_dict/user_public
+               (один HMAC, без JWT и без проверок доступа в БД)
     Вариант 1: Authorization: Bearer <token> (fetch/XHR)
     Вариант 2: ?token=... (для <img>/<video>/<a>)
     Вариант 3: БЕЗ токена — только если это АВАТАР (публичная отдача аватарок)
+
+    Читаем с реплики; "нет файла"/"нет доступа" перепроверяем на primary —
+    файл могли загрузить и отправить только что.
     """
 
+    if exp is not None and sig:
+        if verify_file_signature(file_id, exp, sig):
+            rec = db.get(models.File, file_id)
+            if not rec and use_primary(db):
+                rec = db.get(models.File, file_id)
+            if not rec:
+                raise HTTPException(404, "Not found")
+            max_age = max(0, int(exp - time.time()))
+            return _stream_file(rec, request, range, cache_control=f"private, max-age={max_age}")
+
+        # просроченная/битая подпись (вкладка открыта дольше exp): дальше — обычный путь,
+        # по токену из ссылки/заголовка; без токена пройдут только аватарки
+
     rec = db.get(models.File, file_id)
+    if not rec and use_primary(db):
+        rec = db.get(models.File, file_id)
     if not rec:
         raise HTTPException(404, "Not found")
 
@@ -211,22 +587,32 @@ def download(
     # иначе — нужен токен
     user_id = _get_user_id_from_request(db, token, authorization)
     if user_id is None:
+        if exp is not None and sig:
+            raise HTTPException(403, "Invalid or expired signature")
         raise HTTPException(401, "Missing token")
 
     if not user_can_access_file(db, user_id, file_id):
-        raise HTTPException(403, "Forbidden")
+        if not (use_primary(db) and user_can_access_file(db, user_id, file_id)):
+            raise HTTPException(403, "Forbidden")
 
     return _stream_file(rec, request, range)
 
 
-def _stream_file(rec: models.File, request: Request, range_header: str | None):
+def _stream_file(
+    rec: models.File,
+    request: Request,
+    range_header: str | None,
+    cache_control: str = "no-store",
+):
     """
     Отдаём либо bytes из БД (StreamingResponse),
     либо файл с диска (FileResponse) если вдруг path используется.
     """
     headers = {
         "Content-Disposition": f'inline; filename="{rec.original_name or "file"}"',
-        "Cache-Control": "no-store",  # ✅ чтобы аватарки не залипали в кэше
+        # ✅ no-store по умолчанию, чтобы аватарки не залипали в кэше;
+        # подписанные ссылки уникальны на файл+окно, их можно кэшировать до exp
+        "Cache-Control": cache_control,
         "Accept-Ranges": "bytes",
     }
 
@@ -1,44 +1,107 @@
-from fastapi import APIRouter, Depends, HTTPException
+import hashlib
+import json
+
+from fastapi import APIRouter, Depends, HTTPException, Header, Response
 from pydantic import BaseModel
 from sqlalchemy.orm import Session
 
-from backend_app.deps import get_db, get_current_user
-from backend_app import models
+from backend_app.db_routing import get_read_db
+from backend_app.deps import get_db, get_current_user, get_principal
+from backend_app.auth_cache import invalidate_user
+from backend_app import models, user_search
+from backend_app.config import settings
+from backend_app.security import signed_file_url
+from backend_app.routers.chats import user_public
+from backend_app.ws import manager
 
 router = APIRouter()
 
 
 @router.get("/search")
-def search_users(q: str, db: Session = Depends(get_db), user=Depends(get_current_user)):
-    query = (q or "").strip()
+def search_users(q: str, db: Session = Depends(get_read_db), user=Depends(get_principal)):
+    query = (q or "").strip()[:64]
     if not query:
         return []
 
-    rows = (
-        db.query(models.User)
-        .filter(models.User.username.contains(query))
-        .order_by(models.User.username.asc())
-        .limit(20)
-        .all()
-    )
+    cache_key = (user.id, query)
+    if settings.user_search_cache_ttl_seconds > 0:
+        cached = user_search.search_cache.get(cache_key)
+        if cached is not None:
+            return cached
 
     out = []
-    for r in rows:
-        if r.id == user.id:
-            continue
-
+    for r in user_search.search_users(db, query, exclude_id=user.id, limit=20):
         avatar_file_id = getattr(r, "avatar_file_id", None)
         out.append(
             {
                 "id": r.id,
                 "username": r.username,
                 "avatar_file_id": avatar_file_id,
-                "avatar_url": (f"/files/{avatar_file_id}" if avatar_file_id else None),
+                "avatar_url": (signed_file_url(avatar_file_id) if avatar_file_id else None),
             }
         )
+
+    if settings.user_search_cache_ttl_seconds > 0:
+        user_search.search_cache.put(cache_key, out)
     return out
 
 
+USERS_BATCH_MAX_IDS = 500
+
+
+class UsersBatchIn(BaseModel):
+    ids: list[int]
+
+
+def _etag_matches(etag: str, if_none_match: str) -> bool:
+    """If-None-Match: слабое сравнение (браузеры и прокси возвращают W/"..."), "*" — любой."""
+    tokens = [t.strip() for t in if_none_match.split(",")]
+    return "*" in tokens or any(t.removeprefix("W/") == etag for t in tokens)
+
+
+@router.post("/batch")
+def users_batch(
+    data: UsersBatchIn,
+    if_none_match: str | None = Header(default=None),
+    db: Session = Depends(get_db),
+    user=Depends(get_principal),
+):
+    """
+    user_public + online для пачки пользователей одним запросом.
+    ETag считается по содержимому ответа: если профили/статусы не менялись
+    (и не сменилось окно подписи avatar_url) — 304 без тела.
+    """
+    ids = list(dict.fromkeys(int(x) for x in data.ids))
+    if len(ids) > USERS_BATCH_MAX_IDS:
+        raise HTTPException(400, f"Too many ids (max {USERS_BATCH_MAX_IDS})")
+
+    rows = []
+    if ids:
+        rows = (
+            db.query(models.User.id, models.User.username, models.User.avatar_file_id)
+            .filter(models.User.id.in_(ids))
+            .all()
+        )
+
+    by_id = {r.id: r for r in rows}
+    items = []
+    for uid in ids:
+        r = by_id.get(uid)
+        if r is None:
+            continue
+        items.append({**user_public(r), "online": manager.is_online(r.id)})
+
+    body = {"items": items, "missing": [uid for uid in ids if uid not in by_id]}
+    raw = json.dumps(body, ensure_ascii=False, separators=(",", ":"), sort_keys=True).encode("utf-8")
+    etag = '"' + hashlib.sha1(raw).hexdigest() + '"'
+
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if if_none_match and _etag_matches(etag, if_none_match):
+        return Response(status_code=304, headers=headers)
+
+    return Response(content=raw, media_type="application/json", headers=headers)
+
+
 class UpdateMeIn(BaseModel):
     birth_year: int | None = None
     avatar_file_id: int | None = None
@@ -72,6 +135,7 @@ def update_me(data: UpdateMeIn, db: Session = Depends(get_db), user=Depends(get_
     db.add(user)
     db.commit()
     db.refresh(user)
+    invalidate_user(user.id)
 
     avatar_file_id = getattr(user, "avatar_file_id", None)
     return {
@@ -79,5 +143,5 @@ def update_me(data: UpdateMeIn, db: Session = Depends(get_db), user=Depends(get_
         "username": user.username,
         "birth_year": user.birth_year,
         "avatar_file_id": avatar_file_id,
-        "avatar_url": (f"/files/{avatar_file_id}" if avatar_file_id else None),
+        "avatar_url": (signed_file_url(avatar_file_id) if avatar_file_id else None),
     }
\ No newline at end of file
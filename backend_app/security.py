@@ -1,12 +1,28 @@
+import asyncio
+import base64
+import hashlib
+import hmac
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Any, Dict
+from functools import lru_cache
+from typing import Any, Dict, Optional, Tuple
 
+from fastapi import HTTPException
 from jose import jwt
 from passlib.context import CryptContext
 
 from backend_app.config import settings
 
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# min=max=default: хэш с другой стоимостью считается устаревшим (rehash при логине)
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=settings.bcrypt_rounds,
+    bcrypt__min_rounds=settings.bcrypt_rounds,
+    bcrypt__max_rounds=settings.bcrypt_rounds,
+)
 
 
 def _bcrypt_safe_password(password: str) -> str:
@@ -40,6 +56,71 @@ def verify_password(password: str, password_hash: str) -> bool:
     return pwd_context.verify(pw, password_hash)
 
 
+# =========================
+# Bounded bcrypt pool
+# =========================
+# bcrypt отпускает GIL, поэтому хватает тредов. Пул отдельный от threadpool
+# FastAPI/anyio, чтобы шторм логинов не занимал треды остальных sync-роутов.
+_hash_pool = ThreadPoolExecutor(
+    max_workers=max(1, settings.password_hash_workers),
+    thread_name_prefix="pwhash",
+)
+_hash_pending = 0
+_hash_pending_lock = threading.Lock()
+
+
+def _hash_slot_acquire() -> None:
+    global _hash_pending
+    limit = max(1, settings.password_hash_workers) + max(0, settings.password_hash_max_queue)
+    with _hash_pending_lock:
+        if _hash_pending >= limit:
+            raise HTTPException(
+                status_code=503,
+                detail="Auth is busy, try again",
+                headers={"Retry-After": "1"},
+            )
+        _hash_pending += 1
+
+
+def _hash_slot_release() -> None:
+    global _hash_pending
+    with _hash_pending_lock:
+        _hash_pending -= 1
+
+
+async def _run_hash(fn, *args):
+    _hash_slot_acquire()
+    try:
+        return await asyncio.get_running_loop().run_in_executor(_hash_pool, fn, *args)
+    finally:
+        _hash_slot_release()
+
+
+def password_hash_queue_depth() -> int:
+    return _hash_pending
+
+
+async def hash_password_async(password: str) -> str:
+    return await _run_hash(hash_password, password)
+
+
+def _verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    pw = _bcrypt_safe_password(password)
+    try:
+        return pwd_context.verify_and_update(pw, password_hash)
+    except (ValueError, TypeError):
+        # битый/неизвестный хэш в БД — просто неверный пароль
+        return False, None
+
+
+async def verify_password_async(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """
+    (ok, new_hash): new_hash != None, если пароль верный, но хэш сделан
+    с другой стоимостью — его нужно сохранить вместо старого.
+    """
+    return await _run_hash(_verify_and_update, password, password_hash)
+
+
 def create_token(user_id: int) -> str:
     expire = datetime.utcnow() + timedelta(minutes=settings.access_token_expire_minutes)
     payload = {"sub": str(user_id), "exp": expire}
@@ -69,4 +150,61 @@ def create_access_token(payload: Dict[str, Any]) -> str:
 
 
 def decode_token(token: str) -> Any:
-    return jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
\ No newline at end of file
+    return jwt.decode(token, settings.jwt_secret, algorithms=[settings.jwt_algorithm])
+
+
+# =========================
+# Signed media URLs
+# =========================
+@lru_cache(maxsize=1)
+def _media_url_keys() -> tuple[tuple[str, bytes], ...]:
+    """
+    Ключи для подписи ссылок на файлы: ((kid, secret), ...).
+    Первый — активный (им подписываем), остальные принимаются при проверке.
+    """
+    keys: list[tuple[str, bytes]] = []
+    for part in (settings.media_url_keys or "").split(","):
+        kid, sep, secret = part.strip().partition(":")
+        kid, secret = kid.strip(), secret.strip()
+        if sep and kid and secret and "." not in kid:
+            keys.append((kid, secret.encode("utf-8")))
+
+    if not keys:
+        # dev fallback: отдельный ключ, выведенный из jwt_secret
+        derived = hmac.new(settings.jwt_secret.encode("utf-8"), b"media-url", hashlib.sha256).digest()
+        keys.append(("0", derived))
+    return tuple(keys)
+
+
+@lru_cache(maxsize=1)
+def _media_url_keys_by_kid() -> Dict[str, bytes]:
+    return dict(_media_url_keys())
+
+
+def _media_mac(key: bytes, file_id: int, exp: int) -> str:
+    mac = hmac.new(key, f"{int(file_id)}.{int(exp)}".encode("ascii"), hashlib.sha256).digest()
+    return base64.urlsafe_b64encode(mac[:18]).rstrip(b"=").decode("ascii")
+
+
+def signed_file_url(file_id: int) -> str:
+    """
+    /files/{id}?exp=...&sig=<kid>.<mac>
+    exp выравнивается по ttl, поэтому в пределах окна ссылка одинаковая
+    (браузер может её кэшировать) и остаётся валидной минимум ttl секунд.
+    """
+    ttl = max(int(settings.media_url_ttl_seconds), 60)
+    exp = (int(time.time()) // ttl + 2) * ttl
+    kid, key = _media_url_keys()[0]
+    return f"/files/{int(file_id)}?exp={exp}&sig={kid}.{_media_mac(key, file_id, exp)}"
+
+
+def verify_file_signature(file_id: int, exp: int, sig: str) -> bool:
+    if int(exp) < time.time():
+        return False
+
+    kid, sep, mac = (sig or "").partition(".")
+    key = _media_url_keys_by_kid().get(kid)
+    if not sep or not mac or key is None:
+        return False
+
+    return hmac.compare_digest(mac, _media_mac(key, file_id, exp))
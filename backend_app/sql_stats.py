@@ -0,0 +1,270 @@
+# backend_app/sql_stats.py
+"""
+Сколько SQL делает каждый HTTP-запрос.
+
+Хуки before/after_cursor_execute на движках (engine, async_engine, реплики,
+писатель SQLite) пишут каждый запрос в RequestSQL текущего запроса — он лежит
+в contextvar, и def-роуты в threadpool, AsyncSession и записи через
+sqlite_writer видят тот же объект.
+
+SQLStatsMiddleware по окончании запроса:
+- копит агрегаты по шаблону роута в SQL_STATS (GET /debug/sql для админов):
+  запросы, время в БД, максимум запросов, самый медленный statement, N+1;
+- в dev (только при явном sql_stats_headers=true) добавляет заголовки
+  X-SQL-Count, X-SQL-Time-Ms, X-SQL-Slowest-Ms, X-SQL-Slowest, X-SQL-Repeated
+  и Server-Timing (видно во вкладке Network браузера); в них текст SQL,
+  поэтому в проде не включать;
+- запросы дольше sql_slow_request_ms в БД — в лог.
+
+N+1: одна и та же форма запроса (SQL с точностью до длины IN-списка)
+sql_repeat_threshold и больше раз за запрос — предупреждение в лог и счётчик.
+
+В тестах и бенчах:
+
+    with assert_max_queries(5):
+        client.get(f"/chats/dm/{chat_id}/messages", headers=h)
+
+считает все запросы процесса внутри блока и падает с AssertionError, если их
+больше бюджета или есть повторяющиеся формы (allow_repeats=True — не проверять).
+"""
+from __future__ import annotations
+
+import contextvars
+import logging
+import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from backend_app.config import settings
+from backend_app.db import async_engine, engine, replica_engines
+
+log = logging.getLogger("sql_stats")
+
+_IN_LIST = re.compile(r"\(\s*(?:\?|%\(\w+\)s|\$\d+|:\w+)(?:\s*,\s*(?:\?|%\(\w+\)s|\$\d+|:\w+))+\s*\)")
+_SPACES = re.compile(r"\s+")
+
+
+def statement_shape(sql: str) -> str:
+    """SQL без лишних пробелов и с IN (?, ?, ?) -> IN (?...)."""
+    return _IN_LIST.sub("(?...)", _SPACES.sub(" ", sql).strip())
+
+
+class RequestSQL:
+    """Запросы одного HTTP-запроса (или блока assert_max_queries)."""
+
+    def __init__(self):
+        self.count = 0
+        self.total_ms = 0.0
+        self.slowest_ms = 0.0
+        self.slowest_sql = ""
+        self.statements: Counter[str] = Counter()
+        self.closed = False
+
+    def add(self, statement: str, ms: float) -> None:
+        if self.closed:
+            return  # задача, созданная запросом, пережила его
+        self.count += 1
+        self.total_ms += ms
+        self.statements[statement] += 1
+        if ms > self.slowest_ms:
+            self.slowest_ms = ms
+            self.slowest_sql = statement
+
+    def repeated(self, threshold: Optional[int] = None) -> dict[str, int]:
+        """Формы запросов, повторившиеся threshold и больше раз (вероятный N+1)."""
+        threshold = threshold or max(2, settings.sql_repeat_threshold)
+        shapes: Counter[str] = Counter()
+        for sql, n in self.statements.items():
+            shapes[statement_shape(sql)] += n
+        return {sql: n for sql, n in shapes.most_common() if n >= threshold}
+
+
+_current: contextvars.ContextVar[Optional[RequestSQL]] = contextvars.ContextVar("sql_stats", default=None)
+_captures: list[RequestSQL] = []
+
+
+# =========================
+# Хуки на движки
+# =========================
+# t0 — на контексте выполнения: он живёт ровно один statement, и запрос,
+# упавший с ошибкой (after_cursor_execute не вызывается), ничего не оставляет
+def _before(conn, cursor, statement, parameters, context, executemany) -> None:
+    if context is not None:
+        context._sql_stats_t0 = time.perf_counter()
+    else:
+        conn.info["sql_stats_t0"] = time.perf_counter()
+
+
+def _after(conn, cursor, statement, parameters, context, executemany) -> None:
+    t0 = getattr(context, "_sql_stats_t0", None) if context is not None else conn.info.pop("sql_stats_t0", None)
+    if t0 is None:
+        return
+    ms = (time.perf_counter() - t0) * 1000
+    cur = _current.get()
+    if cur is not None:
+        cur.add(statement, ms)
+    for cap in list(_captures):
+        cap.add(statement, ms)
+
+
+def instrument(eng: Engine) -> None:
+    if settings.sql_stats_enabled and not event.contains(eng, "before_cursor_execute", _before):
+        event.listen(eng, "before_cursor_execute", _before)
+        event.listen(eng, "after_cursor_execute", _after)
+
+
+for _eng in (engine, async_engine.sync_engine, *replica_engines):
+    instrument(_eng)
+
+
+# =========================
+# Агрегаты по роутам
+# =========================
+SQL_STATS: dict[str, dict] = {}
+_stats_lock = threading.Lock()
+
+
+def _record(route: str, rq: RequestSQL, repeated: dict[str, int]) -> None:
+    with _stats_lock:
+        s = SQL_STATS.get(route)
+        if s is None:
+            s = SQL_STATS[route] = {
+                "requests": 0,
+                "queries": 0,
+                "db_ms": 0.0,
+                "max_queries": 0,
+                "slowest_ms": 0.0,
+                "slowest_sql": "",
+                "n_plus_one_requests": 0,
+                "n_plus_one_shapes": {},
+            }
+        s["requests"] += 1
+        s["queries"] += rq.count
+        s["db_ms"] += rq.total_ms
+        s["max_queries"] = max(s["max_queries"], rq.count)
+        if rq.slowest_ms > s["slowest_ms"]:
+            s["slowest_ms"] = rq.slowest_ms
+            s["slowest_sql"] = statement_shape(rq.slowest_sql)
+        if repeated:
+            s["n_plus_one_requests"] += 1
+            shapes = s["n_plus_one_shapes"]
+            for sql, n in repeated.items():
+                if sql in shapes or len(shapes) < 10:
+                    shapes[sql] = max(shapes.get(sql, 0), n)
+
+
+def snapshot() -> dict:
+    """Для GET /debug/sql: роуты по суммарному времени в БД."""
+    with _stats_lock:
+        rows = [(route, dict(s, n_plus_one_shapes=dict(s["n_plus_one_shapes"]))) for route, s in SQL_STATS.items()]
+    rows.sort(key=lambda r: r[1]["db_ms"], reverse=True)
+    out = {}
+    for route, s in rows:
+        s["avg_queries"] = round(s["queries"] / s["requests"], 2) if s["requests"] else 0
+        s["db_ms"] = round(s["db_ms"], 2)
+        s["slowest_ms"] = round(s["slowest_ms"], 2)
+        out[route] = s
+    return out
+
+
+def reset() -> None:
+    with _stats_lock:
+        SQL_STATS.clear()
+
+
+def _header_value(s: str, limit: int = 200) -> bytes:
+    return statement_shape(s)[:limit].encode("latin-1", "replace")
+
+
+def _route_name(scope) -> str:
+    """"GET /chats/dm/{chat_id}/messages": шаблон роута, а не путь с id (иначе агрегаты не сложатся)."""
+    path = scope.get("path", "")
+    tmpl = getattr(scope.get("route"), "path", None)
+    if not tmpl:
+        return f'{scope["method"]} <unmatched>'
+    # роут из include_router может знать только свой путь, без prefix — берём prefix из самого пути
+    extra = path.count("/") - tmpl.count("/")
+    if extra > 0:
+        tmpl = "/".join(path.split("/")[: extra + 1]) + tmpl
+    return f'{scope["method"]} {tmpl}'
+
+
+class SQLStatsMiddleware:
+    """ASGI: RequestSQL на каждый HTTP-запрос, агрегаты, dev-заголовки, лог медленных/N+1."""
+
+    def __init__(self, app):
+        self.app = app
+        self.headers = settings.sql_stats_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        rq = RequestSQL()
+        token = _current.set(rq)
+
+        async def send_with_headers(message):
+            # к моменту заголовков ответа роут уже отработал (кроме стриминга тела)
+            if message["type"] == "http.response.start":
+                repeated = rq.repeated()
+                headers = list(message.get("headers", []))
+                headers += [
+                    (b"x-sql-count", str(rq.count).encode()),
+                    (b"x-sql-time-ms", f"{rq.total_ms:.2f}".encode()),
+                    (b"x-sql-slowest-ms", f"{rq.slowest_ms:.2f}".encode()),
+                    (b"server-timing", f'db;dur={rq.total_ms:.2f};desc="{rq.count} queries"'.encode()),
+                ]
+                if rq.slowest_sql:
+                    headers.append((b"x-sql-slowest", _header_value(rq.slowest_sql)))
+                if repeated:
+                    sql, n = next(iter(repeated.items()))
+                    headers.append((b"x-sql-repeated", f"{n}x ".encode() + _header_value(sql)))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers if self.headers else send)
+        finally:
+            _current.reset(token)
+            rq.closed = True
+            name = _route_name(scope)
+            repeated = rq.repeated()
+            _record(name, rq, repeated)
+            if repeated:
+                sql, n = next(iter(repeated.items()))
+                log.warning("possible N+1 in %s: %s queries, %sx %s", name, rq.count, n, statement_shape(sql)[:300])
+            if settings.sql_slow_request_ms > 0 and rq.total_ms >= settings.sql_slow_request_ms:
+                log.warning(
+                    "slow db in %s: %s queries, %.1f ms (slowest %.1f ms: %s)",
+                    name, rq.count, rq.total_ms, rq.slowest_ms, statement_shape(rq.slowest_sql)[:300],
+                )
+
+
+# =========================
+# Тесты / бенчи
+# =========================
+@contextmanager
+def assert_max_queries(budget: int, *, allow_repeats: bool = False) -> Iterator[RequestSQL]:
+    """Все запросы процесса внутри блока: больше budget или N+1 -> AssertionError."""
+    cap = RequestSQL()
+    _captures.append(cap)
+    try:
+        yield cap
+    finally:
+        _captures.remove(cap)
+
+    problems = []
+    if cap.count > budget:
+        problems.append(f"{cap.count} queries > budget {budget}")
+    repeated = {} if allow_repeats else cap.repeated()
+    for sql, n in repeated.items():
+        problems.append(f"repeated {n}x: {sql}")
+    if problems:
+        listing = "\n".join(f"  {n}x {statement_shape(sql)}" for sql, n in cap.statements.most_common())
+        raise AssertionError("; ".join(problems) + "\n" + listing)
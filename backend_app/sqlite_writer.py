@@ -0,0 +1,208 @@
+# backend_app/sqlite_writer.py
+"""
+Единственный писатель для SQLite.
+
+SQLite пропускает одну пишущую транзакцию за раз: при конкурентных
+send/mark_read/upload транзакции стоят в busy_timeout, ловят
+"database is locked", и каждая платит свой commit (fsync).
+
+Здесь все записи горячих путей идут в очередь одного потока-писателя со своим
+соединением. Писатель берёт из очереди пачку (до sqlite_writer_batch_size,
+подождав попутчиков sqlite_writer_batch_wait_ms) и выполняет её одной
+транзакцией BEGIN IMMEDIATE: каждая запись — в своём SAVEPOINT (ошибка одной
+откатывает только её), commit — один на пачку. Читатели в WAL писателя не ждут.
+
+Запись — sync-функция fn(Session) -> результат (id, числа; не ORM-объекты:
+сессия писателя закрывается после пачки). В async-роутах:
+
+    msg_id = await run_write(db, _insert_message)
+
+Если писатель выключен или БД не SQLite (Postgres), run_write выполняет ту же
+fn на сессии запроса (AsyncSession.run_sync) и коммитит её — код роутов один.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextvars
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+from typing import Any, Callable, Optional, TypeVar
+
+from sqlalchemy import create_engine, event, make_url
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import StaticPool
+
+from backend_app.config import settings
+from backend_app.db import DATABASE_URL, IS_SQLITE, apply_sqlite_pragmas
+from backend_app.sql_stats import instrument
+
+log = logging.getLogger("sqlite_writer")
+
+T = TypeVar("T")
+
+_STOP = object()
+
+
+class SQLiteWriter:
+    def __init__(self, url: str, batch_size: int, batch_wait_ms: float):
+        self.batch_size = max(1, batch_size)
+        self.batch_wait = max(0.0, batch_wait_ms) / 1000
+        # одно соединение на весь процесс, живёт в потоке писателя
+        self.engine = create_engine(
+            url,
+            poolclass=StaticPool,
+            connect_args={"check_same_thread": False},
+        )
+        event.listen(self.engine, "connect", self._on_connect)
+        event.listen(self.engine, "begin", self._on_begin)
+        instrument(self.engine)
+
+        self._q: "queue.SimpleQueue[Any]" = queue.SimpleQueue()
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {"jobs": 0, "batches": 0, "max_batch": 0, "failed_jobs": 0, "failed_batches": 0}
+
+    # pysqlite сам решает, когда открыть транзакцию, и ломает SAVEPOINT —
+    # отключаем это и открываем транзакцию сами, сразу с блокировкой записи
+    @staticmethod
+    def _on_connect(dbapi_connection, record) -> None:
+        apply_sqlite_pragmas(dbapi_connection, record)
+        dbapi_connection.isolation_level = None
+
+    @staticmethod
+    def _on_begin(conn) -> None:
+        conn.exec_driver_sql("BEGIN IMMEDIATE")
+
+    def start(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+                self._thread.start()
+
+    def stop(self, timeout: float = 5.0) -> None:
+        """Дописывает уже поставленное в очередь и останавливает поток."""
+        with self._lock:
+            th, self._thread = self._thread, None
+        if th is not None:
+            self._q.put(_STOP)
+            th.join(timeout=timeout)
+        self.engine.dispose()
+
+    def submit(self, fn: Callable[[Session], T]) -> "Future[T]":
+        if self._thread is None:
+            self.start()
+        fut: Future = Future()
+        # контекст отправителя — чтобы SQL записи засчитался его запросу (sql_stats)
+        self._q.put((fut, fn, contextvars.copy_context()))
+        return fut
+
+    def pending(self) -> int:
+        return self._q.qsize()
+
+    def _run(self) -> None:
+        while True:
+            job = self._q.get()
+            if job is _STOP:
+                return
+            batch = [job]
+            deadline = time.monotonic() + self.batch_wait
+            stop = False
+            while len(batch) < self.batch_size:
+                left = deadline - time.monotonic()
+                try:
+                    job = self._q.get(timeout=left) if left > 0 else self._q.get_nowait()
+                except queue.Empty:
+                    break
+                if job is _STOP:
+                    stop = True
+                    break
+                batch.append(job)
+            self._apply(batch)
+            if stop:
+                return
+
+    def _apply(self, batch: list[tuple[Future, Callable[[Session], Any], contextvars.Context]]) -> None:
+        done: list[tuple[Future, Any]] = []
+        db = Session(bind=self.engine, autoflush=False, expire_on_commit=False)
+        try:
+            for fut, fn, ctx in batch:
+                if not fut.set_running_or_notify_cancel():
+                    continue
+                try:
+                    with db.begin_nested():
+                        res = ctx.run(fn, db)
+                except Exception as e:
+                    self.stats["failed_jobs"] += 1
+                    fut.set_exception(e)
+                    continue
+                done.append((fut, res))
+            db.commit()
+        except Exception as e:
+            self.stats["failed_batches"] += 1
+            log.exception("sqlite writer batch failed (%s jobs)", len(done))
+            try:
+                db.rollback()
+            except Exception:
+                pass
+            for fut, _ in done:
+                fut.set_exception(e)
+            return
+        finally:
+            db.close()
+
+        self.stats["jobs"] += len(batch)
+        self.stats["batches"] += 1
+        self.stats["max_batch"] = max(self.stats["max_batch"], len(batch))
+        for fut, res in done:
+            fut.set_result(res)
+
+
+_writer: Optional[SQLiteWriter] = None
+_writer_lock = threading.Lock()
+
+
+def get_writer() -> Optional[SQLiteWriter]:
+    """Писатель процесса; None — пишем как обычно (не SQLite или выключено)."""
+    global _writer
+    if not (IS_SQLITE and settings.sqlite_single_writer):
+        return None
+    if make_url(DATABASE_URL).database in (None, "", ":memory:"):
+        return None  # у писателя своё соединение — с in-memory БД оно увидит другую базу
+    if _writer is None:
+        with _writer_lock:
+            if _writer is None:
+                _writer = SQLiteWriter(
+                    DATABASE_URL,
+                    batch_size=settings.sqlite_writer_batch_size,
+                    batch_wait_ms=settings.sqlite_writer_batch_wait_ms,
+                )
+    return _writer
+
+
+def stop_writer() -> None:
+    global _writer
+    with _writer_lock:
+        w, _writer = _writer, None
+    if w is not None:
+        w.stop()
+
+
+async def run_write(db: AsyncSession, fn: Callable[[Session], T]) -> T:
+    """Выполняет запись fn и коммитит её; возвращает результат fn."""
+    w = get_writer()
+    if w is None:
+        try:
+            res = await db.run_sync(fn)
+            await db.commit()
+        except BaseException:
+            await db.rollback()
+            raise
+        return res
+    # отпускаем соединение запроса (и его снимок чтения) — дальше читаем уже записанное
+    await db.commit()
+    return await asyncio.wrap_future(w.submit(fn))
+
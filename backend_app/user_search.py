@@ -0,0 +1,166 @@
+# backend_app/user_search.py
+"""
+Поиск пользователей по username для /users/search.
+
+1) префикс без учёта регистра: диапазон lower(username) >= q AND < q+'\U0010ffff'
+   по btree-индексу ix_users_username_lower (LIKE '%q%' индекс не использует);
+2) подстрока, если префиксных совпадений не хватило:
+   - Postgres: pg_trgm + GIN-индекс, ранжирование по similarity();
+   - SQLite: FTS5-таблица users_fts с tokenize='trigram', синхронизируется триггерами;
+   - запрос короче 3 символов (триграммам не хватает) или индекса нет: ILIKE '%q%'.
+
+Порядок выдачи: точное совпадение, префиксы (короче — выше), подстроки.
+Ответы можно кэшировать на несколько секунд (user_search_cache_ttl_seconds).
+"""
+from __future__ import annotations
+
+import logging
+
+from sqlalchemy import case, func, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from backend_app import models
+from backend_app.cache import TTLCache
+from backend_app.config import settings
+
+log = logging.getLogger("user_search")
+
+MIN_TRIGRAM_QUERY = 3
+
+# "pg_trgm" | "fts5" | "like" — определяется в ensure_search_indexes()
+_substring_backend = "like"
+
+_SQLITE_FTS_DDL = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS users_fts
+    USING fts5(username, content='users', content_rowid='id', tokenize='trigram')
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ai AFTER INSERT ON users BEGIN
+        INSERT INTO users_fts(rowid, username) VALUES (new.id, new.username);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_ad AFTER DELETE ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS users_fts_au AFTER UPDATE OF username ON users BEGIN
+        INSERT INTO users_fts(users_fts, rowid, username) VALUES ('delete', old.id, old.username);
+        INSERT INTO users_fts(rowid, username) VALUES (new.id, new.username);
+    END
+    """,
+]
+
+
+def ensure_search_indexes(engine: Engine) -> str:
+    """Идемпотентно создаёт индексы поиска под текущую БД. Вызывается на старте."""
+    global _substring_backend
+
+    dialect = engine.dialect.name
+    try:
+        # префиксный поиск без учёта регистра (выражение — как в _prefix_users)
+        with engine.begin() as conn:
+            conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_username_lower ON users (lower(username))"))
+    except Exception as e:
+        log.warning("user search: lower(username) index unavailable (%s)", e)
+
+    try:
+        if dialect == "postgresql":
+            with engine.begin() as conn:
+                conn.execute(text("CREATE EXTENSION IF NOT EXISTS pg_trgm"))
+                conn.execute(text(
+                    "CREATE INDEX IF NOT EXISTS ix_users_username_trgm "
+                    "ON users USING gin (username gin_trgm_ops)"
+                ))
+            _substring_backend = "pg_trgm"
+
+        elif dialect == "sqlite":
+            with engine.begin() as conn:
+                existed = conn.execute(text(
+                    "SELECT 1 FROM sqlite_master WHERE type='table' AND name='users_fts'"
+                )).first() is not None
+                for ddl in _SQLITE_FTS_DDL:
+                    conn.execute(text(ddl))
+                if not existed:
+                    conn.execute(text("INSERT INTO users_fts(users_fts) VALUES ('rebuild')"))
+            _substring_backend = "fts5"
+
+    except Exception as e:
+        # нет прав на расширение / SQLite без fts5 trigram — работаем по-старому
+        log.warning("user search: trigram index unavailable (%s), falling back to LIKE", e)
+        _substring_backend = "like"
+
+    return _substring_backend
+
+
+def substring_backend() -> str:
+    return _substring_backend
+
+
+def _prefix_users(db: Session, q: str, exclude_id: int, limit: int) -> list[models.User]:
+    u = models.User
+    name = func.lower(u.username)
+    q = q.lower()
+    return (
+        db.query(u)
+        .filter(name >= q, name < q + "\U0010ffff")
+        .filter(name.startswith(q, autoescape=True))
+        .filter(u.id != exclude_id)
+        .order_by(case((name == q, 0), else_=1), func.length(u.username), u.username)
+        .limit(limit)
+        .all()
+    )
+
+
+def _substring_users(db: Session, q: str, exclude_ids: set[int], limit: int) -> list[models.User]:
+    u = models.User
+    base = db.query(u).filter(u.id.notin_(exclude_ids))
+
+    if _substring_backend == "pg_trgm" and len(q) >= MIN_TRIGRAM_QUERY:
+        return (
+            base.filter(u.username.ilike(f"%{_escape_like(q)}%", escape="\\"))
+            .order_by(func.similarity(u.username, q).desc(), func.length(u.username), u.username)
+            .limit(limit)
+            .all()
+        )
+
+    if _substring_backend == "fts5" and len(q) >= MIN_TRIGRAM_QUERY:
+        match = '"' + q.replace('"', '""') + '"'
+        ids = text("SELECT rowid FROM users_fts WHERE users_fts MATCH :m ORDER BY rank LIMIT :n").bindparams(
+            m=match, n=limit + len(exclude_ids)
+        ).columns(rowid=models.User.id.type)
+        return (
+            base.filter(u.id.in_(ids.subquery().select()))
+            .order_by(func.length(u.username), u.username)
+            .limit(limit)
+            .all()
+        )
+
+    # нет trigram-индекса или запрос короче 3 символов — полный просмотр, как раньше
+    return (
+        base.filter(u.username.ilike(f"%{_escape_like(q)}%", escape="\\"))
+        .order_by(func.length(u.username), u.username)
+        .limit(limit)
+        .all()
+    )
+
+
+def _escape_like(s: str) -> str:
+    return s.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def search_users(db: Session, q: str, exclude_id: int, limit: int = 20) -> list[models.User]:
+    out = _prefix_users(db, q, exclude_id, limit)
+    if len(out) < limit:
+        seen = {exclude_id, *(x.id for x in out)}
+        out.extend(_substring_users(db, q, seen, limit - len(out)))
+    return out
+
+
+search_cache = TTLCache(
+    maxsize=settings.user_search_cache_size,
+    ttl=settings.user_search_cache_ttl_seconds,
+)
@@ -0,0 +1,81 @@
+# backend_app/waveform.py
+"""
+Волна голосовых: клиент присылает JSON-массив float 0..1 произвольной длины.
+Сервер приводит его к фиксированному числу столбиков, квантует в uint8
+и хранит как bytes (VoiceMeta.waveform). Наружу отдаём base64-строку.
+"""
+from __future__ import annotations
+
+import base64
+import json
+import math
+from typing import Any
+
+from backend_app.config import settings
+
+# защита от огромных JSON из формы (несколько минут записи по 60fps — это уже много)
+MAX_WAVEFORM_JSON_CHARS = 256 * 1024
+
+
+def _to_floats(raw: Any) -> list[float]:
+    """Плоский список чисел; любая другая структура — волны нет."""
+    if not isinstance(raw, list):
+        return []
+    out: list[float] = []
+    for x in raw:
+        if isinstance(x, bool) or not isinstance(x, (int, float)):
+            return []
+        v = float(x)
+        if math.isfinite(v):
+            out.append(abs(v))
+    return out
+
+
+def downsample(values: list[float], bars: int) -> list[float]:
+    """Ровно `bars` значений: пик по каждому отрезку (или ближайшая точка, если точек меньше)."""
+    n = len(values)
+    if not n or bars <= 0:
+        return []
+
+    out: list[float] = []
+    for i in range(bars):
+        a = i * n // bars
+        b = (i + 1) * n // bars
+        out.append(max(values[a:b]) if b > a else values[min(a, n - 1)])
+    return out
+
+
+def quantize(values: list[float]) -> bytes:
+    peak = max(values, default=0.0)
+    # клиент шлёт 0..1; если прислали другую шкалу — нормируем по пику
+    scale = 255.0 / peak if peak > 1.0 else 255.0
+    return bytes(min(255, int(round(v * scale))) for v in values)
+
+
+def normalize_waveform(raw: str | None, bars: int | None = None) -> bytes | None:
+    """JSON-строка из формы -> uint8 bytes длиной bars (или None, если волны нет/мусор)."""
+    s = (raw or "").strip()
+    if not s or len(s) > MAX_WAVEFORM_JSON_CHARS:
+        return None
+    try:
+        values = _to_floats(json.loads(s))
+    except (ValueError, RecursionError):
+        # глубоко вложенный JSON ("[[[[...]]]]") валит парсер рекурсией
+        return None
+    if not values:
+        return None
+
+    n = int(bars if bars is not None else settings.voice_waveform_bars)
+    return quantize(downsample(values, max(1, n)))
+
+
+def encode_waveform(data: bytes | None) -> str | None:
+    return base64.b64encode(data).decode("ascii") if data else None
+
+
+def waveform_out(vm: Any) -> str | None:
+    """base64 для VoiceMeta; старые строки без миграции конвертируются на лету."""
+    data = getattr(vm, "waveform", None)
+    if data:
+        return encode_waveform(data)
+    return encode_waveform(normalize_waveform(getattr(vm, "waveform_json", None)))
@@ -0,0 +1,377 @@
+# backend_app/webpush_sender.py
+"""
+Асинхронная отправка Web Push.
+
+Шифрование payload (aes128gcm, RFC 8291) делаем локально, доставку — через
+долгоживущий httpx.AsyncClient на каждый origin push-сервиса
+(fcm.googleapis.com, updates.push.services.mozilla.com, web.push.apple.com …),
+так что TLS handshake к сервису делается один раз, а несколько устройств
+пользователя получают push параллельно. Сколько доставок в полёте на процесс —
+ограничено settings.push_max_concurrency.
+
+Клиенты живут в backend_app.http_clients и закрываются на shutdown вместе с остальными.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import binascii
+import logging
+import re
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+from typing import Any, Optional
+from urllib.parse import urlsplit
+
+import http_ece
+import httpx
+from cryptography.hazmat.primitives.asymmetric import ec
+from py_vapid import Vapid
+
+from backend_app.config import settings
+from backend_app.http_clients import get_client, http2_available
+
+log = logging.getLogger("push")
+
+# VAPID JWT живёт 12 часов (как в pywebpush); за час до exp подписываем новый
+VAPID_EXP_SECONDS = 12 * 60 * 60
+VAPID_REFRESH_BEFORE_SECONDS = 60 * 60
+
+
+@dataclass(frozen=True)
+class PushTarget:
+    """Снимок строки PushSubscription — чтобы не держать ORM/сессию на время сети."""
+
+    id: int
+    endpoint: str
+    p256dh: str
+    auth: str
+
+
+@dataclass
+class PushResult:
+    target: PushTarget
+    ok: bool
+    status_code: Optional[int] = None
+    error: Optional[str] = None
+    response_text: Optional[str] = None
+    # секунды из Retry-After (429/503), если сервис его прислал
+    retry_after: Optional[float] = None
+
+    @property
+    def gone(self) -> bool:
+        # подписка протухла — её надо удалить
+        return self.status_code in (404, 410)
+
+    @property
+    def transient(self) -> bool:
+        """Есть смысл повторить: сеть/таймаут, 408, 429, 5xx."""
+        if self.ok:
+            return False
+        return self.status_code is None or self.status_code in (408, 429) or self.status_code >= 500
+
+    def error_detail(self) -> dict[str, Any]:
+        """Та же форма, что отдавал старый sync-отправитель (pywebpush)."""
+        if self.status_code is None:
+            return {"endpoint": self.target.endpoint[:140], "error": self.error}
+        return {
+            "endpoint": self.target.endpoint[:140],
+            "status_code": self.status_code,
+            "error": self.error,
+            "response_text": self.response_text[:400] if isinstance(self.response_text, str) else None,
+        }
+
+
+def _b64url_decode(s: str) -> bytes:
+    x = (s or "").strip()
+    return base64.urlsafe_b64decode(x + "=" * (-len(x) % 4))
+
+
+def push_origin(endpoint: str) -> str:
+    u = urlsplit(endpoint)
+    return f"{u.scheme}://{u.netloc}"
+
+
+@lru_cache(maxsize=10_000)
+def subscriber_keys(p256dh: str, auth: str) -> tuple[ec.EllipticCurvePublicKey, bytes]:
+    """p256dh/auth подписки -> (публичный ключ, auth secret); парсим один раз на подписку."""
+    receiver = _b64url_decode(p256dh)
+    if len(receiver) != 65 or receiver[0] != 0x04:
+        raise ValueError("Invalid p256dh key specified")
+    return ec.EllipticCurvePublicKey.from_encoded_point(ec.SECP256R1(), receiver), _b64url_decode(auth)
+
+
+def encrypt_aes128gcm(payload: bytes, p256dh: str, auth: str) -> bytes:
+    """RFC 8291: эфемерный ECDH-ключ на каждое сообщение, keyid = его публичная точка."""
+    receiver, auth_secret = subscriber_keys(p256dh, auth)
+    server_key = ec.generate_private_key(ec.SECP256R1())
+    return http_ece.encrypt(
+        payload,
+        private_key=server_key,
+        dh=receiver,
+        auth_secret=auth_secret,
+        version="aes128gcm",
+    )
+
+
+class VapidSigner:
+    """
+    Приватный VAPID-ключ, распарсенный один раз, + кэш заголовков Authorization
+    по audience (origin push-сервиса). JWT подписываем на VAPID_EXP_SECONDS и
+    переиспользуем, пока до exp больше VAPID_REFRESH_BEFORE_SECONDS.
+    """
+
+    def __init__(self, vapid: Vapid, subject: str):
+        self.vapid = vapid
+        self.subject = subject
+        self._headers: dict[str, tuple[float, dict[str, str]]] = {}
+        self.signed = 0
+
+    @classmethod
+    def from_pem(cls, pem: bytes, subject: str) -> "VapidSigner":
+        return cls(Vapid.from_pem(pem), subject)
+
+    def headers(self, aud: str) -> dict[str, str]:
+        now = time.time()
+        hit = self._headers.get(aud)
+        if hit is not None and hit[0] - now > VAPID_REFRESH_BEFORE_SECONDS:
+            return hit[1]
+        exp = int(now) + VAPID_EXP_SECONDS
+        h = self.vapid.sign({"sub": self.subject, "aud": aud, "exp": exp})
+        self._headers[aud] = (exp, h)
+        self.signed += 1
+        return h
+
+
+# -------------------------
+# VAPID private key (parsed once, in memory)
+# -------------------------
+
+_PEM_BEGIN_RE = re.compile(r"-----BEGIN [A-Z0-9 ]+-----")
+_PEM_END_RE = re.compile(r"-----END [A-Z0-9 ]+-----")
+
+_VAPID_SIGNER: VapidSigner | None = None
+_VAPID_SIGNER_FINGERPRINT: str | None = None  # raw env key + subject
+
+
+def _strip_ws(s: str) -> str:
+    return "".join((s or "").split())
+
+
+def _b64_any_to_bytes(s: str) -> bytes:
+    """
+    Decode base64 OR base64url.
+    Accepts missing padding, '-' '_' variants, and whitespace.
+    """
+    x = _strip_ws(s)
+    if not x:
+        return b""
+    x = x.replace("-", "+").replace("_", "/")
+    pad = (-len(x)) % 4
+    if pad:
+        x += "=" * pad
+    return base64.b64decode(x, validate=False)
+
+
+def _chunk64(s: str) -> str:
+    return "\n".join(s[i : i + 64] for i in range(0, len(s), 64) if s[i : i + 64])
+
+
+def _normalize_pem(pem: str) -> str:
+    """
+    Normalize any PEM-like input to strict PEM with LF and trailing newline.
+    Handles:
+    - real newlines
+    - '\\n' escaped newlines
+    - CRLF
+    - PEM in one line (BEGIN...END without newlines)
+    """
+    x = (pem or "").strip()
+    if not x:
+        return ""
+
+    x = x.replace("\\r\\n", "\n").replace("\\n", "\n")
+    x = x.replace("\r\n", "\n").replace("\r", "\n").strip()
+
+    # already multiline PEM
+    if "-----BEGIN" in x and "-----END" in x and "\n" in x:
+        lines = [ln.strip() for ln in x.split("\n") if ln.strip()]
+        return "\n".join(lines) + "\n"
+
+    # single-line PEM
+    if "-----BEGIN" in x and "-----END" in x and "\n" not in x:
+        m1 = _PEM_BEGIN_RE.search(x)
+        m2 = _PEM_END_RE.search(x)
+        if m1 and m2:
+            begin = m1.group(0)
+            end = m2.group(0)
+            inner = x[x.find(begin) + len(begin) : x.find(end)].strip().replace(" ", "")
+            return f"{begin}\n{_chunk64(inner)}\n{end}\n"
+
+    return x + ("\n" if not x.endswith("\n") else "")
+
+
+def _raw_env_private_key() -> str | None:
+    """
+    settings.VAPID_PRIVATE_KEY_PEM_B64:
+      - either base64/base64url(PEM text)
+      - or raw PEM text
+    """
+    v = settings.VAPID_PRIVATE_KEY_PEM_B64
+    if not v:
+        return None
+    return str(v).strip()
+
+
+def _private_key_to_pem_text(raw: str) -> str:
+    """
+    100% robust:
+    - if raw already PEM -> normalize and return
+    - else assume base64/base64url that decodes to PEM text (UTF-8)
+    """
+    s = (raw or "").strip()
+    if not s:
+        raise ValueError("empty private key")
+
+    if "-----BEGIN" in s and "-----END" in s:
+        pem = _normalize_pem(s)
+        if "-----BEGIN" not in pem or "-----END" not in pem:
+            raise ValueError("PEM markers present but invalid after normalize")
+        return pem
+
+    # base64/base64url -> bytes -> text
+    try:
+        b = _b64_any_to_bytes(s)
+    except (binascii.Error, ValueError) as e:
+        raise ValueError(f"base64 decode failed: {e}") from e
+
+    if not b:
+        raise ValueError("base64 decode returned empty")
+
+    try:
+        txt = b.decode("utf-8")
+    except UnicodeDecodeError as e:
+        raise ValueError("base64 does not decode to UTF-8 PEM text") from e
+
+    if "-----BEGIN" not in txt or "-----END" not in txt:
+        raise ValueError("decoded text is not PEM")
+
+    return _normalize_pem(txt)
+
+
+def vapid_signer() -> VapidSigner | None:
+    """
+    Parses the private key once per process (no temp PEM file).
+    Re-parsed only if env key / subject changed.
+    """
+    global _VAPID_SIGNER, _VAPID_SIGNER_FINGERPRINT
+
+    raw = _raw_env_private_key()
+    if not raw:
+        return None
+
+    fp = str(hash((raw, settings.VAPID_SUBJECT)))
+    if _VAPID_SIGNER is not None and _VAPID_SIGNER_FINGERPRINT == fp:
+        return _VAPID_SIGNER
+
+    try:
+        pem_text = _private_key_to_pem_text(raw)
+        signer = VapidSigner.from_pem(pem_text.encode("utf-8"), settings.VAPID_SUBJECT)
+    except Exception as e:
+        log.error("VAPID private key invalid: %s", e)
+        return None
+
+    _VAPID_SIGNER, _VAPID_SIGNER_FINGERPRINT = signer, fp
+    return signer
+
+
+# -------------------------
+# Pooled clients per push-service origin
+# -------------------------
+def _make_push_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=bool(settings.push_http2) and http2_available(),
+        limits=httpx.Limits(
+            max_connections=settings.push_max_connections_per_origin,
+            max_keepalive_connections=settings.push_max_connections_per_origin,
+            keepalive_expiry=settings.push_keepalive_expiry_seconds,
+        ),
+        timeout=httpx.Timeout(settings.push_timeout_seconds),
+    )
+
+
+def _push_client(origin: str) -> httpx.AsyncClient:
+    return get_client("push:" + origin, _make_push_client)
+
+
+_slots: Optional[asyncio.Semaphore] = None
+
+
+def _send_slots() -> asyncio.Semaphore:
+    global _slots
+    if _slots is None:
+        _slots = asyncio.Semaphore(max(1, int(settings.push_max_concurrency)))
+    return _slots
+
+
+# -------------------------
+# Delivery
+# -------------------------
+async def deliver(
+    target: PushTarget,
+    payload: bytes,
+    signer: VapidSigner,
+    ttl: Optional[int] = None,
+) -> PushResult:
+    try:
+        origin = push_origin(target.endpoint)
+        body = encrypt_aes128gcm(payload, target.p256dh, target.auth)
+        headers = {
+            "TTL": str(int(settings.push_ttl_seconds if ttl is None else ttl)),
+            "Content-Encoding": "aes128gcm",
+            "Content-Type": "application/octet-stream",
+            **signer.headers(origin),
+        }
+        async with _send_slots():
+            r = await _push_client(origin).post(target.endpoint, content=body, headers=headers)
+    except Exception as e:
+        return PushResult(target, ok=False, error=repr(e))
+
+    if r.status_code < 300:
+        return PushResult(target, ok=True, status_code=r.status_code)
+
+    # формат сообщения как у pywebpush.WebPushException — его уже ждут логи/дебаг
+    return PushResult(
+        target,
+        ok=False,
+        status_code=r.status_code,
+        error=f"WebPushException: Push failed: {r.status_code} {r.reason_phrase}\nResponse body:{r.text}",
+        response_text=r.text,
+        retry_after=parse_retry_after(r.headers.get("Retry-After")),
+    )
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Retry-After: секунды или HTTP-date."""
+    if not value:
+        return None
+    v = value.strip()
+    if v.isdigit():
+        return float(v)
+    try:
+        dt = parsedate_to_datetime(v)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, dt.timestamp() - time.time())
+
+
+async def deliver_many(
+    targets: list[PushTarget],
+    payload: bytes,
+    signer: VapidSigner,
+    ttl: Optional[int] = None,
+) -> list[PushResult]:
+    """Все подписки параллельно (в пределах push_max_concurrency на процесс)."""
+    return list(await asyncio.gather(*(deliver(t, payload, signer, ttl) for t in targets)))
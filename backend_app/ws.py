@@ -1,33 +1,17 @@
 # ws.py
 import json
-from typing import Any, Optional
+from fastapi import APIRouter, HTTPException, WebSocket, WebSocketDisconnect, Query
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from fastapi import APIRouter, WebSocket, WebSocketDisconnect, Query
-from sqlalchemy.orm import Session
-
-from backend_app.security import decode_token
-from backend_app.db import SessionLocal
+from backend_app.auth_cache import authenticate_token_async
+from backend_app.db import AsyncSessionLocal
 from backend_app import models
 
 router = APIRouter()
 
 
-def _payload_to_user_id(payload: Any) -> Optional[int]:
-    if isinstance(payload, int):
-        return payload
-    if isinstance(payload, dict):
-        sub = payload.get("sub")
-        if sub is None:
-            return None
-        try:
-            return int(sub)
-        except Exception:
-            return None
-    return None
-
-
-def get_other_user_id(db: Session, chat_id: int, me_id: int) -> int | None:
-    chat = db.get(models.DMChat, chat_id)
+async def get_other_user_id(db: AsyncSession, chat_id: int, me_id: int) -> int | None:
+    chat = await db.get(models.DMChat, chat_id)
     if not chat:
         return None
     if me_id not in (chat.user1_id, chat.user2_id):
@@ -78,17 +62,29 @@ manager = WSManager()
 
 @router.websocket("/ws")
 async def ws_endpoint(ws: WebSocket, token: str = Query(...)):
+    # сессия живёт всё соединение, но соединение пула берёт только на время запроса
+    # (после каждого чтения rollback); участники чата не меняются — кэшируем
+    db = AsyncSessionLocal()
+    other_by_chat: dict[int, int] = {}
+
+    async def other_of(chat_id: int) -> int | None:
+        if chat_id in other_by_chat:
+            return other_by_chat[chat_id]
+        oid = await get_other_user_id(db, chat_id, user_id)
+        await db.rollback()
+        if oid is not None:
+            other_by_chat[chat_id] = oid
+        return oid
+
     try:
-        payload = decode_token(token)
-        user_id = _payload_to_user_id(payload)
-        if not user_id:
-            raise Exception("bad token payload")
-    except Exception:
+        user_id = (await authenticate_token_async(db, token)).id
+        await db.rollback()
+    except HTTPException:
+        await db.close()
         await ws.close(code=1008)
         return
 
     await manager.connect(user_id, ws)
-    db = SessionLocal()
     try:
         while True:
             raw = await ws.receive_text()
@@ -101,7 +97,7 @@ async def ws_endpoint(ws: WebSocket, token: str = Query(...)):
             chat_id = data.get("chat_id")
 
             if t == "presence:subscribe" and isinstance(chat_id, int):
-                other_id = get_other_user_id(db, chat_id, user_id)
+                other_id = await other_of(chat_id)
                 if other_id is None:
                     continue
 
@@ -126,7 +122,7 @@ async def ws_endpoint(ws: WebSocket, token: str = Query(...)):
                 manager.unsubscribe(user_id, chat_id)
 
             elif t in ("typing:start", "typing:stop") and isinstance(chat_id, int):
-                other_id = get_other_user_id(db, chat_id, user_id)
+                other_id = await other_of(chat_id)
                 if other_id is None:
                     continue
                 if manager.is_subscribed(other_id, chat_id):
@@ -143,7 +139,7 @@ async def ws_endpoint(ws: WebSocket, token: str = Query(...)):
         try:
             subs = list(manager.subscriptions.get(user_id, set()))
             for chat_id in subs:
-                other_id = get_other_user_id(db, chat_id, user_id)
+                other_id = await other_of(chat_id)
                 if other_id is not None and manager.is_subscribed(other_id, chat_id):
                     await manager.send(other_id, {
                         "type": "presence:state",
@@ -154,4 +150,4 @@ async def ws_endpoint(ws: WebSocket, token: str = Query(...)):
         finally:
             manager.disconnect(user_id, ws)
     finally:
-        db.close()
+        await db.close()
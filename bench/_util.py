@@ -0,0 +1,98 @@
+# bench/_util.py
+"""
+Общие помощники для бенчмарков: приложение поверх временной SQLite,
+ASGI-клиент без сети и измеритель лагов event loop.
+
+Импортировать ДО backend_app: DATABASE_URL читается при импорте backend_app.db.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+if str(ROOT) not in sys.path:
+    sys.path.insert(0, str(ROOT))
+
+if not os.getenv("BENCH_KEEP_DATABASE_URL"):
+    _tmp = tempfile.mkdtemp(prefix="bench-")
+    os.environ["DATABASE_URL"] = f"sqlite:///{_tmp}/bench.db"
+
+
+def make_client():
+    import httpx
+
+    from backend_app.db import engine
+    from backend_app.main import app
+    from backend_app.models import Base
+
+    Base.metadata.create_all(bind=engine)
+    transport = httpx.ASGITransport(app=app)
+    return httpx.AsyncClient(transport=transport, base_url="http://bench")
+
+
+async def register(client, username: str, password: str = "bench-pass") -> tuple[int, dict]:
+    r = await client.post("/auth/register_form", data={"username": username, "password": password})
+    r.raise_for_status()
+    j = r.json()
+    return j["id"], {"Authorization": "Bearer " + j["access_token"]}
+
+
+class LoopLagMonitor:
+    """Спит по interval и меряет, насколько позже просыпается: это и есть лаг loop'а."""
+
+    def __init__(self, interval: float = 0.005):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self) -> None:
+        while True:
+            t0 = time.perf_counter()
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - t0 - self.interval))
+
+    def start(self) -> "LoopLagMonitor":
+        self._task = asyncio.create_task(self._run())
+        return self
+
+    async def stop(self) -> None:
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def summary(self) -> dict[str, float]:
+        return {
+            "loop_lag_p50_ms": percentile(self.samples, 50) * 1000,
+            "loop_lag_p99_ms": percentile(self.samples, 99) * 1000,
+            "loop_lag_max_ms": max(self.samples, default=0.0) * 1000,
+        }
+
+
+def percentile(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    xs = sorted(values)
+    k = min(len(xs) - 1, max(0, int(round(p / 100 * (len(xs) - 1)))))
+    return xs[k]
+
+
+def print_table(title: str, rows: dict[str, float | int | str]) -> None:
+    print(f"\n== {title} ==")
+    w = max(len(k) for k in rows)
+    for k, v in rows.items():
+        if isinstance(v, float):
+            v = f"{v:.2f}"
+        print(f"  {k.ljust(w)}  {v}")
+
+
+def mean(values: list[float]) -> float:
+    return statistics.fmean(values) if values else 0.0
@@ -0,0 +1,145 @@
+# bench/bench_assistant.py
+"""
+Сквозной бенчмарк /assistant/suggest: приложение (ASGI, временная SQLite) ->
+pooled-клиент -> локальный мок апстрима. Ключ OpenAI не нужен.
+
+    python -m bench.bench_assistant --requests 500 --concurrency 20 --users 40 \\
+        --drafts 30 --latency-ms 300 --jitter-ms 100 --rate-limit-rate 0.02
+
+Фиксированная конкурентность: `--concurrency` воркеров шлют запросы подряд,
+каждый по кругу от своих пользователей из `--users` с черновиком из пула
+`--drafts` (меньше черновиков — больше попаданий в кэш подсказок). Если
+пользователей меньше, чем воркеров, одни и те же пользователи шлют
+параллельно — и часть запросов получает 409 (latest-wins).
+
+Печатает throughput, латентность (p50/p95/p99), коды ответов, hit rate
+кэша (assistant.cache_stats) и отказы по лимитам: 429 наших лимитов и
+429/5xx апстрима (у нас они превращаются в 502).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import random
+import time
+
+from bench._util import LoopLagMonitor, make_client, percentile, print_table, register
+from bench.mock_upstream import MockConfig, MockStats, serve_mock
+from backend_app.config import settings
+from backend_app.routers import assistant
+
+
+async def _setup_users(client, n: int) -> list[tuple[dict, int]]:
+    """Пары пользователей с общим чатом и парой сообщений контекста -> [(headers, chat_id)]."""
+    out: list[tuple[dict, int]] = []
+    peer_id, peer_h = await register(client, "bench-peer")
+    for i in range(n):
+        _, h = await register(client, f"bench-u{i}")
+        r = await client.post("/chats/dm/start", json={"other_user_id": peer_id}, headers=h)
+        r.raise_for_status()
+        chat_id = r.json()["chat_id"]
+        await client.post(f"/chats/dm/{chat_id}/send", json={"text": "привет! как дела?"}, headers=peer_h)
+        await client.post(f"/chats/dm/{chat_id}/send", json={"text": "норм, а ты?"}, headers=h)
+        out.append((h, chat_id))
+    return out
+
+
+async def main(args) -> None:
+    settings.openai_api_key = "mock"
+    settings.openai_model = "mock"
+    if args.no_rate_limit:
+        settings.rate_limit_enabled = False
+
+    cfg = MockConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        error_rate=args.error_rate,
+        rate_limit_rate=args.rate_limit_rate,
+        seed=args.seed,
+    )
+    mock_stats = MockStats()
+    rnd = random.Random(args.seed)
+    drafts = [f"давай встретимся в {i % 24}:00, вариант {i}" for i in range(max(1, args.drafts))]
+
+    async with serve_mock(cfg, stats=mock_stats) as base, make_client() as client:
+        settings.openai_base_url = base + "/v1"
+
+        # регистрация и переписка не должны упираться в лимиты
+        rl_enabled = settings.rate_limit_enabled
+        settings.rate_limit_enabled = False
+        users = await _setup_users(client, args.users)
+        settings.rate_limit_enabled = rl_enabled
+
+        for k in assistant.cache_stats:
+            assistant.cache_stats[k] = 0
+        assistant.suggestion_cache.clear()
+
+        lat: list[float] = []
+        codes: dict[int, int] = {}
+        remaining = args.requests
+
+        async def worker(w: int) -> None:
+            nonlocal remaining
+            mine = users[w::args.concurrency] or [users[w % len(users)]]
+            i = 0
+            while remaining > 0:
+                remaining -= 1
+                h, chat_id = mine[i % len(mine)]
+                i += 1
+                body = {"chat_id": chat_id, "draft": rnd.choice(drafts), "reason": "idle"}
+                t0 = time.perf_counter()
+                r = await client.post("/assistant/suggest", json=body, headers=h)
+                lat.append(time.perf_counter() - t0)
+                codes[r.status_code] = codes.get(r.status_code, 0) + 1
+
+        lag = LoopLagMonitor().start()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(worker(w) for w in range(args.concurrency)))
+        wall = time.perf_counter() - t0
+        await lag.stop()
+
+    cs = assistant.cache_stats
+    lookups = cs["hits"] + cs["misses"]
+    ok = codes.get(200, 0)
+    rows: dict[str, float | int | str] = {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "wall_s": wall,
+        "req_per_sec": args.requests / wall,
+        "ok_per_sec": ok / wall,
+        "latency_p50_ms": percentile(lat, 50) * 1000,
+        "latency_p95_ms": percentile(lat, 95) * 1000,
+        "latency_p99_ms": percentile(lat, 99) * 1000,
+        "latency_max_ms": max(lat, default=0.0) * 1000,
+        "codes": " ".join(f"{c}:{n}" for c, n in sorted(codes.items())),
+        "rejected_429": codes.get(429, 0),
+        "cache_hit_rate": (cs["hits"] / lookups) if lookups else 0.0,
+        "cache_hits": cs["hits"],
+        "coalesced": cs["coalesced"],
+        "superseded_409": cs["superseded"],
+        "upstream_calls": cs["upstream_calls"],
+        "upstream_429": mock_stats.rate_limited,
+        "upstream_5xx": mock_stats.errors,
+        **lag.summary(),
+    }
+    print_table(
+        f"/assistant/suggest: upstream {args.latency_ms:.0f}±{args.jitter_ms:.0f}ms, "
+        f"{args.users} users, {args.drafts} drafts",
+        rows,
+    )
+    print_table("upstream (pooled client)", assistant.upstream_stats.snapshot())
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=500)
+    ap.add_argument("--concurrency", type=int, default=20)
+    ap.add_argument("--users", type=int, default=40)
+    ap.add_argument("--drafts", type=int, default=30)
+    ap.add_argument("--latency-ms", type=float, default=300.0)
+    ap.add_argument("--jitter-ms", type=float, default=100.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--no-rate-limit", action="store_true", help="выключить наши лимиты (чистая пропускная способность)")
+    ap.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(ap.parse_args()))
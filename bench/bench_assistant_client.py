@@ -0,0 +1,62 @@
+# bench/bench_assistant_client.py
+"""
+Клиент на каждый запрос vs один pooled keep-alive клиент против локального мока.
+
+    python -m bench.bench_assistant_client --requests 200 --concurrency 10 --latency-ms 50
+
+Печатает connect / TTFB / total (p50/p99) и число новых соединений.
+Мок без TLS, поэтому разница здесь — только TCP connect; с реальным
+апстримом добавляется TLS handshake (обычно ещё 1–2 RTT).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from bench._util import print_table
+from bench.mock_upstream import serve_mock
+from backend_app.http_clients import LatencyStats, timed_request
+from backend_app.routers.assistant import _make_openai_client
+
+PAYLOAD = {"model": "mock", "input": [{"role": "user", "content": "hi"}], "max_output_tokens": 50}
+
+
+async def run(mode: str, url: str, n: int, concurrency: int) -> dict:
+    stats = LatencyStats(window=n)
+    sem = asyncio.Semaphore(concurrency)
+    pooled = _make_openai_client() if mode == "pooled" else None
+
+    async def one() -> None:
+        async with sem:
+            if pooled is not None:
+                await timed_request(pooled, "POST", url, stats, json=PAYLOAD)
+            else:
+                # так было: новый AsyncClient (и соединение) на каждый вызов
+                async with httpx.AsyncClient(timeout=httpx.Timeout(25.0, connect=10.0)) as c:
+                    await timed_request(c, "POST", url, stats, json=PAYLOAD)
+
+    t0 = time.perf_counter()
+    await asyncio.gather(*(one() for _ in range(n)))
+    wall = time.perf_counter() - t0
+    if pooled is not None:
+        await pooled.aclose()
+    return {"req_per_sec": n / wall, **stats.snapshot()}
+
+
+async def main(args) -> None:
+    async with serve_mock(latency_ms=args.latency_ms) as base:
+        url = base + "/v1/responses"
+        for mode in ("per_request", "pooled"):
+            res = await run(mode, url, args.requests, args.concurrency)
+            print_table(f"{mode}: {args.requests} req, concurrency {args.concurrency}", res)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--requests", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=10)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    asyncio.run(main(ap.parse_args()))
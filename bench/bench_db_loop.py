@@ -0,0 +1,112 @@
+# bench/bench_db_loop.py
+"""
+Лаг event loop при медленной БД: sync Session прямо в корутине против AsyncSession.
+
+    python -m bench.bench_db_loop --messages 300 --concurrency 30 --query-latency-ms 5
+
+Каждому SQL-запросу добавляется --query-latency-ms задержки — в том потоке,
+который его выполняет (sqlite trace callback), как будто БД по сети:
+
+  sync-on-loop — то, что делал send до перехода на AsyncSession: sync Session
+                 в async-корутине, запрос выполняется прямо в потоке loop'а;
+  async        — POST /chats/dm/{id}/send через приложение (AsyncSession,
+                 запрос уходит в поток драйвера, loop свободен).
+
+Печатает messages/sec, латентность отправки и лаг loop'а — столько ждали бы
+все WebSocket'ы воркера.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+
+from sqlalchemy import event
+
+from bench._util import LoopLagMonitor, make_client, percentile, print_table, register
+from backend_app import models
+from backend_app.config import settings
+from backend_app.db import SessionLocal, async_engine, engine
+from backend_app.routers.chats import ensure_chat_member, msg_to_dict
+
+
+def _install_latency(latency_s: float) -> None:
+    def on_statement(_sql: str) -> None:
+        time.sleep(latency_s)
+
+    @event.listens_for(engine, "connect")
+    def _sync_connect(dbapi_connection, _record):
+        dbapi_connection.set_trace_callback(on_statement)
+
+    @event.listens_for(async_engine.sync_engine, "connect")
+    def _async_connect(dbapi_connection, _record):
+        # callback вешаем на sqlite-соединение внутри потока aiosqlite
+        dbapi_connection.run_async(lambda conn: conn.set_trace_callback(on_statement))
+
+
+async def _send_sync_on_loop(chat_id: int, user_id: int, text: str) -> None:
+    db = SessionLocal()
+    try:
+        ensure_chat_member(db, chat_id, user_id)
+        msg = models.Message(chat_id=chat_id, sender_id=user_id, text=text)
+        db.add(msg)
+        db.commit()
+        db.refresh(msg)
+        msg_to_dict(db, msg)
+    finally:
+        db.close()
+    await asyncio.sleep(0)  # WS-рассылка
+
+
+async def main(args) -> None:
+    settings.rate_limit_enabled = False  # меряем БД, а не лимит отправки
+    async with make_client() as client:
+        uid, h = await register(client, "loop-a")
+        other, _ = await register(client, "loop-b")
+        chat_id = (await client.post("/chats/dm/start", json={"other_user_id": other}, headers=h)).json()["chat_id"]
+        # задержка — только на новых соединениях: сбрасываем пулы
+        _install_latency(args.query_latency_ms / 1000)
+        engine.dispose()
+        await async_engine.dispose()
+
+        for mode in args.modes:
+            sem = asyncio.Semaphore(args.concurrency)
+            lat: list[float] = []
+            errors = 0
+
+            async def one(i: int) -> None:
+                nonlocal errors
+                async with sem:
+                    t0 = time.perf_counter()
+                    if mode == "sync-on-loop":
+                        await _send_sync_on_loop(chat_id, uid, f"m{i}")
+                    else:
+                        r = await client.post(f"/chats/dm/{chat_id}/send", json={"text": f"m{i}"}, headers=h)
+                        errors += r.status_code != 200
+                    lat.append(time.perf_counter() - t0)
+
+            lag = LoopLagMonitor().start()
+            t0 = time.perf_counter()
+            await asyncio.gather(*(one(i) for i in range(args.messages)))
+            wall = time.perf_counter() - t0
+            await lag.stop()
+
+            print_table(
+                f"{mode}: {args.messages} messages, concurrency {args.concurrency}, +{args.query_latency_ms:.0f}ms/query",
+                {
+                    "messages_per_sec": args.messages / wall,
+                    "errors": errors,
+                    "latency_p50_ms": percentile(lat, 50) * 1000,
+                    "latency_p99_ms": percentile(lat, 99) * 1000,
+                    **lag.summary(),
+                },
+            )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--messages", type=int, default=300)
+    ap.add_argument("--concurrency", type=int, default=30)
+    ap.add_argument("--query-latency-ms", type=float, default=5.0)
+    ap.add_argument("--modes", nargs="+", choices=("sync-on-loop", "async"), default=["sync-on-loop", "async"])
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,59 @@
+# bench/bench_login.py
+"""
+Шторм логинов: N одновременных /auth/login + фоновый измеритель лага event loop.
+
+    python -m bench.bench_login --logins 200 --concurrency 50
+
+Показывает logins/sec, латентность логина, сколько получили 503 (очередь
+хэширования переполнена) и лаг loop'а — то, что в это время почувствовали
+бы WebSocket'ы.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import time
+
+from bench._util import LoopLagMonitor, make_client, percentile, print_table, register
+
+
+async def main(args) -> None:
+    async with make_client() as client:
+        await register(client, "storm", "storm-pass")
+
+        sem = asyncio.Semaphore(args.concurrency)
+        lat: list[float] = []
+        codes: dict[int, int] = {}
+
+        async def one() -> None:
+            async with sem:
+                t0 = time.perf_counter()
+                r = await client.post("/auth/login", json={"username": "storm", "password": "storm-pass"})
+                lat.append(time.perf_counter() - t0)
+                codes[r.status_code] = codes.get(r.status_code, 0) + 1
+
+        lag = LoopLagMonitor().start()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(one() for _ in range(args.logins)))
+        wall = time.perf_counter() - t0
+        await lag.stop()
+
+    print_table(
+        f"login storm: {args.logins} logins, concurrency {args.concurrency}",
+        {
+            "logins_per_sec": codes.get(200, 0) / wall,
+            "ok_200": codes.get(200, 0),
+            "busy_503": codes.get(503, 0),
+            "other": sum(v for k, v in codes.items() if k not in (200, 503)),
+            "latency_p50_ms": percentile(lat, 50) * 1000,
+            "latency_p99_ms": percentile(lat, 99) * 1000,
+            **lag.summary(),
+        },
+    )
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--logins", type=int, default=200)
+    ap.add_argument("--concurrency", type=int, default=50)
+    asyncio.run(main(ap.parse_args()))
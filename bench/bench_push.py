@@ -0,0 +1,194 @@
+# bench/bench_push.py
+"""
+Пропускная способность Web Push против локального эмулятора push-сервиса.
+
+    python -m bench.bench_push --users 200 --subs-per-user 3 --stale 0.1 --latency-ms 30
+    python -m bench.bench_push --mode outbox --rate-limit-rate 0.02
+
+Сидит users × subs-per-user строк PushSubscription (доля --stale отвечает 410),
+затем шлёт каждому пользователю по push'у:
+
+  direct — send_webpush_to_user для всех пользователей, --concurrency одновременно;
+  outbox — enqueue_push для всех, затем drain_once() до пустой очереди
+           (ретраи 429 по Retry-After включены, ждём их).
+
+Печатает pushes/sec (доставок на подписку), сколько протухших подписок
+удалено из засеянных, сколько payload'ов эмулятор расшифровал и лаг event loop
+за время отправки.
+
+Только на временной БД: бенч дренирует всю очередь и считает все подписки,
+поэтому с BENCH_KEEP_DATABASE_URL не запускается.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import os
+import sys
+import time
+
+from bench._util import LoopLagMonitor, print_table
+from bench.fake_push_service import FakePushConfig, FakePushStats, make_subscriber_key, serve_fake_push
+from backend_app import http_clients, models, push_outbox
+from backend_app.config import settings
+from backend_app.db import AsyncSessionLocal, SessionLocal, engine
+from backend_app.routers.push import send_webpush_to_user
+
+# генерация EC-ключа на каждую подписку дорогая и к делу не относится: берём из пула
+KEY_POOL = 16
+
+PUSH = {"type": "message:new", "chat_id": 1, "title": "Новое сообщение", "body": "привет! как дела?"}
+
+
+def _configure_vapid() -> None:
+    from py_vapid import Vapid
+
+    v = Vapid()
+    v.generate_keys()
+    settings.VAPID_PRIVATE_KEY_PEM_B64 = base64.b64encode(v.private_pem()).decode()
+    settings.VAPID_PUBLIC_KEY_B64URL = "bench"
+
+
+def _seed(base_url: str, cfg: FakePushConfig, users: int, per_user: int, stale: float) -> tuple[list[int], int]:
+    models.Base.metadata.create_all(bind=engine)
+    pool = [make_subscriber_key() for _ in range(KEY_POOL)]
+    n_stale_every = int(round(1 / stale)) if stale > 0 else 0
+
+    db = SessionLocal()
+    try:
+        # остатки прошлых прогонов — только свои пользователи
+        bench_users = db.query(models.User.id).filter(models.User.username.like("push-bench-%"))
+        db.query(models.PushOutbox).filter(models.PushOutbox.user_id.in_(bench_users)).delete(
+            synchronize_session=False
+        )
+        db.query(models.PushSubscription).filter(models.PushSubscription.user_id.in_(bench_users)).delete(
+            synchronize_session=False
+        )
+        db.commit()
+        user_ids: list[int] = []
+        for u in range(users):
+            user = models.User(username=f"push-bench-{u}-{time.time_ns()}", password_hash="x")
+            db.add(user)
+            db.flush()
+            user_ids.append(user.id)
+            for k in range(per_user):
+                i = u * per_user + k
+                token = f"u{u}d{k}"
+                priv, auth, p256dh, auth_b64 = pool[i % KEY_POOL]
+                cfg.keys[token] = (priv, auth)
+                if n_stale_every and i % n_stale_every == 0:
+                    cfg.stale.add(token)
+                db.add(models.PushSubscription(
+                    user_id=user.id, endpoint=f"{base_url}/push/{token}", p256dh=p256dh, auth=auth_b64,
+                ))
+        db.commit()
+        return user_ids, len(cfg.stale)
+    finally:
+        db.close()
+
+
+async def _run_direct(user_ids: list[int], concurrency: int) -> None:
+    sem = asyncio.Semaphore(concurrency)
+
+    async def one(uid: int) -> None:
+        async with sem, AsyncSessionLocal() as db:
+            await send_webpush_to_user(db, uid, PUSH)
+
+    await asyncio.gather(*(one(u) for u in user_ids))
+
+
+async def _run_outbox(user_ids: list[int]) -> int:
+    async with AsyncSessionLocal() as db:
+        for uid in user_ids:
+            await push_outbox.enqueue_push(db, uid, PUSH)
+
+    batches = 0
+    while True:
+        n = await push_outbox.drain_once()
+        batches += bool(n)
+        if n:
+            continue
+        db = SessionLocal()
+        try:
+            left = db.query(models.PushOutbox).filter(models.PushOutbox.status.in_(("pending", "sending"))).count()
+        finally:
+            db.close()
+        if not left:
+            return batches
+        await asyncio.sleep(0.05)  # ждём ретраев (backoff / Retry-After)
+
+
+async def main(args) -> None:
+    _configure_vapid()
+    settings.push_max_concurrency = args.max_in_flight
+    settings.push_outbox_batch_size = args.batch_size
+    settings.push_outbox_backoff_base_seconds = 0.2
+
+    cfg = FakePushConfig(
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        rate_limit_rate=args.rate_limit_rate,
+        decrypt=not args.no_decrypt,
+        seed=args.seed,
+    )
+    stats = FakePushStats()
+    with serve_fake_push(cfg, stats) as base:
+        user_ids, seeded_stale = _seed(base, cfg, args.users, args.subs_per_user, args.stale)
+        total = len(user_ids) * args.subs_per_user
+
+        lag = LoopLagMonitor().start()
+        t0 = time.perf_counter()
+        extra: dict[str, int] = {}
+        if args.mode == "direct":
+            await _run_direct(user_ids, args.concurrency)
+        else:
+            extra["outbox_batches"] = await _run_outbox(user_ids)
+        wall = time.perf_counter() - t0
+        await lag.stop()
+        await http_clients.close_all()
+
+    db = SessionLocal()
+    try:
+        remaining_subs = db.query(models.PushSubscription).count()
+        dead = db.query(models.PushOutbox).filter(models.PushOutbox.status == "dead").count()
+    finally:
+        db.close()
+
+    print_table(
+        f"{args.mode}: {len(user_ids)} users × {args.subs_per_user} subs, push service {args.latency_ms:.0f}ms",
+        {
+            "subscriptions": total,
+            "wall_s": wall,
+            "pushes_per_sec": total / wall,
+            "service_received": stats.received,
+            "service_accepted": stats.accepted,
+            "service_429": stats.rate_limited,
+            "decrypted_ok": stats.decrypted,
+            "bad_request": stats.bad_request,
+            "stale_seeded": seeded_stale,
+            "stale_deleted": total - remaining_subs,
+            "outbox_dead": dead,
+            **extra,
+            **lag.summary(),
+        },
+    )
+
+
+if __name__ == "__main__":
+    if os.getenv("BENCH_KEEP_DATABASE_URL"):
+        sys.exit("bench_push sends every queued push and counts all subscriptions: run it without BENCH_KEEP_DATABASE_URL")
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--mode", choices=("direct", "outbox"), default="direct")
+    ap.add_argument("--users", type=int, default=200)
+    ap.add_argument("--subs-per-user", type=int, default=3)
+    ap.add_argument("--stale", type=float, default=0.1, help="доля подписок, отвечающих 410")
+    ap.add_argument("--concurrency", type=int, default=50, help="direct: пользователей одновременно")
+    ap.add_argument("--max-in-flight", type=int, default=100, help="push_max_concurrency")
+    ap.add_argument("--batch-size", type=int, default=200, help="outbox: размер батча")
+    ap.add_argument("--latency-ms", type=float, default=30.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--no-decrypt", action="store_true", help="эмулятор не расшифровывает (меньше CPU на его стороне)")
+    ap.add_argument("--seed", type=int, default=1)
+    asyncio.run(main(ap.parse_args()))
@@ -0,0 +1,108 @@
+# bench/bench_push_crypto.py
+"""
+CPU-стоимость подготовки одного Web Push (без сети), pushes/sec на ядро.
+
+    python -m bench.bench_push_crypto --pushes 2000 --subscriptions 50
+
+legacy  — как было с pywebpush: на каждый push читаем PEM из файла, парсим
+          EC-ключ, подписываем новый VAPID JWT, парсим p256dh подписки.
+cached  — backend_app.webpush_sender: ключ распарсен один раз, заголовок
+          Authorization закэширован на audience, p256dh — в LRU.
+
+Шифрование (эфемерный ECDH + aes128gcm) в обоих вариантах одно и то же —
+оно по RFC обязано быть на каждое сообщение.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import os
+import tempfile
+import time
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from py_vapid import Vapid
+from pywebpush import WebPusher
+
+from bench._util import print_table
+from backend_app.webpush_sender import VapidSigner, encrypt_aes128gcm, push_origin, subscriber_keys
+
+AUDIENCES = (
+    "https://fcm.googleapis.com",
+    "https://updates.push.services.mozilla.com",
+    "https://web.push.apple.com",
+)
+SUBJECT = "mailto:bench@example.com"
+PAYLOAD = b'{"type":"message:new","chat_id":1,"title":"@alice","body":"\xd0\xbf\xd1\x80\xd0\xb8\xd0\xb2\xd0\xb5\xd1\x82"}'
+
+
+def _b64(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode()
+
+
+def _subscriptions(n: int) -> list[dict]:
+    out = []
+    for i in range(n):
+        k = ec.generate_private_key(ec.SECP256R1()).public_key()
+        raw = k.public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+        out.append({
+            "endpoint": f"{AUDIENCES[i % len(AUDIENCES)]}/send/{i}",
+            "keys": {"p256dh": _b64(raw), "auth": _b64(os.urandom(16))},
+        })
+    return out
+
+
+def _measure(fn, subs: list[dict], n: int) -> dict[str, float]:
+    fn(subs[0])  # прогрев
+    c0, w0 = time.process_time(), time.perf_counter()
+    for i in range(n):
+        fn(subs[i % len(subs)])
+    cpu, wall = time.process_time() - c0, time.perf_counter() - w0
+    return {"pushes_per_cpu_sec": n / cpu if cpu else 0.0, "us_per_push": cpu / n * 1e6, "wall_s": wall}
+
+
+def main(args) -> None:
+    vapid = Vapid()
+    vapid.generate_keys()
+    pem = vapid.private_pem()
+    fd, pem_path = tempfile.mkstemp(suffix=".pem")
+    with os.fdopen(fd, "wb") as f:
+        f.write(pem)
+
+    subs = _subscriptions(args.subscriptions)
+
+    def legacy(sub: dict) -> None:
+        vv = Vapid.from_file(private_key_file=pem_path)
+        vv.sign({"sub": SUBJECT, "aud": push_origin(sub["endpoint"]), "exp": int(time.time()) + 43200})
+        WebPusher(sub).encode(PAYLOAD, content_encoding="aes128gcm")
+
+    signer = VapidSigner.from_pem(pem, SUBJECT)
+
+    def cached(sub: dict) -> None:
+        signer.headers(push_origin(sub["endpoint"]))
+        encrypt_aes128gcm(PAYLOAD, sub["keys"]["p256dh"], sub["keys"]["auth"])
+
+    def sign_only(sub: dict) -> None:
+        vapid.sign({"sub": SUBJECT, "aud": push_origin(sub["endpoint"]), "exp": int(time.time()) + 43200})
+
+    res_legacy = _measure(legacy, subs, args.pushes)
+    res_cached = _measure(cached, subs, args.pushes)
+    res_sign = _measure(sign_only, subs, args.pushes)
+    os.unlink(pem_path)
+
+    print_table(f"legacy (pywebpush path), {args.pushes} pushes", res_legacy)
+    print_table("cached (webpush_sender)", {
+        **res_cached,
+        "vapid_signatures": signer.signed,
+        "p256dh_cache": str(subscriber_keys.cache_info()),
+    })
+    print_table("for reference: VAPID sign alone", res_sign)
+    print_table("speedup", {"x": res_cached["pushes_per_cpu_sec"] / max(res_legacy["pushes_per_cpu_sec"], 1e-9)})
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--pushes", type=int, default=2000)
+    ap.add_argument("--subscriptions", type=int, default=50)
+    main(ap.parse_args())
@@ -0,0 +1,109 @@
+# bench/bench_sql_queries.py
+"""
+Бюджет SQL-запросов по эндпоинтам (backend_app/sql_stats.py).
+
+    python -m bench.bench_sql_queries --chats 20 --messages 50
+    python -m bench.bench_sql_queries --budget history=6 --budget list=8
+
+Заполняет БД (диалоги, сообщения с вложениями), вызывает каждый эндпоинт
+внутри assert_max_queries(бюджет) и печатает число запросов, время в БД и
+повторяющиеся формы запросов (N+1). Код возврата 1, если кто-то вышел за
+бюджет или повторяет запросы, — годится для CI.
+
+Число запросов N+1-эндпоинтов растёт с данными: сравнивать прогоны с
+одинаковыми --chats/--messages.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import sys
+
+from bench._util import make_client, print_table, register
+from backend_app.auth_cache import principal_cache
+from backend_app.config import settings
+from backend_app.sql_stats import assert_max_queries, statement_shape
+
+# бюджеты по умолчанию: сколько запросов эндпоинт должен делать независимо от объёма данных
+BUDGETS = {
+    "me": 1,
+    "list": 6,
+    "history": 6,
+    "search": 3,
+    "send": 8,
+    "read": 8,
+    "download": 5,
+}
+
+
+async def main(args) -> int:
+    settings.rate_limit_enabled = False
+    budgets = dict(BUDGETS)
+    for item in args.budget:
+        name, _, n = item.partition("=")
+        budgets[name] = int(n)
+
+    async with make_client() as client:
+        uid, h = await register(client, "sql-a")
+        other, oh = await register(client, "sql-b")
+        chat = (await client.post("/chats/dm/start", json={"other_user_id": other}, headers=h)).json()["chat_id"]
+        for i in range(args.chats - 1):
+            peer, _ = await register(client, f"sql-peer{i}")
+            await client.post("/chats/dm/start", json={"other_user_id": peer}, headers=h)
+
+        file_id = None
+        for i in range(args.messages):
+            file_ids = []
+            if i % 3 == 0:
+                up = await client.post("/files/upload", files={"file": (f"f{i}.txt", b"x", "text/plain")}, headers=h)
+                file_ids = [file_id := up.json()["file_id"]]
+            await client.post(f"/chats/dm/{chat}/send", json={"text": f"m{i}", "file_ids": file_ids}, headers=h)
+        last = (await client.get(f"/chats/dm/{chat}/messages", headers=h)).json()["items"][-1]["id"]
+
+        calls = {
+            "me": lambda: client.get("/auth/me", headers=h),
+            "list": lambda: client.get("/chats/dm/list", headers=h),
+            "history": lambda: client.get(f"/chats/dm/{chat}/messages", params={"limit": 50}, headers=h),
+            "search": lambda: client.get("/users/search", params={"q": "sql"}, headers=h),
+            "send": lambda: client.post(f"/chats/dm/{chat}/send", json={"text": "budget"}, headers=h),
+            "read": lambda: client.post(f"/chats/dm/{chat}/read", json={"last_read_message_id": last}, headers=oh),
+            "download": lambda: client.get(f"/files/{file_id}", headers=oh),
+        }
+
+        failed = []
+        for name, call in calls.items():
+            if name not in args.only and args.only:
+                continue
+            principal_cache.clear()  # считаем и аутентификацию (холодный кэш)
+            budget = budgets.get(name, 10**6)
+            error = ""
+            try:
+                with assert_max_queries(budget) as cap:
+                    r = await call()
+                    r.raise_for_status()
+            except AssertionError as e:
+                error = str(e).splitlines()[0]
+                failed.append(name)
+            repeated = cap.repeated()
+            rows = {
+                "queries": cap.count,
+                "budget": budget,
+                "db_ms": cap.total_ms,
+                "slowest_ms": cap.slowest_ms,
+                "status": "FAIL" if error else "ok",
+            }
+            for i, (sql, n) in enumerate(repeated.items()):
+                rows[f"repeated_{i + 1}"] = f"{n}x {statement_shape(sql)[:100]}"
+            print_table(f"{name}: {args.chats} chats, {args.messages} messages", rows)
+
+    print(f"\nover budget / N+1: {', '.join(failed) or 'none'}")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--chats", type=int, default=20)
+    ap.add_argument("--messages", type=int, default=50)
+    ap.add_argument("--budget", action="append", default=[], metavar="NAME=N", help=f"из {', '.join(BUDGETS)}")
+    ap.add_argument("--only", nargs="*", default=[], choices=list(BUDGETS))
+    sys.exit(asyncio.run(main(ap.parse_args())))
@@ -0,0 +1,233 @@
+# bench/bench_sqlite_writes.py
+"""
+Конкурентные записи в SQLite: профиль по умолчанию против WAL + pragmas и
+против WAL + единственного писателя (backend_app/sqlite_writer.py).
+
+    python -m bench.bench_sqlite_writes --writers 40 --readers 20 --seconds 5
+
+Две части, каждый профиль — отдельный процесс со свежей БД
+(journal_mode=WAL сохраняется в файле):
+
+  raw  — --raw-threads потоков пишут напрямую (сообщение + read state,
+         транзакция на запись; с писателем — через него): чистая конкуренция
+         за блокировку записи, без HTTP;
+  http — --writers корутин без пауз шлют сообщения и отмечают прочитанное
+         (send + mark_read, каждое ещё и пишет rate limit в БД), --readers
+         корутин читают историю. Всё в одном процессе, так что здесь заметнее
+         CPU самого приложения.
+
+Печатает транзакции/запросы в секунду, латентности и ошибки
+("database is locked", таймаут пула и т.п.).
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import subprocess
+import sys
+
+PROFILES = {
+    "default": {"sqlite_tuning": "false", "sqlite_single_writer": "false"},
+    "wal": {"sqlite_tuning": "true", "sqlite_single_writer": "false"},
+    "wal+writer": {"sqlite_tuning": "true", "sqlite_single_writer": "true"},
+}
+
+
+def run_raw(args, chat_id: int, a: int, b: int) -> None:
+    import threading
+    import time
+    from datetime import datetime
+
+    from bench._util import percentile, print_table
+    from backend_app import models
+    from backend_app.db import SessionLocal
+    from backend_app.sqlite_writer import get_writer
+
+    w = get_writer()
+    lat: list[float] = []
+    errors: dict[str, int] = {}
+    lock = threading.Lock()
+
+    def write(s) -> None:
+        msg = models.Message(chat_id=chat_id, sender_id=a, text="raw")
+        s.add(msg)
+        s.flush()
+        row = s.query(models.DMRead).filter_by(chat_id=chat_id, user_id=b).first()
+        if not row:
+            row = models.DMRead(chat_id=chat_id, user_id=b)
+            s.add(row)
+        row.last_read_message_id = msg.id
+        row.updated_at = datetime.utcnow()
+
+    def worker() -> None:
+        for _ in range(args.raw_writes):
+            t0 = time.perf_counter()
+            try:
+                if w is not None:
+                    w.submit(write).result()
+                else:
+                    db = SessionLocal()
+                    try:
+                        write(db)
+                        db.commit()
+                    finally:
+                        db.close()
+            except Exception as e:
+                with lock:
+                    errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            with lock:
+                lat.append(time.perf_counter() - t0)
+
+    threads = [threading.Thread(target=worker) for _ in range(args.raw_threads)]
+    t0 = time.perf_counter()
+    for th in threads:
+        th.start()
+    for th in threads:
+        th.join()
+    wall = time.perf_counter() - t0
+
+    print_table(
+        f"{args.child} raw: {args.raw_threads} threads × {args.raw_writes} write transactions",
+        {
+            "tx_per_sec": len(lat) / wall,
+            "tx_p50_ms": percentile(lat, 50) * 1000,
+            "tx_p99_ms": percentile(lat, 99) * 1000,
+            "tx_max_ms": max(lat, default=0.0) * 1000,
+            "errors": sum(errors.values()),
+            **{f"err_{k}": v for k, v in sorted(errors.items())},
+        },
+    )
+
+
+async def run(args) -> None:
+    import asyncio
+    import time
+
+    from bench._util import LoopLagMonitor, make_client, percentile, print_table, register
+    from backend_app.sqlite_writer import get_writer, stop_writer
+
+    async with make_client() as client:
+        pairs = []
+        raw_ids = (0, 0, 0)
+        for i in range(max(1, args.writers // 2)):
+            uid, h = await register(client, f"w{i}a")
+            oid, oh = await register(client, f"w{i}b")
+            chat = (await client.post("/chats/dm/start", json={"other_user_id": oid}, headers=h)).json()["chat_id"]
+            pairs.append((chat, h, oh))
+            if i == 0:
+                raw_ids = (chat, uid, oid)
+
+        if args.raw_threads:
+            await asyncio.to_thread(run_raw, args, *raw_ids)
+        if not (args.writers or args.readers):
+            stop_writer()
+            return
+
+        w_lat: list[float] = []
+        r_lat: list[float] = []
+        errors: dict[str, int] = {}
+        stop_at = time.perf_counter() + args.seconds
+
+        def fail(kind: str) -> None:
+            errors[kind] = errors.get(kind, 0) + 1
+
+        async def writer(n: int) -> None:
+            chat, h, oh = pairs[n % len(pairs)]
+            me, other = (h, oh) if n % 2 == 0 else (oh, h)
+            while time.perf_counter() < stop_at:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.post(f"/chats/dm/{chat}/send", json={"text": f"hello {n}"}, headers=me)
+                    if r.status_code != 200:
+                        fail(f"send_{r.status_code}")
+                        continue
+                    r = await client.post(
+                        f"/chats/dm/{chat}/read", json={"last_read_message_id": r.json()["id"]}, headers=other
+                    )
+                    if r.status_code != 200:
+                        fail(f"read_{r.status_code}")
+                        continue
+                except Exception as e:
+                    fail(type(e).__name__)
+                    continue
+                w_lat.append(time.perf_counter() - t0)
+
+        async def reader(n: int) -> None:
+            chat, h, _ = pairs[n % len(pairs)]
+            while time.perf_counter() < stop_at:
+                t0 = time.perf_counter()
+                try:
+                    r = await client.get(f"/chats/dm/{chat}/messages", params={"limit": 50}, headers=h)
+                    if r.status_code != 200:
+                        fail(f"history_{r.status_code}")
+                        continue
+                except Exception as e:
+                    fail(type(e).__name__)
+                    continue
+                r_lat.append(time.perf_counter() - t0)
+
+        lag = LoopLagMonitor().start()
+        t0 = time.perf_counter()
+        await asyncio.gather(*(writer(i) for i in range(args.writers)), *(reader(i) for i in range(args.readers)))
+        wall = time.perf_counter() - t0
+        await lag.stop()
+
+        w = get_writer()
+        writer_stats = dict(w.stats) if w is not None else {}
+        stop_writer()
+
+    print_table(
+        f"{args.child} http: {args.writers} writers + {args.readers} readers, {args.seconds:.0f}s",
+        {
+            # одна итерация писателя = send + mark_read
+            "writes_per_sec": 2 * len(w_lat) / wall,
+            "reads_per_sec": len(r_lat) / wall,
+            "write_p50_ms": percentile(w_lat, 50) * 1000,
+            "write_p99_ms": percentile(w_lat, 99) * 1000,
+            "read_p50_ms": percentile(r_lat, 50) * 1000,
+            "read_p99_ms": percentile(r_lat, 99) * 1000,
+            "errors": sum(errors.values()),
+            **{f"err_{k}": v for k, v in sorted(errors.items())},
+            **{f"writer_{k}": v for k, v in writer_stats.items()},
+            **lag.summary(),
+        },
+    )
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--writers", type=int, default=40)
+    ap.add_argument("--readers", type=int, default=20)
+    ap.add_argument("--seconds", type=float, default=5.0)
+    ap.add_argument("--raw-threads", type=int, default=32)
+    ap.add_argument("--raw-writes", type=int, default=50, help="транзакций на поток")
+    ap.add_argument("--profiles", nargs="+", choices=list(PROFILES), default=list(PROFILES))
+    ap.add_argument("--child", choices=list(PROFILES), help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        import asyncio
+
+        asyncio.run(run(args))
+        return
+
+    for profile in args.profiles:
+        env = {
+            **os.environ,
+            **PROFILES[profile],
+            # лимиты оставляем включёнными (они тоже пишут в БД), но не упираемся в них
+            "rate_limit_send": "1000000/second;burst=1000000",
+            "rate_limit_register": "1000000/second;burst=1000000",
+        }
+        env.pop("BENCH_KEEP_DATABASE_URL", None)
+        cmd = [
+            sys.executable, "-m", "bench.bench_sqlite_writes", "--child", profile,
+            "--writers", str(args.writers), "--readers", str(args.readers), "--seconds", str(args.seconds),
+            "--raw-threads", str(args.raw_threads), "--raw-writes", str(args.raw_writes),
+        ]
+        subprocess.run(cmd, env=env, check=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# bench/fake_push_service.py
+"""
+Локальный эмулятор push-сервиса (как FCM / Mozilla autopush) для нагрузочных тестов.
+
+    python -m bench.fake_push_service --port 8902 --latency-ms 30 --gone-rate 0.05 --rate-limit-rate 0.01
+
+Принимает POST /push/<token> с телом aes128gcm и отвечает 201. Умеет:
+- проверять заголовки (Content-Encoding: aes128gcm, Authorization: vapid …, TTL);
+- расшифровывать тело, если для <token> зарегистрирован ключ подписчика
+  (FakePushConfig.keys) — так бенчмарк убеждается, что payload валиден;
+- добавлять задержку (±jitter), 404/410 (случайно или для заданных stale
+  токенов) и 429 с Retry-After.
+
+Из кода (сервер в отдельном потоке со своим loop, чтобы не мешать замерам лага):
+    with serve_fake_push(cfg, stats) as base_url: ...
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import contextlib
+import json
+import os
+import random
+import socket
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any
+
+import http_ece
+import uvicorn
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.routing import Route
+
+
+@dataclass
+class FakePushConfig:
+    latency_ms: float = 30.0
+    jitter_ms: float = 10.0
+    gone_rate: float = 0.0  # случайные 410
+    not_found_rate: float = 0.0  # случайные 404
+    rate_limit_rate: float = 0.0  # случайные 429
+    retry_after_s: int = 1
+    decrypt: bool = True
+    seed: int | None = None
+    # token -> (приватный ключ подписчика, auth secret) для расшифровки
+    keys: dict[str, tuple[ec.EllipticCurvePrivateKey, bytes]] = field(default_factory=dict)
+    # эти токены всегда отвечают 410 (протухшие подписки)
+    stale: set[str] = field(default_factory=set)
+
+
+@dataclass
+class FakePushStats:
+    received: int = 0
+    accepted: int = 0
+    gone: int = 0
+    not_found: int = 0
+    rate_limited: int = 0
+    bad_request: int = 0  # нет нужных заголовков / не расшифровалось
+    decrypted: int = 0
+    by_token: dict[str, int] = field(default_factory=dict)
+    last_payload: dict[str, Any] | None = None
+
+
+def b64url(b: bytes) -> str:
+    return base64.urlsafe_b64encode(b).rstrip(b"=").decode()
+
+
+def make_subscriber_key() -> tuple[ec.EllipticCurvePrivateKey, bytes, str, str]:
+    """Ключи «браузера»: (private key, auth secret, p256dh b64url, auth b64url)."""
+    priv = ec.generate_private_key(ec.SECP256R1())
+    auth = os.urandom(16)
+    raw = priv.public_key().public_bytes(serialization.Encoding.X962, serialization.PublicFormat.UncompressedPoint)
+    return priv, auth, b64url(raw), b64url(auth)
+
+
+def build_app(cfg: FakePushConfig, stats: FakePushStats | None = None) -> Starlette:
+    rnd = random.Random(cfg.seed)
+    stats = stats if stats is not None else FakePushStats()
+
+    async def push(request: Request):
+        token = request.path_params["token"]
+        body = await request.body()
+        stats.received += 1
+        stats.by_token[token] = stats.by_token.get(token, 0) + 1
+
+        delay = cfg.latency_ms + (rnd.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        h = request.headers
+        if (
+            h.get("content-encoding", "").lower() != "aes128gcm"
+            or not h.get("authorization", "").startswith("vapid ")
+            or "ttl" not in h
+        ):
+            stats.bad_request += 1
+            return Response(b"missing push headers", status_code=400)
+
+        if token in cfg.stale:
+            stats.gone += 1
+            return Response(b"push subscription has unsubscribed or expired", status_code=410)
+
+        roll = rnd.random()
+        if roll < cfg.rate_limit_rate:
+            stats.rate_limited += 1
+            return Response(b"too many requests", status_code=429, headers={"Retry-After": str(cfg.retry_after_s)})
+        roll -= cfg.rate_limit_rate
+        if roll < cfg.gone_rate:
+            stats.gone += 1
+            return Response(b"gone", status_code=410)
+        roll -= cfg.gone_rate
+        if roll < cfg.not_found_rate:
+            stats.not_found += 1
+            return Response(b"not found", status_code=404)
+
+        if cfg.decrypt and token in cfg.keys:
+            priv, auth = cfg.keys[token]
+            try:
+                plain = http_ece.decrypt(body, private_key=priv, auth_secret=auth, version="aes128gcm")
+                stats.last_payload = json.loads(plain)
+                stats.decrypted += 1
+            except Exception:
+                stats.bad_request += 1
+                return Response(b"decryption failed", status_code=400)
+
+        stats.accepted += 1
+        return Response(status_code=201, headers={"Location": f"/m/{stats.accepted}"})
+
+    app = Starlette(routes=[Route("/push/{token}", push, methods=["POST"])])
+    app.state.cfg = cfg
+    app.state.stats = stats
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.contextmanager
+def serve_fake_push(cfg: FakePushConfig | None = None, stats: FakePushStats | None = None, port: int | None = None):
+    """Поднимает эмулятор в отдельном потоке; отдаёт base URL вида http://127.0.0.1:PORT."""
+    cfg = cfg or FakePushConfig()
+    port = port or _free_port()
+    server = uvicorn.Server(
+        uvicorn.Config(build_app(cfg, stats), host="127.0.0.1", port=port, log_level="warning", backlog=4096)
+    )
+    th = threading.Thread(target=server.run, daemon=True)
+    th.start()
+    while not server.started:
+        time.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        th.join(timeout=5)
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8902)
+    ap.add_argument("--latency-ms", type=float, default=30.0)
+    ap.add_argument("--jitter-ms", type=float, default=10.0)
+    ap.add_argument("--gone-rate", type=float, default=0.0)
+    ap.add_argument("--not-found-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=None)
+    a = ap.parse_args()
+    cfg = FakePushConfig(
+        latency_ms=a.latency_ms,
+        jitter_ms=a.jitter_ms,
+        gone_rate=a.gone_rate,
+        not_found_rate=a.not_found_rate,
+        rate_limit_rate=a.rate_limit_rate,
+        retry_after_s=a.retry_after,
+        decrypt=False,  # ключей подписчиков у отдельного процесса нет
+        seed=a.seed,
+    )
+    uvicorn.run(build_app(cfg), host="127.0.0.1", port=a.port)
@@ -0,0 +1,148 @@
+# bench/mock_upstream.py
+"""
+Локальный мок OpenAI /v1/responses для бенчмарков ассистента.
+
+    python -m bench.mock_upstream --port 8901 --latency-ms 50 --jitter-ms 20 \
+        --error-rate 0.01 --rate-limit-rate 0.05 --retry-after 1
+
+Бэкенд на мок: OPENAI_BASE_URL=http://127.0.0.1:8901/v1 OPENAI_API_KEY=mock
+Из кода: `async with serve_mock(latency_ms=50) as base_url: ...`
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import random
+import socket
+from dataclasses import dataclass
+
+import uvicorn
+from starlette.applications import Starlette
+from starlette.requests import ClientDisconnect, Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 50.0
+    # равномерный разброс ±jitter_ms вокруг latency_ms
+    jitter_ms: float = 0.0
+    # для stream=true: пауза между дельтами
+    token_interval_ms: float = 20.0
+    text: str = "Звучит отлично, давай завтра в семь!"
+    # доля ответов 500 / 429 (0..1); на 429 ставим Retry-After
+    error_rate: float = 0.0
+    rate_limit_rate: float = 0.0
+    retry_after_s: int = 1
+    seed: int | None = None
+
+
+@dataclass
+class MockStats:
+    requests: int = 0
+    streamed: int = 0
+    errors: int = 0
+    rate_limited: int = 0
+
+
+def build_app(cfg: MockConfig, stats: MockStats | None = None) -> Starlette:
+    rnd = random.Random(cfg.seed)
+    stats = stats if stats is not None else MockStats()
+
+    async def stream_events():
+        words = cfg.text.split(" ")
+        for i, w in enumerate(words):
+            if i:
+                await asyncio.sleep(cfg.token_interval_ms / 1000)
+            delta = w if i == 0 else " " + w
+            ev = {"type": "response.output_text.delta", "delta": delta}
+            yield f"event: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+        ev = {"type": "response.completed", "response": {"output_text": cfg.text}}
+        yield f"event: {ev['type']}\ndata: {json.dumps(ev, ensure_ascii=False)}\n\n"
+
+    async def responses(request: Request):
+        try:
+            body = await request.json()
+        except ClientDisconnect:
+            # бэкенд отменил запрос (latest-wins) ещё до конца тела
+            return Response(status_code=499)
+        stats.requests += 1
+        delay = cfg.latency_ms + (rnd.uniform(-cfg.jitter_ms, cfg.jitter_ms) if cfg.jitter_ms else 0.0)
+        if delay > 0:
+            await asyncio.sleep(delay / 1000)
+
+        roll = rnd.random()
+        if roll < cfg.rate_limit_rate:
+            stats.rate_limited += 1
+            return JSONResponse(
+                {"error": {"message": "Rate limit reached (mock)", "type": "rate_limit_exceeded"}},
+                status_code=429,
+                headers={"Retry-After": str(cfg.retry_after_s)},
+            )
+        if roll < cfg.rate_limit_rate + cfg.error_rate:
+            stats.errors += 1
+            return JSONResponse({"error": {"message": "Upstream failure (mock)", "type": "server_error"}}, status_code=500)
+
+        if body.get("stream"):
+            stats.streamed += 1
+            return StreamingResponse(stream_events(), media_type="text/event-stream")
+        return JSONResponse({"output_text": cfg.text})
+
+    app = Starlette(routes=[Route("/v1/responses", responses, methods=["POST"])])
+    app.state.cfg = cfg
+    app.state.stats = stats
+    return app
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextlib.asynccontextmanager
+async def serve_mock(
+    cfg: MockConfig | None = None, port: int | None = None, stats: MockStats | None = None, **kw
+):
+    """Поднимает мок в текущем event loop; отдаёт base URL вида http://127.0.0.1:PORT.
+
+    Счётчики мока пишутся в переданный `stats`.
+    """
+    cfg = cfg or MockConfig(**kw)
+    port = port or _free_port()
+    app = build_app(cfg, stats)
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        server.should_exit = True
+        await task
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--port", type=int, default=8901)
+    ap.add_argument("--latency-ms", type=float, default=50.0)
+    ap.add_argument("--jitter-ms", type=float, default=0.0)
+    ap.add_argument("--token-interval-ms", type=float, default=20.0)
+    ap.add_argument("--error-rate", type=float, default=0.0)
+    ap.add_argument("--rate-limit-rate", type=float, default=0.0)
+    ap.add_argument("--retry-after", type=int, default=1)
+    ap.add_argument("--seed", type=int, default=None)
+    a = ap.parse_args()
+    cfg = MockConfig(
+        latency_ms=a.latency_ms,
+        jitter_ms=a.jitter_ms,
+        token_interval_ms=a.token_interval_ms,
+        error_rate=a.error_rate,
+        rate_limit_rate=a.rate_limit_rate,
+        retry_after_s=a.retry_after,
+        seed=a.seed,
+    )
+    uvicorn.run(build_app(cfg), host="127.0.0.1", port=a.port)